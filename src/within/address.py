@@ -1,11 +1,32 @@
 # Parsing address input
+import json
 import os
-from typing import Optional, Tuple
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
 from openai import OpenAI
 from pydantic import BaseModel
 
-from within.nominatim import coords_from_addresses
+from within.cache import SQLiteCache
+from within.nominatim import (
+    DEFAULT_CONCURRENCY,
+    bulk_coords_from_addresses,
+    coords_from_addresses,
+    normalize_query,
+)
+
+# Persistent cache of OpenAI answers keyed by request kind, model and description
+OPENAI_CACHE_DB_PATH = Path(__file__).parent / "openai_cache.sqlite3"
+USE_OPENAI_CACHE = True
+# Max addresses sanitized in a single prompt by Address.sanitize_addresses
+OPENAI_BATCH_SIZE = 50
+
+_openai_client: Optional[OpenAI] = None
+_openai_client_lock = threading.Lock()
+_openai_cache: Optional[SQLiteCache] = None
+_openai_cache_lock = threading.Lock()
 
 
 class GeographicLocation(BaseModel):
@@ -13,6 +34,38 @@ class GeographicLocation(BaseModel):
     latitude: float
 
 
+class SanitizedAddresses(BaseModel):
+    addresses: List[str]
+
+
+def _get_openai_client() -> OpenAI:
+    """OpenAI client shared by all requests so its connection pool is reused"""
+    global _openai_client
+    if not os.getenv("OPENAI_API_KEY"):
+        raise Exception(
+            "You need to set the OPENAI_API_KEY environment variable for "
+            "parsing address input with OpenAI"
+        )
+    with _openai_client_lock:
+        if _openai_client is None:
+            _openai_client = OpenAI()
+        return _openai_client
+
+
+def _get_openai_cache() -> SQLiteCache:
+    global _openai_cache
+    with _openai_cache_lock:
+        if _openai_cache is None or _openai_cache.path != OPENAI_CACHE_DB_PATH:
+            if _openai_cache is not None:
+                _openai_cache.close()
+            _openai_cache = SQLiteCache(OPENAI_CACHE_DB_PATH)
+        return _openai_cache
+
+
+def _openai_cache_key(kind: str, model: str, location_description: str) -> str:
+    return json.dumps([kind, model, normalize_query(location_description)])
+
+
 class Address:
     MODEL = "gpt-4o-mini"
     location_description: str
@@ -72,12 +125,14 @@ class Address:
         self.parse_location_description_with_OpenAI()
 
     def _sanitize_address_with_OpenAI(self) -> str:
-        if not os.getenv("OPENAI_API_KEY"):
-            raise Exception(
-                "You need to set the OPENAI_API_KEY environment variable for "
-                "parsing address input with OpenAI"
-            )
-        client = OpenAI()
+        cache_key = _openai_cache_key(
+            "sanitized_address", self.MODEL, self.location_description
+        )
+        if USE_OPENAI_CACHE:
+            cached_address: Optional[str] = _get_openai_cache().get(cache_key)
+            if cached_address is not None:
+                return cached_address
+        client = _get_openai_client()
         response = client.beta.chat.completions.parse(
             messages=[
                 {
@@ -95,15 +150,25 @@ class Address:
             ],
             model=self.MODEL,
         )
-        return response.choices[0].message.content or "FAILED TO SANITIZE ADDRESS"
+        sanitized_address = response.choices[0].message.content
+        if not sanitized_address:
+            return "FAILED TO SANITIZE ADDRESS"
+        if USE_OPENAI_CACHE:
+            _get_openai_cache().set(cache_key, sanitized_address)
+        return sanitized_address
 
     def parse_location_description_with_OpenAI(self) -> None:
-        if not os.getenv("OPENAI_API_KEY"):
-            raise Exception(
-                "You need to set the OPENAI_API_KEY environment variable for "
-                "parsing address input with OpenAI"
+        cache_key = _openai_cache_key(
+            "coordinates", self.MODEL, self.location_description
+        )
+        if USE_OPENAI_CACHE:
+            cached_location: Optional[Dict[str, float]] = _get_openai_cache().get(
+                cache_key
             )
-        client = OpenAI()
+            if cached_location is not None:
+                self._parsed_location = GeographicLocation(**cached_location)
+                return
+        client = _get_openai_client()
         response = client.beta.chat.completions.parse(
             messages=[
                 {
@@ -122,3 +187,127 @@ class Address:
             response_format=GeographicLocation,
         )
         self._parsed_location = response.choices[0].message.parsed
+        if USE_OPENAI_CACHE and self._parsed_location is not None:
+            _get_openai_cache().set(cache_key, self._parsed_location.model_dump())
+
+    @classmethod
+    def sanitize_addresses(cls, addresses: List["Address"]) -> None:
+        """
+        Sanitize many addresses with one OpenAI prompt per OPENAI_BATCH_SIZE
+        addresses rather than one per address. Cached answers are reused.
+        """
+        pending: Dict[str, List[Address]] = {}
+        for address in addresses:
+            if address._sanitized_address is not None:
+                continue
+            cache_key = _openai_cache_key(
+                "sanitized_address", cls.MODEL, address.location_description
+            )
+            cached_address = (
+                _get_openai_cache().get(cache_key) if USE_OPENAI_CACHE else None
+            )
+            if cached_address is not None:
+                address._sanitized_address = cached_address
+            else:
+                pending.setdefault(address.location_description, []).append(address)
+
+        descriptions = list(pending)
+        for start in range(0, len(descriptions), OPENAI_BATCH_SIZE):
+            batch = descriptions[start : start + OPENAI_BATCH_SIZE]
+            sanitized = cls._sanitize_batch_with_OpenAI(batch)
+            for description, sanitized_address in zip(batch, sanitized):
+                for address in pending[description]:
+                    address._sanitized_address = sanitized_address
+
+    @classmethod
+    def _sanitize_batch_with_OpenAI(cls, descriptions: List[str]) -> List[str]:
+        if len(descriptions) == 1:
+            return [cls(descriptions[0])._sanitize_address_with_OpenAI()]
+        client = _get_openai_client()
+        numbered = "\n".join(
+            f"{idx}. {description}" for idx, description in enumerate(descriptions, 1)
+        )
+        response = client.beta.chat.completions.parse(
+            messages=[
+                {
+                    "role": "developer",
+                    "content": "You are an expert on geographical locations",
+                },
+                {
+                    "role": "user",
+                    "content": (
+                        "What are the mailing addresses of these locations:\n"
+                        f"{numbered}\n"
+                        "Answer precisely with just one address per location, "
+                        "in the same order."
+                    ),
+                },
+            ],
+            model=cls.MODEL,
+            response_format=SanitizedAddresses,
+        )
+        parsed = response.choices[0].message.parsed
+        if parsed is None or len(parsed.addresses) != len(descriptions):
+            # The model did not answer one to one. Fall back to single requests.
+            return [
+                cls(description)._sanitize_address_with_OpenAI()
+                for description in descriptions
+            ]
+        if USE_OPENAI_CACHE:
+            cache = _get_openai_cache()
+            for description, sanitized_address in zip(descriptions, parsed.addresses):
+                cache.set(
+                    _openai_cache_key("sanitized_address", cls.MODEL, description),
+                    sanitized_address,
+                )
+        return parsed.addresses
+
+
+def _apply_coords(
+    addresses: List[Address], coords: List[Optional[Tuple[float, float]]]
+) -> List[Address]:
+    """Set resolved coordinates and return the addresses still unresolved"""
+    unresolved: List[Address] = []
+    for address, coord in zip(addresses, coords):
+        if coord is None:
+            unresolved.append(address)
+        else:
+            address._parsed_location = GeographicLocation(
+                latitude=coord[0], longitude=coord[1]
+            )
+    return unresolved
+
+
+def resolve_addresses(
+    addresses: List[Address], max_concurrency: int = DEFAULT_CONCURRENCY
+) -> None:
+    """
+    Resolve the coordinates of a group of addresses together. Each step of the
+    fallback chain of Address.parse_location_description runs once for the
+    whole group: a batched Nominatim pass, one batched OpenAI sanitizing
+    prompt, a second Nominatim pass and finally concurrent OpenAI lookups.
+    """
+    pending = [address for address in addresses if address._parsed_location is None]
+    if not pending:
+        return
+    pending = _apply_coords(
+        pending,
+        bulk_coords_from_addresses(
+            [address.location_description for address in pending], max_concurrency
+        ),
+    )
+    if not pending:
+        return
+    # Retry with sanitized addresses
+    Address.sanitize_addresses(pending)
+    pending = _apply_coords(
+        pending,
+        bulk_coords_from_addresses(
+            [address.sanitized_address for address in pending], max_concurrency
+        ),
+    )
+    if not pending:
+        return
+    # Nominatim parsing failed. Try OpenAI as fallback
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        list(executor.map(Address.parse_location_description_with_OpenAI, pending))
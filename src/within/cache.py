@@ -0,0 +1,265 @@
+# Caching helpers shared by the geocoding and address parsing layers
+
+import json
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from time import monotonic, time
+from typing import Any, Callable, Dict, Generic, Optional, Tuple, TypeVar
+
+from typing_extensions import TypedDict
+
+V = TypeVar("V")
+R = TypeVar("R")
+
+
+class SQLiteCache:
+    """
+    Persistent key/value store backed by a single SQLite table in WAL mode.
+    Values are stored as JSON. Lookups go through the primary key index and
+    inserts are single row upserts, so neither depends on the size of the cache.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit mode: every upsert is its own (cheap, WAL appended) transaction
+        self._connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            row = self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()
+        return int(row[0])
+
+    def get(self, key: str) -> Optional[Any]:
+        """Cached value for key or None if missing or expired"""
+        entry = self.get_with_ttl(key)
+        return None if entry is None else entry[0]
+
+    def get_with_ttl(self, key: str) -> Optional[Tuple[Any, Optional[float]]]:
+        """
+        (cached value, seconds until it expires or None if it never does) for
+        key, or None if missing or expired
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        ttl_s = None if expires_at is None else expires_at - time()
+        if ttl_s is not None and ttl_s <= 0:
+            return None
+        return json.loads(value), ttl_s
+
+    def set(self, key: str, value: Any, ttl_s: Optional[float] = None) -> None:
+        expires_at = None if ttl_s is None else time() + ttl_s
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def migrate_from_json(
+        self,
+        json_path: Path,
+        key_func: Callable[[str], str] = str,
+        ttl_func: Callable[[Any], Optional[float]] = lambda value: None,
+    ) -> int:
+        """
+        One-time import of a legacy cache file holding a single JSON object.
+        Keys are mapped through `key_func` and entries already in the store are
+        kept. Imported values expire after `ttl_func(value)` seconds (never if
+        None). Of legacy entries mapped to the same key, the one kept longest
+        wins. Returns the number of entries read.
+        """
+        if not json_path.exists():
+            return 0
+        marker = f"migrated_from:{json_path.resolve()}"
+        with self._lock:
+            if self._connection.execute(
+                "SELECT 1 FROM meta WHERE key = ?", (marker,)
+            ).fetchone():
+                return 0
+        with json_path.open("r") as fh:
+            legacy_data: Dict[str, Any] = json.load(fh)
+        now = time()
+        # key -> (value, expires_at)
+        entries: Dict[str, Tuple[Any, Optional[float]]] = {}
+        for legacy_key, value in legacy_data.items():
+            key = key_func(legacy_key)
+            ttl_s = ttl_func(value)
+            expires_at = None if ttl_s is None else now + ttl_s
+            previous = entries.get(key)
+            if previous is None or (
+                previous[1] is not None
+                and (expires_at is None or expires_at > previous[1])
+            ):
+                entries[key] = (value, expires_at)
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO cache (key, value, expires_at) "
+                "VALUES (?, ?, ?)",
+                (
+                    (key, json.dumps(value), expires_at)
+                    for key, (value, expires_at) in entries.items()
+                ),
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (marker, str(now)),
+            )
+            self._connection.execute("COMMIT")
+        return len(legacy_data)
+
+
+class CacheStatsT(TypedDict):
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    size_bytes: int
+
+
+class LRUCache(Generic[V]):
+    """
+    Thread-safe, bounded in-memory least-recently-used cache.
+    Bounded by entry count and/or an approximate byte budget given by `sizeof`.
+    Entries optionally expire after `ttl_s` seconds.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = 1024,
+        max_bytes: Optional[int] = None,
+        ttl_s: Optional[float] = None,
+        sizeof: Callable[[V], int] = sys.getsizeof,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._sizeof = sizeof
+        self._lock = threading.Lock()
+        # key -> (value, expires_at, size in bytes)
+        self._entries: OrderedDict[str, Tuple[V, Optional[float], int]] = OrderedDict()
+        self._size_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            value, expires_at, size = entry
+            if expires_at is not None and expires_at <= monotonic():
+                del self._entries[key]
+                self._size_bytes -= size
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key: str, value: V, ttl_s: Optional[float] = None) -> None:
+        """Insert or replace key. `ttl_s` overrides the cache wide TTL."""
+        ttl_s = self.ttl_s if ttl_s is None else ttl_s
+        expires_at = None if ttl_s is None else monotonic() + ttl_s
+        size = self._sizeof(value)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size_bytes -= previous[2]
+            self._entries[key] = (value, expires_at, size)
+            self._size_bytes += size
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+
+    def stats(self) -> CacheStatsT:
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "entries": len(self._entries),
+                "size_bytes": self._size_bytes,
+            }
+
+    def _evict(self) -> None:
+        # Caller must hold self._lock
+        while self._entries and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+            or (self.max_bytes is not None and self._size_bytes > self.max_bytes)
+        ):
+            _, (_, _, size) = self._entries.popitem(last=False)
+            self._size_bytes -= size
+            self._evictions += 1
+
+
+class SingleFlight(Generic[R]):
+    """
+    Coalesces concurrent calls for the same key. The first caller runs the
+    function while later callers wait for it and share its result or exception.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future[R]] = {}
+
+    def __len__(self) -> int:
+        """Number of calls currently in flight"""
+        return len(self._calls)
+
+    def do(self, key: str, fn: Callable[[], R]) -> R:
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if future is None:
+                future = self._calls[key] = Future()
+        if not is_leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
@@ -2,10 +2,14 @@
 
 
 import argparse
-from typing import cast
+from math import isnan
+from pathlib import Path
+from typing import Optional, cast
 
-from within.address import Address
-from within.routing import POSSIBLE_TRANSPORTATION_MODES, Route, Routing, TransportModeT
+from within.address import Address, resolve_addresses
+from within.compact_graph import POSSIBLE_WEIGHTS, WeightT
+from within.network import POSSIBLE_TRANSPORTATION_MODES, TransportModeT
+from within.routing import Route, Routing
 
 try:
     import plotly.express as px
@@ -21,6 +25,9 @@ class ArgNamespaceT(argparse.Namespace):
     transport_mode: TransportModeT
     num_suggestions: int
     show_map: bool
+    snapshot: Optional[Path]
+    save_snapshot: Optional[Path]
+    optimize: WeightT
 
 
 def get_args() -> ArgNamespaceT:
@@ -36,9 +43,25 @@ def get_args() -> ArgNamespaceT:
         help="Mode of transpotation",
     )
     parser.add_argument("--num-suggestions", type=int, default=1)
+    parser.add_argument(
+        "--optimize",
+        choices=POSSIBLE_WEIGHTS,
+        default="length",
+        help="Minimize route length or travel time",
+    )
     parser.add_argument(
         "--show-map", action="store_true", help="Visualize route on map"
     )
+    parser.add_argument(
+        "--snapshot",
+        type=Path,
+        help="Street network snapshot to route on instead of downloading",
+    )
+    parser.add_argument(
+        "--save-snapshot",
+        type=Path,
+        help="Save the street network as a snapshot for later --snapshot runs",
+    )
     return cast(ArgNamespaceT, parser.parse_args())
 
 
@@ -54,6 +77,7 @@ def main() -> None:
     if args.show_map and px is None:
         print("For map visualization support run `pip install within[map]`")
         raise SystemExit(-1)
+    resolve_addresses([args.start, args.destination])
     print(
         f"{args.start.location_description}: {args.start.latitude}, {args.start.longitude}"
     )
@@ -61,10 +85,21 @@ def main() -> None:
         f"{args.destination.location_description}: {args.destination.latitude}, {args.destination.longitude}"
     )
     print()
-    routing = Routing(args.start, args.destination, args.transport_mode)
+    routing = Routing(
+        args.start,
+        args.destination,
+        args.transport_mode,
+        snapshot=args.snapshot,
+        weight_by=args.optimize,
+    )
     routes = routing.shortest_routes(args.num_suggestions)
+    if args.save_snapshot is not None:
+        routing.street_network.save_snapshot(args.save_snapshot)
     for route in routes:
         print("\n".join(route.description))
-        print(f"Total route length: {route.total_length_m / 1000:.1f} km\n\n")
+        print(f"Total route length: {route.total_length_m / 1000:.1f} km")
+        if not isnan(route.total_travel_time_s):
+            print(f"Estimated travel time: {route.total_travel_time_s / 60:.0f} min")
+        print("\n")
         if args.show_map:
             show_map(route, ZOOM_LEVEL)
@@ -0,0 +1,413 @@
+# Compact array backed street graph used for route searches
+
+import hashlib
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Literal, Optional, Sequence, Tuple, cast
+
+import numpy as np
+from networkx import MultiDiGraph
+from numpy.typing import ArrayLike, NDArray
+
+WeightT = Literal["length", "travel_time"]
+POSSIBLE_WEIGHTS: List[WeightT] = ["length", "travel_time"]
+AdjacencyT = Tuple[Sequence[int], Sequence[int], Sequence[float]]
+# (offsets, source nodes, edge indices) of incoming edges grouped by target node
+ReverseAdjacencyT = Tuple[Sequence[int], Sequence[int], Sequence[int]]
+# (u, v, key) of an edge in the osmnx graph, by OSM node ids
+EdgeKeyT = Tuple[int, int, int]
+# (south, west, north, east) in degrees
+BoundsT = Tuple[float, float, float, float]
+
+UNNAMED = -1  # name_ids value for edges without a street name
+# Bumped whenever the snapshot layout changes so old snapshots are rejected
+SNAPSHOT_VERSION = 2
+SNAPSHOT_ARRAYS = (
+    "node_ids",
+    "latitudes",
+    "longitudes",
+    "offsets",
+    "targets",
+    "edge_keys",
+    "lengths",
+    "travel_times",
+    "name_ids",
+    "geometry_offsets",
+    "geometry_latitudes",
+    "geometry_longitudes",
+)
+
+
+class CompactGraph:
+    """
+    Street graph in compressed sparse row (CSR) form. Nodes are numbered
+    0..num_nodes-1 in order of their OSM id and the outgoing edges of node i
+    are edges offsets[i]..offsets[i+1]-1, with per edge attributes held in
+    flat NumPy arrays and street names interned in a string table. This takes
+    a fraction of the memory of a networkx MultiDiGraph and is what route
+    searches run on.
+
+    Edges simplified by osmnx follow a curved geometry rather than the
+    straight line between their nodes. The vertices in between are kept in
+    geometry_latitudes/longitudes, those of edge i being
+    geometry_offsets[i]..geometry_offsets[i+1]-1.
+    """
+
+    def __init__(
+        self,
+        node_ids: NDArray[np.int64],
+        latitudes: NDArray[np.float64],
+        longitudes: NDArray[np.float64],
+        offsets: NDArray[np.int64],
+        targets: NDArray[np.int32],
+        edge_keys: NDArray[np.int32],
+        lengths: NDArray[np.float64],
+        travel_times: NDArray[np.float64],
+        name_ids: NDArray[np.int32],
+        geometry_offsets: NDArray[np.int64],
+        geometry_latitudes: NDArray[np.float64],
+        geometry_longitudes: NDArray[np.float64],
+        names: List[str],
+    ) -> None:
+        self.node_ids = node_ids
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.offsets = offsets
+        self.targets = targets
+        self.edge_keys = edge_keys
+        self.lengths = lengths
+        self.travel_times = travel_times
+        self.name_ids = name_ids
+        self.geometry_offsets = geometry_offsets
+        self.geometry_latitudes = geometry_latitudes
+        self.geometry_longitudes = geometry_longitudes
+        self.names = names
+        self._lock = threading.Lock()
+        self._adjacency: Dict[WeightT, AdjacencyT] = {}
+        self._reverse_adjacency: Optional[ReverseAdjacencyT] = None
+        self._max_speeds: Dict[WeightT, float] = {}
+        self._has_weight: Dict[WeightT, bool] = {}
+        self._bounds: Optional[BoundsT] = None
+        self._fingerprints: Dict[WeightT, str] = {}
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # Arrays and names only, e.g. to send the graph to worker processes
+        return (
+            CompactGraph,
+            tuple(getattr(self, name) for name in SNAPSHOT_ARRAYS) + (self.names,),
+        )
+
+    @classmethod
+    def from_networkx(cls, graph: MultiDiGraph) -> "CompactGraph":
+        node_ids = np.sort(np.fromiter(graph.nodes, dtype=np.int64))
+        latitudes = np.array([graph.nodes[node]["y"] for node in node_ids.tolist()])
+        longitudes = np.array([graph.nodes[node]["x"] for node in node_ids.tolist()])
+
+        num_edges = graph.number_of_edges()
+        sources = np.empty(num_edges, dtype=np.int64)
+        targets = np.empty(num_edges, dtype=np.int64)
+        edge_keys = np.empty(num_edges, dtype=np.int32)
+        lengths = np.empty(num_edges, dtype=np.float64)
+        travel_times = np.empty(num_edges, dtype=np.float64)
+        name_ids = np.empty(num_edges, dtype=np.int32)
+        name_table: Dict[str, int] = {}
+        # (n, 2) longitudes and latitudes between the end nodes of each edge
+        interiors: List[NDArray[np.float64]] = []
+        for idx, (u, v, key, data) in enumerate(graph.edges(keys=True, data=True)):
+            sources[idx] = u
+            targets[idx] = v
+            edge_keys[idx] = key
+            lengths[idx] = data.get("length", 0.0)
+            travel_times[idx] = data.get("travel_time", np.nan)
+            name = data.get("name")
+            if isinstance(name, list):
+                # Street has several names
+                name = "/".join(name)
+            name_ids[idx] = (
+                UNNAMED
+                if name is None
+                else name_table.setdefault(name, len(name_table))
+            )
+            geometry = data.get("geometry")
+            interiors.append(
+                np.empty((0, 2))
+                if geometry is None
+                else np.asarray(geometry.coords, dtype=np.float64)[1:-1]
+            )
+
+        source_idx = np.searchsorted(node_ids, sources)
+        order = np.argsort(source_idx, kind="stable")
+        offsets = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(source_idx, minlength=len(node_ids)), out=offsets[1:])
+        geometry_offsets = np.zeros(num_edges + 1, dtype=np.int64)
+        np.cumsum([len(interiors[idx]) for idx in order], out=geometry_offsets[1:])
+        geometry = (
+            np.concatenate([interiors[idx] for idx in order])
+            if num_edges
+            else np.empty((0, 2))
+        )
+        return cls(
+            node_ids=node_ids,
+            latitudes=latitudes,
+            longitudes=longitudes,
+            offsets=offsets,
+            targets=np.searchsorted(node_ids, targets[order]).astype(np.int32),
+            edge_keys=edge_keys[order],
+            lengths=lengths[order],
+            travel_times=travel_times[order],
+            name_ids=name_ids[order],
+            geometry_offsets=geometry_offsets,
+            geometry_latitudes=np.ascontiguousarray(geometry[:, 1]),
+            geometry_longitudes=np.ascontiguousarray(geometry[:, 0]),
+            names=list(name_table),
+        )
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.targets)
+
+    def index_of(self, node_id: int) -> int:
+        """Node index for an OSM node id"""
+        idx = int(np.searchsorted(self.node_ids, node_id))
+        if idx == self.num_nodes or self.node_ids[idx] != node_id:
+            raise KeyError(node_id)
+        return idx
+
+    def sources(self, edges: ArrayLike) -> NDArray[np.int64]:
+        """Source node index of each edge index"""
+        return np.searchsorted(self.offsets, edges, side="right") - 1
+
+    def edge_key(self, edge: int) -> EdgeKeyT:
+        """The osmnx graph edge for an edge index"""
+        return (
+            int(self.node_ids[self.sources(edge)]),
+            int(self.node_ids[self.targets[edge]]),
+            int(self.edge_keys[edge]),
+        )
+
+    def edge_index(self, u: int, v: int, key: int = 0) -> int:
+        """Edge index of the osmnx graph edge (u, v, key)"""
+        source, target = self.index_of(u), self.index_of(v)
+        for edge in range(int(self.offsets[source]), int(self.offsets[source + 1])):
+            if self.targets[edge] == target and self.edge_keys[edge] == key:
+                return edge
+        raise KeyError((u, v, key))
+
+    def polylines(
+        self,
+    ) -> Tuple[NDArray[np.int64], NDArray[np.float64], NDArray[np.float64]]:
+        """
+        (offsets, latitudes, longitudes) of the full geometry of every edge:
+        vertices offsets[i]..offsets[i+1]-1 lead from the source node of edge
+        i through its geometry to the target node
+        """
+        offsets = np.zeros(self.num_edges + 1, dtype=np.int64)
+        np.cumsum(np.diff(self.geometry_offsets) + 2, out=offsets[1:])
+        sources = self.sources(np.arange(self.num_edges))
+        interior = np.ones(offsets[-1], dtype=bool)
+        interior[offsets[:-1]] = False
+        interior[offsets[1:] - 1] = False
+        polylines = []
+        for node_values, geometry_values in (
+            (self.latitudes, self.geometry_latitudes),
+            (self.longitudes, self.geometry_longitudes),
+        ):
+            values = np.empty(offsets[-1])
+            values[offsets[:-1]] = node_values[sources]
+            values[offsets[1:] - 1] = node_values[self.targets]
+            values[interior] = geometry_values
+            polylines.append(values)
+        return offsets, polylines[0], polylines[1]
+
+    def weights(self, weight: WeightT) -> NDArray[np.float64]:
+        if weight == "length":
+            return self.lengths
+        return self.travel_times
+
+    def adjacency(self, weight: WeightT) -> AdjacencyT:
+        """
+        (offsets, targets, weights) as sequences of Python numbers for the
+        search loops. These are memoryviews of the arrays, not copies.
+        """
+        with self._lock:
+            if weight not in self._adjacency:
+                self._adjacency[weight] = (
+                    cast(Sequence[int], self.offsets.data),
+                    cast(Sequence[int], self.targets.data),
+                    cast(Sequence[float], self.weights(weight).data),
+                )
+            return self._adjacency[weight]
+
+    def reverse_adjacency(self) -> ReverseAdjacencyT:
+        """Incoming edges, for searches running backwards from the target"""
+        with self._lock:
+            if self._reverse_adjacency is None:
+                sources = np.repeat(
+                    np.arange(self.num_nodes, dtype=np.int32), np.diff(self.offsets)
+                )
+                order = np.argsort(self.targets, kind="stable")
+                offsets = np.zeros(self.num_nodes + 1, dtype=np.int64)
+                np.cumsum(
+                    np.bincount(self.targets, minlength=self.num_nodes), out=offsets[1:]
+                )
+                self._reverse_adjacency = (
+                    cast(Sequence[int], offsets.data),
+                    cast(Sequence[int], sources[order].data),
+                    cast(Sequence[int], order.data),
+                )
+            return self._reverse_adjacency
+
+    def coordinates(self) -> Tuple[Sequence[float], Sequence[float]]:
+        """(latitudes, longitudes) as memoryviews for the search loops"""
+        return (
+            cast(Sequence[float], self.latitudes.data),
+            cast(Sequence[float], self.longitudes.data),
+        )
+
+    def has_weight(self, weight: WeightT) -> bool:
+        """Whether the weight is known (not NaN) for every edge"""
+        with self._lock:
+            if weight not in self._has_weight:
+                self._has_weight[weight] = not np.isnan(self.weights(weight)).any()
+            return self._has_weight[weight]
+
+    def max_speed(self, weight: WeightT) -> float:
+        """
+        Largest edge length per unit of weight, i.e. meters per second for
+        travel_time. 0 when the weight is unknown (NaN) for all edges.
+        """
+        with self._lock:
+            if weight not in self._max_speeds:
+                weights = self.weights(weight)
+                known = (weights > 0) & ~np.isnan(weights)
+                self._max_speeds[weight] = (
+                    float(np.max(self.lengths[known] / weights[known]))
+                    if known.any()
+                    else 0.0
+                )
+            return self._max_speeds[weight]
+
+    def bounds(self) -> BoundsT:
+        """Bounding box of the nodes and edge geometries, NaN if empty"""
+        with self._lock:
+            if self._bounds is None:
+                if self.num_nodes == 0:
+                    self._bounds = (np.nan, np.nan, np.nan, np.nan)
+                else:
+                    latitudes = np.concatenate(
+                        [self.latitudes, self.geometry_latitudes]
+                    )
+                    longitudes = np.concatenate(
+                        [self.longitudes, self.geometry_longitudes]
+                    )
+                    self._bounds = (
+                        float(latitudes.min()),
+                        float(longitudes.min()),
+                        float(latitudes.max()),
+                        float(longitudes.max()),
+                    )
+            return self._bounds
+
+    def fingerprint(self, weight: WeightT) -> str:
+        """
+        Identifies the graph structure and weights, e.g. those a contraction
+        hierarchy was built for. Hashes the arrays once, after which it is
+        kept in memory and in snapshots.
+        """
+        with self._lock:
+            if weight not in self._fingerprints:
+                digest = hashlib.sha1()
+                for array in (self.offsets, self.targets, self.weights(weight)):
+                    digest.update(np.ascontiguousarray(array).tobytes())
+                self._fingerprints[weight] = digest.hexdigest()
+            return self._fingerprints[weight]
+
+    def nbytes(self) -> int:
+        """Memory held by the arrays (excluding the name table)"""
+        return sum(getattr(self, name).nbytes for name in SNAPSHOT_ARRAYS)
+
+    def save(self, directory: Path, metadata: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Write the graph as a snapshot: one .npy file per array and the street
+        names as JSON. metadata is kept in the manifest, see read_manifest().
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        with (directory / "names.json").open("w") as fh:
+            json.dump(self.names, fh)
+        save_arrays(
+            directory,
+            {name: getattr(self, name) for name in SNAPSHOT_ARRAYS},
+            {
+                "version": SNAPSHOT_VERSION,
+                "num_nodes": self.num_nodes,
+                "num_edges": self.num_edges,
+                "bounds": self.bounds(),
+                "fingerprints": {
+                    weight: self.fingerprint(weight) for weight in POSSIBLE_WEIGHTS
+                },
+                "metadata": metadata or {},
+            },
+        )
+
+    @classmethod
+    def load(cls, directory: Path, mmap: bool = True) -> "CompactGraph":
+        """
+        Open a snapshot written by save(). With mmap the arrays are read-only
+        numpy memmaps, so opening is near-instant, pages are read on demand and
+        processes opening the same snapshot share them through the page cache.
+        """
+        arrays, manifest = load_arrays(
+            directory, SNAPSHOT_ARRAYS, SNAPSHOT_VERSION, mmap
+        )
+        with (directory / "names.json").open() as fh:
+            names = json.load(fh)
+        graph = cls(names=names, **arrays)
+        assert graph.num_nodes == manifest["num_nodes"]
+        assert graph.num_edges == manifest["num_edges"]
+        # Saved so that opening does not have to go over the arrays
+        if "bounds" in manifest:
+            graph._bounds = cast(BoundsT, tuple(manifest["bounds"]))
+        graph._fingerprints.update(manifest.get("fingerprints", {}))
+        return graph
+
+
+def save_arrays(
+    directory: Path, arrays: Dict[str, NDArray[Any]], manifest: Dict[str, Any]
+) -> None:
+    """
+    Write arrays as .npy files in directory. The manifest is written last and
+    marks the directory complete.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(directory / f"{name}.npy", array)
+    with (directory / "manifest.json").open("w") as fh:
+        json.dump(manifest, fh)
+
+
+def read_manifest(directory: Path) -> Dict[str, Any]:
+    """Manifest written by save_arrays()"""
+    with (directory / "manifest.json").open() as fh:
+        manifest: Dict[str, Any] = json.load(fh)
+    return manifest
+
+
+def load_arrays(
+    directory: Path, names: Sequence[str], version: int, mmap: bool = True
+) -> Tuple[Dict[str, NDArray[Any]], Dict[str, Any]]:
+    """(arrays, manifest) written by save_arrays(), memory mapped with mmap"""
+    manifest = read_manifest(directory)
+    if manifest["version"] != version:
+        raise Exception(
+            f"{directory} has version {manifest['version']}, expected {version}"
+        )
+    arrays = {
+        name: np.load(directory / f"{name}.npy", mmap_mode="r" if mmap else None)
+        for name in names
+    }
+    return arrays, manifest
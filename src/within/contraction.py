@@ -0,0 +1,466 @@
+# Contraction Hierarchies for fast shortest path queries on a fixed graph
+
+from heapq import heapify, heappop, heappush
+from math import inf
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Set, Tuple, cast
+
+import numpy as np
+from numpy.typing import NDArray
+
+from within.compact_graph import CompactGraph, WeightT, load_arrays, save_arrays
+from within.search import (
+    EndpointT,
+    LinkT,
+    PathT,
+    as_endpoint,
+    direct_cost,
+    link_costs,
+)
+
+CH_VERSION = 1
+CH_ARRAYS = (
+    "up_offsets",
+    "up_targets",
+    "up_edges",
+    "down_offsets",
+    "down_sources",
+    "down_edges",
+    "weights",
+    "edges",
+    "first",
+    "second",
+)
+# Witness searches give up after settling this many nodes or following this
+# many edges. A witness missed because of a limit only adds a redundant
+# shortcut, never a wrong one. Estimating the contraction order only needs a
+# rough count of shortcuts, so those searches are cut off sooner.
+WITNESS_SETTLE_LIMIT = 500
+WITNESS_ESTIMATE_SETTLE_LIMIT = 20
+WITNESS_HOP_LIMIT = 5
+
+# Remaining graph during contraction: node -> {neighbor: (weight, CH edge)}
+_DynamicAdjacencyT = List[Dict[int, Tuple[float, int]]]
+
+
+class ContractionHierarchy:
+    """
+    Contraction Hierarchy of a CompactGraph for one weight. Nodes are
+    contracted one by one in order of importance, adding shortcut edges where
+    a shortest path would otherwise pass through the contracted node. A query
+    is then a bidirectional Dijkstra that only ever moves up the hierarchy and
+    settles a few hundred nodes even on large graphs.
+
+    CH edges are either original edges of the graph (edges[i] is the edge
+    index, first/second are -1) or shortcuts made of the two CH edges first[i]
+    and second[i] (edges[i] is -1). up_* is the CSR adjacency of edges to
+    higher ranked nodes, down_* that of edges from higher ranked nodes,
+    grouped by their lower ranked end.
+    """
+
+    def __init__(
+        self,
+        graph: CompactGraph,
+        weight: WeightT,
+        up_offsets: NDArray[np.int64],
+        up_targets: NDArray[np.int32],
+        up_edges: NDArray[np.int64],
+        down_offsets: NDArray[np.int64],
+        down_sources: NDArray[np.int32],
+        down_edges: NDArray[np.int64],
+        weights: NDArray[np.float64],
+        edges: NDArray[np.int64],
+        first: NDArray[np.int64],
+        second: NDArray[np.int64],
+    ) -> None:
+        self.graph = graph
+        self.weight = weight
+        self.up_offsets = up_offsets
+        self.up_targets = up_targets
+        self.up_edges = up_edges
+        self.down_offsets = down_offsets
+        self.down_sources = down_sources
+        self.down_edges = down_edges
+        self.weights = weights
+        self.edges = edges
+        self.first = first
+        self.second = second
+
+    @property
+    def num_shortcuts(self) -> int:
+        return int(np.count_nonzero(self.edges < 0))
+
+    @classmethod
+    def build(cls, graph: CompactGraph, weight: WeightT) -> "ContractionHierarchy":
+        """Contract all nodes of graph. Slow; intended as an offline step."""
+        weights = graph.weights(weight)
+        if np.isnan(weights).any():
+            raise Exception(f"Graph has edges without {weight}")
+        ch_weights: List[float] = []
+        ch_edges: List[int] = []
+        ch_first: List[int] = []
+        ch_second: List[int] = []
+        out_edges: _DynamicAdjacencyT = [{} for _ in range(graph.num_nodes)]
+        in_edges: _DynamicAdjacencyT = [{} for _ in range(graph.num_nodes)]
+        for node in range(graph.num_nodes):
+            for edge in range(int(graph.offsets[node]), int(graph.offsets[node + 1])):
+                target = int(graph.targets[edge])
+                edge_weight = float(weights[edge])
+                parallel = out_edges[node].get(target)
+                if target == node or (parallel and parallel[0] <= edge_weight):
+                    # Self loops and longer parallel edges are never needed
+                    continue
+                out_edges[node][target] = in_edges[target][node] = (
+                    edge_weight,
+                    len(ch_weights),
+                )
+                ch_weights.append(edge_weight)
+                ch_edges.append(edge)
+                ch_first.append(-1)
+                ch_second.append(-1)
+
+        # Edges to higher ranked nodes, recorded when each node is contracted
+        up: List[List[Tuple[int, int]]] = [[] for _ in range(graph.num_nodes)]
+        down: List[List[Tuple[int, int]]] = [[] for _ in range(graph.num_nodes)]
+        contracted = [False] * graph.num_nodes
+        contracted_neighbors = [0] * graph.num_nodes
+        priorities = [
+            _priority(node, out_edges, in_edges, contracted_neighbors)
+            for node in range(graph.num_nodes)
+        ]
+        queue = [(priority, node) for node, priority in enumerate(priorities)]
+        heapify(queue)
+        while queue:
+            priority, node = heappop(queue)
+            if contracted[node] or priority != priorities[node]:
+                continue  # Superseded when a neighbor was contracted
+            for source, target, shortcut_weight in _shortcuts(
+                node, out_edges, in_edges, WITNESS_SETTLE_LIMIT
+            ):
+                out_edges[source][target] = in_edges[target][source] = (
+                    shortcut_weight,
+                    len(ch_weights),
+                )
+                ch_weights.append(shortcut_weight)
+                ch_edges.append(-1)
+                ch_first.append(in_edges[node][source][1])
+                ch_second.append(out_edges[node][target][1])
+            up[node] = [
+                (target, ch_edge) for target, (_, ch_edge) in out_edges[node].items()
+            ]
+            down[node] = [
+                (source, ch_edge) for source, (_, ch_edge) in in_edges[node].items()
+            ]
+            contracted[node] = True
+            neighbors = set(out_edges[node]) | set(in_edges[node])
+            for target in out_edges[node]:
+                del in_edges[target][node]
+            for source in in_edges[node]:
+                del out_edges[source][node]
+            out_edges[node] = {}
+            in_edges[node] = {}
+            # Only the priorities of the neighbors change
+            for neighbor in neighbors:
+                contracted_neighbors[neighbor] += 1
+                priorities[neighbor] = _priority(
+                    neighbor, out_edges, in_edges, contracted_neighbors
+                )
+                heappush(queue, (priorities[neighbor], neighbor))
+
+        up_offsets, up_targets, up_edges = _to_csr(up)
+        down_offsets, down_sources, down_edges = _to_csr(down)
+        return cls(
+            graph,
+            weight,
+            up_offsets=up_offsets,
+            up_targets=up_targets,
+            up_edges=up_edges,
+            down_offsets=down_offsets,
+            down_sources=down_sources,
+            down_edges=down_edges,
+            weights=np.array(ch_weights, dtype=np.float64),
+            edges=np.array(ch_edges, dtype=np.int64),
+            first=np.array(ch_first, dtype=np.int64),
+            second=np.array(ch_second, dtype=np.int64),
+        )
+
+    def save(self, directory: Path) -> None:
+        save_arrays(
+            directory,
+            {name: getattr(self, name) for name in CH_ARRAYS},
+            {
+                "version": CH_VERSION,
+                "weight": self.weight,
+                "fingerprint": self.graph.fingerprint(self.weight),
+            },
+        )
+
+    @classmethod
+    def load(
+        cls, directory: Path, graph: CompactGraph, weight: WeightT, mmap: bool = True
+    ) -> "ContractionHierarchy":
+        """
+        Open a hierarchy written by save(). Raises if it was built for another
+        weight or another version of the graph.
+        """
+        arrays, manifest = load_arrays(directory, CH_ARRAYS, CH_VERSION, mmap)
+        if manifest["weight"] != weight or manifest["fingerprint"] != graph.fingerprint(
+            weight
+        ):
+            raise Exception(
+                f"Contraction hierarchy {directory} was built for another graph"
+            )
+        return cls(graph, weight, **arrays)
+
+    def shortest_path(
+        self, source: int | EndpointT, target: int | EndpointT
+    ) -> Optional[PathT]:
+        """
+        Shortest path between node indices of the graph or end points, with
+        shortcuts unpacked into the original edges. See bidirectional_astar
+        for paths between end points.
+        """
+        source = as_endpoint(self.graph, source)
+        target = as_endpoint(self.graph, target)
+        weights = cast(Sequence[float], self.weights.data)
+        graph_weights = cast(Sequence[float], self.graph.weights(self.weight).data)
+        adjacency = self._adjacency()
+        dist = (
+            link_costs(source.outgoing, graph_weights),
+            link_costs(target.incoming, graph_weights),
+        )
+        pred: Tuple[Dict[int, Tuple[int, int]], ...] = ({}, {})
+        settled: Tuple[Set[int], Set[int]] = (set(), set())
+        heaps: Tuple[List[Tuple[float, int]], ...] = (
+            sorted((cost, node) for node, cost in dist[0].items()),
+            sorted((cost, node) for node, cost in dist[1].items()),
+        )
+        best_cost = direct_cost(source, target, graph_weights)
+        meeting_node = -1
+        while True:
+            # Unlike plain bidirectional Dijkstra, each search has to run until
+            # it cannot improve on the best meeting point by itself
+            forward_min = heaps[0][0][0] if heaps[0] else inf
+            backward_min = heaps[1][0][0] if heaps[1] else inf
+            if forward_min >= best_cost and backward_min >= best_cost:
+                break
+            side = 0 if forward_min <= backward_min else 1
+            node_dist, node = heappop(heaps[side])
+            if node in settled[side]:
+                continue
+            settled[side].add(node)
+            if node in dist[1 - side] and node_dist + dist[1 - side][node] < best_cost:
+                best_cost = node_dist + dist[1 - side][node]
+                meeting_node = node
+            side_dist = dist[side]
+            if _stalled(node, node_dist, side_dist, adjacency[1 - side], weights):
+                continue
+            offsets, neighbors, ch_edges = adjacency[side]
+            for idx in range(offsets[node], offsets[node + 1]):
+                neighbor = neighbors[idx]
+                ch_edge = ch_edges[idx]
+                new_dist = node_dist + weights[ch_edge]
+                if new_dist < side_dist.get(neighbor, inf):
+                    side_dist[neighbor] = new_dist
+                    pred[side][neighbor] = (node, ch_edge)
+                    heappush(heaps[side], (new_dist, neighbor))
+        if meeting_node < 0:
+            return None if best_cost == inf else PathT(best_cost, [], [])
+
+        ch_path: List[int] = []
+        node = meeting_node
+        while node in pred[0]:
+            node, ch_edge = pred[0][node]
+            ch_path.append(ch_edge)
+        first_node = node
+        ch_path.reverse()
+        node = meeting_node
+        while node in pred[1]:
+            node, ch_edge = pred[1][node]
+            ch_path.append(ch_edge)
+        edges = self.unpack(ch_path)
+        nodes = [first_node] + [int(self.graph.targets[edge]) for edge in edges]
+        return PathT(best_cost, nodes, edges)
+
+    def search_space(
+        self, links: Sequence[LinkT], backward: bool = False
+    ) -> Dict[int, float]:
+        """
+        Cost from the links of an end point (outgoing, or incoming when
+        backward) to every node reached going up the hierarchy, leaving out
+        stalled nodes. The cost between two end points is the least sum of
+        the forward and backward costs over the nodes both search spaces
+        share, which is how many-to-many queries combine one search per end
+        point instead of one per pair.
+        """
+        weights = cast(Sequence[float], self.weights.data)
+        graph_weights = cast(Sequence[float], self.graph.weights(self.weight).data)
+        side = 1 if backward else 0
+        offsets, neighbors, ch_edges = self._adjacency()[side]
+        opposite = self._adjacency()[1 - side]
+        dist = link_costs(links, graph_weights)
+        heap = sorted((cost, node) for node, cost in dist.items())
+        settled: Set[int] = set()
+        reached: Dict[int, float] = {}
+        while heap:
+            node_dist, node = heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            if _stalled(node, node_dist, dist, opposite, weights):
+                continue
+            reached[node] = node_dist
+            for idx in range(offsets[node], offsets[node + 1]):
+                neighbor = neighbors[idx]
+                new_dist = node_dist + weights[ch_edges[idx]]
+                if new_dist < dist.get(neighbor, inf):
+                    dist[neighbor] = new_dist
+                    heappush(heap, (new_dist, neighbor))
+        return reached
+
+    def _adjacency(
+        self,
+    ) -> Tuple[Tuple[Sequence[int], Sequence[int], Sequence[int]], ...]:
+        """(offsets, neighbors, CH edges) up the hierarchy from either end"""
+        return (
+            (
+                cast(Sequence[int], self.up_offsets.data),
+                cast(Sequence[int], self.up_targets.data),
+                cast(Sequence[int], self.up_edges.data),
+            ),
+            (
+                cast(Sequence[int], self.down_offsets.data),
+                cast(Sequence[int], self.down_sources.data),
+                cast(Sequence[int], self.down_edges.data),
+            ),
+        )
+
+    def unpack(self, ch_edges: List[int]) -> List[int]:
+        """Original graph edges making up a sequence of CH edges"""
+        edges: List[int] = []
+        stack = ch_edges[::-1]
+        while stack:
+            ch_edge = stack.pop()
+            edge = int(self.edges[ch_edge])
+            if edge >= 0:
+                edges.append(edge)
+            else:
+                stack.append(int(self.second[ch_edge]))
+                stack.append(int(self.first[ch_edge]))
+        return edges
+
+
+def _stalled(
+    node: int,
+    node_dist: float,
+    dist: Dict[int, float],
+    opposite: Tuple[Sequence[int], Sequence[int], Sequence[int]],
+    weights: Sequence[float],
+) -> bool:
+    """
+    Stall-on-demand: node is not on a shortest path of this search if a higher
+    ranked node already reached reaches it more cheaply, so it need not be
+    expanded.
+    """
+    offsets, neighbors, ch_edges = opposite
+    for idx in range(offsets[node], offsets[node + 1]):
+        neighbor_dist = dist.get(neighbors[idx])
+        if neighbor_dist is not None and (
+            neighbor_dist + weights[ch_edges[idx]] < node_dist
+        ):
+            return True
+    return False
+
+
+def _shortcuts(
+    node: int,
+    out_edges: _DynamicAdjacencyT,
+    in_edges: _DynamicAdjacencyT,
+    settle_limit: int,
+) -> List[Tuple[int, int, float]]:
+    """(source, target, weight) of shortcuts needed to contract node"""
+    shortcuts: List[Tuple[int, int, float]] = []
+    outgoing = out_edges[node]
+    if not outgoing:
+        return shortcuts
+    max_out = max(edge_weight for edge_weight, _ in outgoing.values())
+    for source, (in_weight, _) in in_edges[node].items():
+        witness_dist = _witness_search(
+            source, node, set(outgoing), in_weight + max_out, out_edges, settle_limit
+        )
+        for target, (out_weight, _) in outgoing.items():
+            if target == source:
+                continue
+            shortcut_weight = in_weight + out_weight
+            if witness_dist.get(target, inf) > shortcut_weight:
+                shortcuts.append((source, target, shortcut_weight))
+    return shortcuts
+
+
+def _witness_search(
+    source: int,
+    skip_node: int,
+    targets: Set[int],
+    max_dist: float,
+    out_edges: _DynamicAdjacencyT,
+    settle_limit: int,
+) -> Dict[int, float]:
+    """Dijkstra from source avoiding skip_node, bounded by distance and size"""
+    dist = {source: 0.0}
+    hops = {source: 0}
+    heap = [(0.0, source)]
+    settled: Set[int] = set()
+    remaining = len(targets)
+    while heap and len(settled) < settle_limit:
+        node_dist, node = heappop(heap)
+        if node_dist > max_dist:
+            break
+        if node in settled:
+            continue
+        settled.add(node)
+        if node in targets:
+            remaining -= 1
+            if not remaining:
+                break
+        if hops[node] == WITNESS_HOP_LIMIT:
+            continue
+        for neighbor, (edge_weight, _) in out_edges[node].items():
+            new_dist = node_dist + edge_weight
+            if neighbor != skip_node and new_dist < dist.get(neighbor, inf):
+                dist[neighbor] = new_dist
+                hops[neighbor] = hops[node] + 1
+                heappush(heap, (new_dist, neighbor))
+    return dist
+
+
+def _priority(
+    node: int,
+    out_edges: _DynamicAdjacencyT,
+    in_edges: _DynamicAdjacencyT,
+    contracted_neighbors: List[int],
+) -> int:
+    """
+    Contraction order: nodes adding few shortcuts relative to the edges they
+    remove go first, spread out over the graph by the number of neighbors
+    already contracted. Shortcuts are only estimated, with witness searches
+    cut off early.
+    """
+    edge_difference = len(
+        _shortcuts(node, out_edges, in_edges, WITNESS_ESTIMATE_SETTLE_LIMIT)
+    ) - (len(out_edges[node]) + len(in_edges[node]))
+    return edge_difference + contracted_neighbors[node]
+
+
+def _to_csr(
+    adjacency: List[List[Tuple[int, int]]],
+) -> Tuple[NDArray[np.int64], NDArray[np.int32], NDArray[np.int64]]:
+    """(offsets, neighbors, CH edges) from per node lists of (neighbor, CH edge)"""
+    offsets = np.zeros(len(adjacency) + 1, dtype=np.int64)
+    np.cumsum([len(entries) for entries in adjacency], out=offsets[1:])
+    neighbors = np.array(
+        [neighbor for entries in adjacency for neighbor, _ in entries], dtype=np.int32
+    )
+    ch_edges = np.array(
+        [ch_edge for entries in adjacency for _, ch_edge in entries], dtype=np.int64
+    )
+    return offsets, neighbors, ch_edges
@@ -0,0 +1,384 @@
+# On-disk cache of downloaded street graphs
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil, cos, floor, pi, radians
+from pathlib import Path
+from time import time
+from typing import Dict, List, Optional, Tuple
+
+import networkx
+import osmnx
+from networkx import MultiDiGraph
+
+from within.spherical_geometry import (
+    EARTH_RADIUS,
+    CoordT,
+    great_circle_distance,
+    great_circle_intermediate_point,
+)
+
+# Kept in the user's cache directory rather than the installed package
+GRAPH_CACHE_DIR = Path(
+    os.getenv(
+        "WITHIN_GRAPH_CACHE_DIR",
+        Path(os.getenv("XDG_CACHE_HOME", Path.home() / ".cache")) / "within" / "graphs",
+    )
+)
+GRAPH_CACHE_MAX_BYTES = 2 * 1024**3
+USE_GRAPH_CACHE = True
+# Corridor mode downloads fixed size tiles on a global latitude/longitude grid,
+# so tiles are shared between all routes passing through them.
+TILE_SIZE_DEG = 0.05
+CORRIDOR_HALF_WIDTH_KM = 5.0
+TILE_DOWNLOAD_CONCURRENCY = 4
+KM_PER_DEGREE = 2 * pi * EARTH_RADIUS / 360
+
+# Travel speeds (km/h) used for travel times. Driving uses speed limits from
+# OpenStreetMap where tagged and these by highway type otherwise. Walking and
+# cycling ignore speed limits: a speed per mode with exceptions by highway type.
+DRIVE_SPEEDS_KPH = {
+    "motorway": 100.0,
+    "trunk": 80.0,
+    "primary": 60.0,
+    "secondary": 50.0,
+    "tertiary": 40.0,
+    "unclassified": 30.0,
+    "residential": 30.0,
+    "living_street": 10.0,
+    "service": 20.0,
+}
+DRIVE_FALLBACK_SPEED_KPH = 30.0
+WALK_SPEED_KPH = 5.0
+BIKE_SPEED_KPH = 15.0
+ACTIVE_SPEEDS_KPH: Dict[str, Dict[str, float]] = {
+    "walk": {"steps": 2.0},
+    "bike": {"steps": 2.0, "footway": WALK_SPEED_KPH, "pedestrian": WALK_SPEED_KPH},
+}
+
+TileT = Tuple[int, int]  # (row, column) in the tile grid
+
+_graph_cache: Optional["GraphCache"] = None
+_graph_cache_lock = threading.Lock()
+
+
+class GraphCache:
+    """
+    Street graphs stored as binary pickles in `directory`, indexed in SQLite by
+    transport mode and the circle (center, radius) they were downloaded for,
+    along with whether their edges have travel times.
+    A cached graph serves any later request whose circle it covers. The least
+    recently used graphs are evicted once the total size exceeds `max_bytes`.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            directory / "index.sqlite3", check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS graphs ("
+            "key TEXT PRIMARY KEY, transport_mode TEXT NOT NULL, "
+            "latitude REAL NOT NULL, longitude REAL NOT NULL, radius_m REAL NOT NULL, "
+            "file_name TEXT NOT NULL, size_bytes INTEGER NOT NULL, "
+            "last_used REAL NOT NULL, has_travel_times INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {
+            row[1] for row in self._connection.execute("PRAGMA table_info(graphs)")
+        }
+        if "has_travel_times" not in columns:
+            # Index written before travel times were added
+            self._connection.execute(
+                "ALTER TABLE graphs "
+                "ADD COLUMN has_travel_times INTEGER NOT NULL DEFAULT 0"
+            )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS graphs_by_mode ON graphs (transport_mode)"
+        )
+
+    @staticmethod
+    def disc_key(transport_mode: str, center: CoordT, radius_m: float) -> str:
+        return f"{transport_mode}:{center[0]:.6f}:{center[1]:.6f}:{radius_m:.0f}"
+
+    def find(
+        self, transport_mode: str, center: CoordT, radius_m: float
+    ) -> Optional[MultiDiGraph]:
+        """Smallest cached graph covering the circle around center, if any"""
+        key = self.find_key(transport_mode, center, radius_m)
+        return None if key is None else self.get(key)
+
+    def find_key(
+        self, transport_mode: str, center: CoordT, radius_m: float
+    ) -> Optional[str]:
+        """Key of the smallest cached graph covering the circle around center"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT key, latitude, longitude, radius_m FROM graphs "
+                "WHERE transport_mode = ? AND radius_m >= ? ORDER BY radius_m",
+                (transport_mode, radius_m),
+            ).fetchall()
+        for key, latitude, longitude, cached_radius_m in rows:
+            offset_m = 1000 * great_circle_distance(
+                center[0], center[1], latitude, longitude
+            )
+            if offset_m + radius_m <= cached_radius_m:
+                return str(key)
+        return None
+
+    def has_travel_times(self, key: str) -> bool:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT has_travel_times FROM graphs WHERE key = ?", (key,)
+            ).fetchone()
+        return row is not None and bool(row[0])
+
+    def get(self, key: str) -> Optional[MultiDiGraph]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT file_name FROM graphs WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE graphs SET last_used = ? WHERE key = ?", (time(), key)
+            )
+        try:
+            with (self.directory / row[0]).open("rb") as fh:
+                graph: MultiDiGraph = pickle.load(fh)
+        except FileNotFoundError:
+            # Removed behind our back (e.g. evicted by another process)
+            self.delete(key)
+            return None
+        return graph
+
+    def put(
+        self,
+        key: str,
+        transport_mode: str,
+        center: CoordT,
+        radius_m: float,
+        graph: MultiDiGraph,
+        has_travel_times: bool = False,
+    ) -> None:
+        key_digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        file_name = f"{key_digest}-{int(time() * 1000):x}.pickle"
+        # Write to a temporary file first so readers never see partial graphs
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            pickle.dump(graph, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.directory / file_name)
+        size_bytes = (self.directory / file_name).stat().st_size
+        self.delete(key)
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO graphs (key, transport_mode, latitude, longitude, "
+                "radius_m, file_name, size_bytes, last_used, has_travel_times) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    transport_mode,
+                    center[0],
+                    center[1],
+                    radius_m,
+                    file_name,
+                    size_bytes,
+                    time(),
+                    has_travel_times,
+                ),
+            )
+        self._evict(keep=key)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT file_name FROM graphs WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return
+            self._connection.execute("DELETE FROM graphs WHERE key = ?", (key,))
+        (self.directory / row[0]).unlink(missing_ok=True)
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT COALESCE(SUM(size_bytes), 0) FROM graphs"
+            ).fetchone()
+        return int(row[0])
+
+    def _evict(self, keep: str) -> None:
+        while self.total_bytes() > self.max_bytes:
+            with self._lock:
+                row = self._connection.execute(
+                    "SELECT key FROM graphs WHERE key != ? "
+                    "ORDER BY last_used LIMIT 1",
+                    (keep,),
+                ).fetchone()
+            if row is None:
+                return
+            self.delete(row[0])
+
+
+def get_graph_cache() -> GraphCache:
+    """Graph cache at GRAPH_CACHE_DIR. Reopens if GRAPH_CACHE_DIR has been changed."""
+    global _graph_cache
+    with _graph_cache_lock:
+        if _graph_cache is None or _graph_cache.directory != GRAPH_CACHE_DIR:
+            _graph_cache = GraphCache(GRAPH_CACHE_DIR, GRAPH_CACHE_MAX_BYTES)
+        return _graph_cache
+
+
+def add_travel_times(graph: MultiDiGraph, transport_mode: str) -> MultiDiGraph:
+    """Add speed_kph and travel_time (seconds) attributes to all edges, in place"""
+    if graph.number_of_edges() == 0:
+        return graph
+    if transport_mode == "drive":
+        osmnx.routing.add_edge_speeds(
+            graph, hwy_speeds=DRIVE_SPEEDS_KPH, fallback=DRIVE_FALLBACK_SPEED_KPH
+        )
+    else:
+        default_speed_kph = (
+            WALK_SPEED_KPH if transport_mode == "walk" else BIKE_SPEED_KPH
+        )
+        speeds_kph = ACTIVE_SPEEDS_KPH.get(transport_mode, {})
+        for _, _, data in graph.edges(data=True):
+            highway = data.get("highway")
+            if isinstance(highway, list):
+                # Merged edge of several highway types: go by the slowest
+                data["speed_kph"] = min(
+                    speeds_kph.get(value, default_speed_kph) for value in highway
+                )
+            else:
+                data["speed_kph"] = speeds_kph.get(highway, default_speed_kph)
+    return osmnx.routing.add_edge_travel_times(graph)
+
+
+def load_graph(center: CoordT, radius_m: float, transport_mode: str) -> MultiDiGraph:
+    """
+    Street graph for transport_mode covering radius_m around center
+    (latitude, longitude), with travel times. Served from the graph cache when
+    a cached graph covers the area, otherwise downloaded from OpenStreetMap and
+    cached.
+    """
+    if USE_GRAPH_CACHE:
+        cache = get_graph_cache()
+        key = cache.find_key(transport_mode, center, radius_m)
+        graph = None if key is None else cache.get(key)
+        if key is not None and graph is not None:
+            if not cache.has_travel_times(key):
+                # Cached before travel times were added
+                add_travel_times(graph, transport_mode)
+            return graph
+    graph = osmnx.graph.graph_from_point(center, radius_m, network_type=transport_mode)
+    add_travel_times(graph, transport_mode)
+    if USE_GRAPH_CACHE:
+        get_graph_cache().put(
+            GraphCache.disc_key(transport_mode, center, radius_m),
+            transport_mode,
+            center,
+            radius_m,
+            graph,
+            has_travel_times=True,
+        )
+    return graph
+
+
+def corridor_tiles(
+    start: CoordT,
+    end: CoordT,
+    half_width_km: float = CORRIDOR_HALF_WIDTH_KM,
+    tile_size_deg: float = TILE_SIZE_DEG,
+) -> List[TileT]:
+    """
+    Tiles overlapping the band of half_width_km around the great circle path
+    from start to end (latitude, longitude).
+    """
+    distance_km = great_circle_distance(start[0], start[1], end[0], end[1])
+    # Sample the path densely enough for the boxes around samples to overlap
+    num_steps = max(1, ceil(2 * distance_km / half_width_km))
+    tiles = set()
+    for step in range(num_steps + 1):
+        latitude, longitude = great_circle_intermediate_point(
+            start[0], start[1], end[0], end[1], step / num_steps
+        )
+        lat_delta = half_width_km / KM_PER_DEGREE
+        long_delta = half_width_km / (KM_PER_DEGREE * max(cos(radians(latitude)), 0.01))
+        for row in range(
+            floor((latitude - lat_delta) / tile_size_deg),
+            floor((latitude + lat_delta) / tile_size_deg) + 1,
+        ):
+            for col in range(
+                floor((longitude - long_delta) / tile_size_deg),
+                floor((longitude + long_delta) / tile_size_deg) + 1,
+            ):
+                tiles.add((row, col))
+    return sorted(tiles)
+
+
+def _load_tile(tile: TileT, transport_mode: str) -> MultiDiGraph:
+    """
+    Unsimplified street graph of a single tile. Edges crossing the tile border
+    are kept so that neighbouring tiles share nodes and can be stitched together.
+    """
+    row, col = tile
+    key = f"tile:{transport_mode}:{TILE_SIZE_DEG}:{row}:{col}"
+    if USE_GRAPH_CACHE:
+        graph = get_graph_cache().get(key)
+        if graph is not None:
+            return graph
+    bottom, left = row * TILE_SIZE_DEG, col * TILE_SIZE_DEG
+    top, right = bottom + TILE_SIZE_DEG, left + TILE_SIZE_DEG
+    try:
+        graph = osmnx.graph.graph_from_bbox(
+            (left, bottom, right, top),
+            network_type=transport_mode,
+            simplify=False,
+            retain_all=True,
+            truncate_by_edge=True,
+        )
+    except ValueError:
+        # No streets in this tile (e.g. open water). osmnx raises its
+        # InsufficientResponseError, which is not public but a ValueError.
+        graph = MultiDiGraph(crs=osmnx.settings.default_crs)
+    if USE_GRAPH_CACHE:
+        center = (bottom + TILE_SIZE_DEG / 2, left + TILE_SIZE_DEG / 2)
+        inscribed_radius_m = 1000 * min(
+            great_circle_distance(center[0], center[1], top, center[1]),
+            great_circle_distance(center[0], center[1], center[0], right),
+        )
+        # Tiles are unsimplified so they are kept apart from disc graphs
+        get_graph_cache().put(
+            key, f"{transport_mode}-tile", center, inscribed_radius_m, graph
+        )
+    return graph
+
+
+def load_corridor_graph(
+    start: CoordT,
+    end: CoordT,
+    transport_mode: str,
+    half_width_km: float = CORRIDOR_HALF_WIDTH_KM,
+) -> MultiDiGraph:
+    """
+    Street graph for transport_mode covering a band of half_width_km around the
+    great circle path from start to end, with travel times. The band is made of
+    grid tiles which are downloaded in parallel, cached individually and
+    stitched together.
+    """
+    tiles = corridor_tiles(start, end, half_width_km, TILE_SIZE_DEG)
+    with ThreadPoolExecutor(max_workers=TILE_DOWNLOAD_CONCURRENCY) as executor:
+        tile_graphs = list(
+            executor.map(lambda tile: _load_tile(tile, transport_mode), tiles)
+        )
+    graph = networkx.compose_all(tile_graphs)
+    graph = osmnx.simplification.simplify_graph(graph)
+    graph = osmnx.truncate.largest_component(graph)
+    return add_travel_times(graph, transport_mode)
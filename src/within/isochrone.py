@@ -0,0 +1,230 @@
+# Everything reachable from a single origin within a travel budget
+
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import shapely
+from numpy.typing import NDArray
+
+from within.address import Address
+from within.compact_graph import WeightT
+from within.graph_cache import BIKE_SPEED_KPH, WALK_SPEED_KPH, load_graph
+from within.network import (
+    POSSIBLE_TRANSPORTATION_MODES,
+    RegionalNetwork,
+    StreetNetwork,
+    TransportModeT,
+)
+from within.search import EndpointT, dijkstra_costs, link_costs
+
+# Fastest speed (km/h) per transport mode, bounding how far a travel time
+# budget can reach when downloading the network. Driving allows for tagged
+# motorway speed limits above the highway type defaults.
+MAX_SPEEDS_KPH: Dict[TransportModeT, float] = {
+    "bike": BIKE_SPEED_KPH,
+    "drive": 130.0,
+    "walk": WALK_SPEED_KPH,
+}
+# Extra network downloaded around the reachable disc, so that streets leaving
+# and re-entering it are not cut off
+ISOCHRONE_MARGIN_M = 500.0
+# Passed to shapely.concave_hull: 1 is the convex hull, smaller values follow
+# the reachable streets more closely
+CONCAVE_HULL_RATIO = 0.3
+
+
+class Isochrone:
+    """
+    Streets reachable from starting_point within budget meters (weight_by
+    length) or seconds (weight_by travel_time). One bounded Dijkstra search
+    answers every threshold up to budget, so nodes and polygons for e.g. 5,
+    10 and 15 minutes come from the same search.
+    """
+
+    _street_network: Optional[StreetNetwork] = None
+    # Start point snapped to the edges of the street network
+    _origin: EndpointT
+    _origin_dist_m: float
+
+    def __init__(
+        self,
+        starting_point: Address,
+        budget: float,
+        transport_mode: TransportModeT,
+        weight_by: WeightT = "length",
+        region: Optional[RegionalNetwork] = None,
+        snapshot: Optional[Path] = None,
+    ) -> None:
+        """
+        region: Preloaded network shared with other queries, which must
+        contain starting_point. Nothing is downloaded when given.
+        snapshot: Directory of a street network snapshot for transport_mode
+        (see StreetNetwork.save_snapshot) to open instead of downloading.
+        """
+        assert budget >= 0, f"invalid budget {budget}"
+        assert (
+            transport_mode in POSSIBLE_TRANSPORTATION_MODES
+        ), f"invalid transport_mode {transport_mode}"
+        self.starting_point = starting_point
+        self.budget = budget
+        self.transport_mode = transport_mode
+        self.weight_by = weight_by
+        self.region = region
+        self.snapshot = snapshot
+
+    @property
+    def network_radius_m(self) -> float:
+        """Radius around starting_point of the network downloaded"""
+        if self.weight_by == "length":
+            reach_m = self.budget
+        else:
+            reach_m = self.budget * MAX_SPEEDS_KPH[self.transport_mode] / 3.6
+        return reach_m + ISOCHRONE_MARGIN_M
+
+    @property
+    def street_network(self) -> StreetNetwork:
+        if self._street_network is None:
+            self._street_network = self._load_street_network()
+            endpoints, dist_m = self._street_network.snap_to_edges(
+                [self.starting_point.latitude], [self.starting_point.longitude]
+            )
+            self._origin = endpoints[0]
+            self._origin_dist_m = float(dist_m[0])
+        return self._street_network
+
+    @property
+    def snap_distance_m(self) -> float:
+        """
+        Distance (m) from starting_point to the point on the street network
+        the search starts at
+        """
+        self.street_network
+        return self._origin_dist_m
+
+    def _load_street_network(self) -> StreetNetwork:
+        if self.region is not None:
+            assert self.region.covers(
+                self.starting_point.latitude, self.starting_point.longitude
+            ), f"{self.starting_point.location_description} is outside the region"
+            return self.region.network(self.transport_mode)
+        if self.snapshot is not None:
+            network = StreetNetwork.open_snapshot(self.snapshot)
+            assert network.transport_mode in (None, self.transport_mode), (
+                f"snapshot {self.snapshot} is of the {network.transport_mode} "
+                f"network, not {self.transport_mode}"
+            )
+            assert network.covers(
+                self.starting_point.latitude, self.starting_point.longitude
+            ), f"{self.starting_point.location_description} is outside the snapshot"
+            return network
+        return StreetNetwork(
+            load_graph(
+                (self.starting_point.latitude, self.starting_point.longitude),
+                self.network_radius_m,
+                self.transport_mode,
+            ),
+            transport_mode=self.transport_mode,
+        )
+
+    @cached_property
+    def node_costs(self) -> NDArray[np.float64]:
+        """Cost to each node of the compact graph, inf beyond budget"""
+        compact = self.street_network.compact
+        assert compact.has_weight(
+            self.weight_by
+        ), f"street network has no {self.weight_by}"
+        settled = dijkstra_costs(
+            compact,
+            link_costs(self._origin.outgoing, compact.adjacency(self.weight_by)[2]),
+            self.weight_by,
+            max_cost=self.budget,
+        )
+        costs = np.full(compact.num_nodes, np.inf)
+        costs[list(settled)] = list(settled.values())
+        return costs
+
+    def _threshold(self, threshold: Optional[float]) -> float:
+        if threshold is None:
+            return self.budget
+        assert 0 <= threshold <= self.budget, f"threshold {threshold} beyond budget"
+        return threshold
+
+    def reachable_nodes(self, threshold: Optional[float] = None) -> Dict[int, float]:
+        """
+        OSM node ids reachable within threshold (by default the budget) with
+        their costs, closest first
+        """
+        threshold = self._threshold(threshold)
+        compact = self.street_network.compact
+        reached = np.flatnonzero(self.node_costs <= threshold)
+        reached = reached[np.argsort(self.node_costs[reached], kind="stable")]
+        return dict(
+            zip(
+                compact.node_ids[reached].tolist(),
+                self.node_costs[reached].tolist(),
+            )
+        )
+
+    def reachable_points(
+        self, threshold: Optional[float] = None
+    ) -> NDArray[np.float64]:
+        """
+        (n, 2) longitudes and latitudes of the start point, the nodes reached
+        within threshold and how far along the edges leaving them threshold
+        reaches
+        """
+        threshold = self._threshold(threshold)
+        compact = self.street_network.compact
+        # Every edge leaving a reached node, and the edges the start point is
+        # part way along, with the fraction along and cost where each starts
+        leaving = np.flatnonzero(
+            self.node_costs[compact.sources(np.arange(compact.num_edges))] <= threshold
+        )
+        origin_links = [link for link in self._origin.outgoing if link.edge >= 0]
+        edges = np.concatenate(
+            [leaving, np.array([link.edge for link in origin_links], dtype=np.int64)]
+        )
+        start_fractions = np.concatenate(
+            [np.zeros(len(leaving)), [1 - link.share for link in origin_links]]
+        )
+        start_costs = np.concatenate(
+            [
+                self.node_costs[compact.sources(leaving)],
+                np.zeros(len(origin_links)),
+            ]
+        )
+        weights = compact.weights(self.weight_by)[edges]
+        fractions = np.minimum(
+            1.0,
+            start_fractions
+            + (threshold - start_costs) / np.where(weights > 0, weights, 1.0),
+        )[:, None]
+        coordinates = np.column_stack([compact.longitudes, compact.latitudes])
+        sources, targets = compact.sources(edges), compact.targets[edges]
+        along = (1 - fractions) * coordinates[sources] + fractions * coordinates[
+            targets
+        ]
+        return np.concatenate(
+            [[[self._origin.longitude, self._origin.latitude]], along]
+        )
+
+    def polygon(
+        self, threshold: Optional[float] = None, ratio: float = CONCAVE_HULL_RATIO
+    ) -> shapely.Geometry:
+        """
+        Concave hull (x longitude, y latitude) of the streets reachable within
+        threshold, by default the budget. Degenerates to a point or line when
+        only a single street is reached.
+        """
+        return shapely.concave_hull(
+            shapely.multipoints(self.reachable_points(threshold)), ratio=ratio
+        )
+
+    def polygons(
+        self, thresholds: Iterable[float], ratio: float = CONCAVE_HULL_RATIO
+    ) -> Dict[float, shapely.Geometry]:
+        return {
+            threshold: self.polygon(threshold, ratio=ratio) for threshold in thresholds
+        }
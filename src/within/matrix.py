@@ -0,0 +1,164 @@
+# Many-to-many travel cost matrices on a shared street network
+
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from math import inf
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from numpy.typing import ArrayLike, NDArray
+
+from within.compact_graph import CompactGraph, WeightT
+from within.contraction import ContractionHierarchy
+from within.network import StreetNetwork
+from within.search import EndpointT, LinkT, dijkstra_costs, link_cost, link_costs
+
+# Origins are split into this many chunks per process to even out the load
+CHUNKS_PER_PROCESS = 4
+
+# Per node, (destination indices, costs) of the destinations reaching it
+# backwards up the hierarchy
+BucketsT = Dict[int, Tuple[NDArray[np.int64], NDArray[np.float64]]]
+
+
+class _MatrixRows:
+    """
+    Computes matrix rows for any origins towards a fixed set of destinations.
+    With a contraction hierarchy, the destinations' backward search spaces are
+    stored in buckets at the nodes they reach, so each origin takes a single
+    upward search which scans the buckets of the nodes it settles. Otherwise
+    each origin takes one Dijkstra search stopping once every destination is
+    reached.
+    """
+
+    def __init__(
+        self,
+        graph: CompactGraph,
+        weight: WeightT,
+        destinations: List[EndpointT],
+        hierarchy: Optional[ContractionHierarchy] = None,
+        buckets: Optional[BucketsT] = None,
+    ) -> None:
+        self.graph = graph
+        self.weight = weight
+        self.num_destinations = len(destinations)
+        self.hierarchy = hierarchy
+        self.buckets = buckets
+        weights = graph.adjacency(weight)[2]
+        links = [
+            (idx, link)
+            for idx, destination in enumerate(destinations)
+            for link in destination.incoming
+        ]
+        self.link_destinations = np.array([idx for idx, _ in links], dtype=np.int64)
+        self.link_nodes = [link.node for _, link in links]
+        self.link_costs = np.array([link_cost(link, weights) for _, link in links])
+        self.target_nodes: Set[int] = set(self.link_nodes)
+        # Destinations part way along each edge, for origins on the same edge
+        self.along_edges: Dict[int, List[Tuple[int, LinkT]]] = defaultdict(list)
+        for idx, link in links:
+            if link.edge >= 0:
+                self.along_edges[link.edge].append((idx, link))
+
+    def rows(self, origins: Sequence[EndpointT]) -> NDArray[np.float64]:
+        weights = self.graph.adjacency(self.weight)[2]
+        result = np.full((len(origins), self.num_destinations), inf)
+        for row, origin in zip(result, origins):
+            if self.hierarchy is not None and self.buckets is not None:
+                for node, cost in self.hierarchy.search_space(origin.outgoing).items():
+                    if node in self.buckets:
+                        indices, destination_costs = self.buckets[node]
+                        row[indices] = np.minimum(
+                            row[indices], destination_costs + cost
+                        )
+            else:
+                costs = dijkstra_costs(
+                    self.graph,
+                    link_costs(origin.outgoing, weights),
+                    self.weight,
+                    self.target_nodes,
+                )
+                np.minimum.at(
+                    row,
+                    self.link_destinations,
+                    np.array([costs.get(node, inf) for node in self.link_nodes])
+                    + self.link_costs,
+                )
+            for origin_link in origin.outgoing:
+                for idx, link in self.along_edges.get(origin_link.edge, ()):
+                    if origin_link.share + link.share >= 1:
+                        row[idx] = min(
+                            row[idx],
+                            (origin_link.share + link.share - 1) * weights[link.edge],
+                        )
+        return result
+
+
+# Set in each worker process by _init_worker
+_worker_rows: Optional[_MatrixRows] = None
+
+
+def _init_worker(rows: _MatrixRows) -> None:
+    global _worker_rows
+    _worker_rows = rows
+
+
+def _compute_rows(origins: Sequence[EndpointT]) -> NDArray[np.float64]:
+    assert _worker_rows is not None
+    return _worker_rows.rows(origins)
+
+
+def _snap(network: StreetNetwork, points: ArrayLike) -> List[EndpointT]:
+    coordinates = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    endpoints, _ = network.snap_to_edges(coordinates[:, 0], coordinates[:, 1])
+    return endpoints
+
+
+def cost_matrix(
+    network: StreetNetwork,
+    origins: ArrayLike,
+    destinations: ArrayLike,
+    weight: WeightT = "length",
+    processes: int = 1,
+) -> NDArray[np.float64]:
+    """
+    Route length (meters) or travel time (seconds) from every origin to every
+    destination, as an (origins, destinations) array with inf where there is
+    no route. origins and destinations are (latitude, longitude) rows,
+    snapped to the street network like the end points of Routing.
+
+    Uses the network's contraction hierarchy for weight when one is prepared
+    (bucket based many-to-many), otherwise one Dijkstra search per origin.
+    With more than one process the origins are split between worker
+    processes, each receiving a copy of the graph once.
+    """
+    compact = network.compact
+    assert compact.has_weight(weight), f"street network has no {weight}"
+    origin_endpoints = _snap(network, origins)
+    destination_endpoints = _snap(network, destinations)
+    hierarchy = network.hierarchies.get(weight)
+    buckets: Optional[BucketsT] = None
+    if hierarchy is not None:
+        entries: Dict[int, List[Tuple[int, float]]] = defaultdict(list)
+        for idx, destination in enumerate(destination_endpoints):
+            reached = hierarchy.search_space(destination.incoming, backward=True)
+            for node, cost in reached.items():
+                entries[node].append((idx, cost))
+        buckets = {
+            node: (
+                np.array([idx for idx, _ in bucket], dtype=np.int64),
+                np.array([cost for _, cost in bucket]),
+            )
+            for node, bucket in entries.items()
+        }
+    rows = _MatrixRows(compact, weight, destination_endpoints, hierarchy, buckets)
+    if processes <= 1 or len(origin_endpoints) <= 1:
+        return rows.rows(origin_endpoints)
+
+    num_chunks = min(len(origin_endpoints), processes * CHUNKS_PER_PROCESS)
+    bounds = np.linspace(0, len(origin_endpoints), num_chunks + 1).astype(int)
+    chunks = [origin_endpoints[start:end] for start, end in zip(bounds, bounds[1:])]
+    with ProcessPoolExecutor(
+        max_workers=processes, initializer=_init_worker, initargs=(rows,)
+    ) as executor:
+        return np.vstack(list(executor.map(_compute_rows, chunks)))
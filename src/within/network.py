@@ -0,0 +1,299 @@
+# Street networks shared between routing queries
+
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Literal, Optional, Tuple
+
+import networkx
+import numpy as np
+from networkx import MultiDiGraph
+from numpy.typing import ArrayLike, NDArray
+from typing_extensions import TypedDict
+
+from within.compact_graph import (
+    POSSIBLE_WEIGHTS,
+    CompactGraph,
+    WeightT,
+    read_manifest,
+)
+from within.contraction import ContractionHierarchy
+from within.graph_cache import load_graph
+from within.search import EndpointT, LinkT, node_endpoint
+from within.spatial_index import EdgeIndex, NodeIndex
+from within.spherical_geometry import CoordT, great_circle_distance
+
+TransportModeT = Literal["bike", "drive", "walk"]
+POSSIBLE_TRANSPORTATION_MODES: List[TransportModeT] = [
+    # "all",
+    # "all_public",
+    "bike",
+    "drive",
+    # "drive_service",
+    "walk",
+]
+
+# Points snapped to within this many meters of the end of an edge are snapped
+# to the node there instead, rather than to a virtual node next to it
+SNAP_NODE_TOLERANCE_M = 1.0
+# Points up to this far outside the bounding box of a street network still
+# count as covered by it, e.g. addresses set back from the outermost street
+COVERS_MARGIN_M = 250.0
+
+
+class EdgeDataT(TypedDict, total=False):
+    length: float
+    travel_time: float
+    name: str | List[str]
+
+
+class StreetNetwork:
+    """
+    A street graph together with the lookup structures derived from it. The
+    graph is never modified once the network is created, so one instance can
+    be shared by any number of Routing queries, including from multiple
+    threads. Spatial indexes are built (or loaded from the snapshot) on first
+    use, under a lock.
+    """
+
+    def __init__(
+        self,
+        graph: Optional[MultiDiGraph] = None,
+        compact: Optional[CompactGraph] = None,
+        node_index: Optional[NodeIndex] = None,
+        keep_graph: bool = False,
+        snapshot: Optional[Path] = None,
+        transport_mode: Optional[TransportModeT] = None,
+    ) -> None:
+        """
+        Built from an osmnx graph, or from just the compact graph (e.g. an
+        opened snapshot). The networkx graph is dropped once converted, as
+        it takes several times the memory of the compact graph, unless
+        keep_graph is set. snapshot is the directory the spatial indexes are
+        loaded from when saved there. transport_mode is what the graph was
+        downloaded for, if known, and is saved with snapshots.
+        """
+        assert graph is not None or compact is not None, "graph or compact required"
+        self.graph: Optional[MultiDiGraph] = (
+            networkx.freeze(graph) if keep_graph and graph is not None else None
+        )
+        if compact is None:
+            compact = CompactGraph.from_networkx(graph)
+        self.compact = compact
+        self.snapshot = snapshot
+        self.transport_mode = transport_mode
+        self._lock = threading.Lock()
+        self._node_index = node_index
+        self._edge_index: Optional[EdgeIndex] = None
+        self.hierarchies: Dict[WeightT, ContractionHierarchy] = {}
+
+    @property
+    def node_index(self) -> NodeIndex:
+        """KD-tree over the nodes, only needed for snap_to_nodes"""
+        with self._lock:
+            if self._node_index is None:
+                path = self._saved_node_index()
+                self._node_index = (
+                    NodeIndex.load(path)
+                    if path is not None
+                    else NodeIndex.build(
+                        self.compact.latitudes, self.compact.longitudes
+                    )
+                )
+            return self._node_index
+
+    @property
+    def edge_index(self) -> EdgeIndex:
+        """R-tree over the edges, built on the first snap_to_edges"""
+        with self._lock:
+            if self._edge_index is None:
+                directory = (
+                    None if self.snapshot is None else self.snapshot / "edge_index"
+                )
+                if directory is not None and (directory / "manifest.json").exists():
+                    self._edge_index = EdgeIndex.load(directory)
+                else:
+                    self._edge_index = EdgeIndex.build(*self.compact.polylines())
+            return self._edge_index
+
+    def _saved_node_index(self) -> Optional[Path]:
+        if self.snapshot is None:
+            return None
+        path = self.snapshot / "node_index.pickle"
+        return path if path.exists() else None
+
+    @classmethod
+    def open_snapshot(cls, directory: Path) -> "StreetNetwork":
+        """
+        Open a snapshot including any contraction hierarchies saved with it.
+        The spatial indexes saved with it are loaded on first use.
+        """
+        # Snapshots from before transport modes were recorded have no metadata
+        metadata = read_manifest(directory).get("metadata", {})
+        network = cls(
+            compact=CompactGraph.load(directory),
+            snapshot=directory,
+            transport_mode=metadata.get("transport_mode"),
+        )
+        for weight in POSSIBLE_WEIGHTS:
+            ch_directory = directory / f"ch-{weight}"
+            if ch_directory.exists():
+                network.hierarchies[weight] = ContractionHierarchy.load(
+                    ch_directory, network.compact, weight
+                )
+        return network
+
+    def save_snapshot(self, directory: Path) -> None:
+        self.compact.save(directory, {"transport_mode": self.transport_mode})
+        self.edge_index.save(directory / "edge_index")
+        # The node index is saved only if in use, it is not needed for routing
+        if self._node_index is not None or self._saved_node_index() is not None:
+            self.node_index.save(directory / "node_index.pickle")
+        for weight, hierarchy in self.hierarchies.items():
+            hierarchy.save(directory / f"ch-{weight}")
+
+    def covers(self, latitude: float, longitude: float) -> bool:
+        """Whether the point is within COVERS_MARGIN_M of the network's bounds"""
+        south, west, north, east = self.compact.bounds()
+        offset_m = 1000 * great_circle_distance(
+            latitude,
+            longitude,
+            min(max(latitude, south), north),
+            min(max(longitude, west), east),
+        )
+        return offset_m <= COVERS_MARGIN_M
+
+    def snap_to_nodes(
+        self, latitudes: ArrayLike, longitudes: ArrayLike
+    ) -> Tuple[NDArray[np.int64], NDArray[np.float64]]:
+        """
+        (node indices in the compact graph, distances in meters) of the nodes
+        closest to each point, in one vectorized query
+        """
+        return self.node_index.nearest(latitudes, longitudes)
+
+    def snap_to_edges(
+        self, latitudes: ArrayLike, longitudes: ArrayLike
+    ) -> Tuple[List[EndpointT], NDArray[np.float64]]:
+        """
+        (search end points, distances in meters) at the closest point on any
+        edge to each point, following the curved geometry of simplified edges.
+        Unlike the closest node, which may be hundreds of meters away at the
+        other end of a long edge, routes then start and end where the points
+        are.
+        """
+        compact = self.compact
+        match = self.edge_index.nearest(latitudes, longitudes)
+        sources = compact.sources(match.edges)
+        endpoints: List[EndpointT] = []
+        for edge, source, fraction, latitude, longitude in zip(
+            match.edges.tolist(),
+            sources.tolist(),
+            match.fractions.tolist(),
+            match.latitudes.tolist(),
+            match.longitudes.tolist(),
+        ):
+            target = int(compact.targets[edge])
+            length = float(compact.lengths[edge])
+            if fraction * length <= SNAP_NODE_TOLERANCE_M:
+                endpoints.append(node_endpoint(compact, source))
+                continue
+            if (1 - fraction) * length <= SNAP_NODE_TOLERANCE_M:
+                endpoints.append(node_endpoint(compact, target))
+                continue
+            outgoing = [LinkT(target, edge, 1 - fraction)]
+            incoming = [LinkT(source, edge, fraction)]
+            for reverse in range(compact.offsets[target], compact.offsets[target + 1]):
+                # The same street the other way, not another street between
+                # the same nodes
+                if compact.targets[reverse] == source and np.isclose(
+                    compact.lengths[reverse], length
+                ):
+                    outgoing.append(LinkT(source, reverse, fraction))
+                    incoming.append(LinkT(target, reverse, 1 - fraction))
+            endpoints.append(
+                EndpointT(latitude, longitude, tuple(outgoing), tuple(incoming))
+            )
+        return endpoints, match.dist_m
+
+    def prepare_contraction_hierarchy(
+        self, weight: WeightT = "length", directory: Optional[Path] = None
+    ) -> ContractionHierarchy:
+        """
+        Contraction hierarchy for weight, used by single route queries from
+        then on. Loaded from directory when one was saved there for this graph,
+        otherwise built (which is slow) and saved to directory. Prepare before
+        sharing the network between threads.
+        """
+        if weight not in self.hierarchies:
+            hierarchy = None
+            if directory is not None and (directory / "manifest.json").exists():
+                try:
+                    hierarchy = ContractionHierarchy.load(
+                        directory, self.compact, weight
+                    )
+                except Exception as e:
+                    print(f"Rebuilding contraction hierarchy: {e}")
+            if hierarchy is None:
+                hierarchy = ContractionHierarchy.build(self.compact, weight)
+                if directory is not None:
+                    hierarchy.save(directory)
+            self.hierarchies[weight] = hierarchy
+        return self.hierarchies[weight]
+
+
+class RegionalNetwork:
+    """
+    Street networks of a fixed region (a disc of radius_m around center),
+    loaded once per transport mode and kept in memory. Intended for long-lived
+    processes answering many routing queries in the same area:
+    `Routing(..., region=region)` reuses the shared network so each query
+    only pays for snapping its end points and the search itself.
+    """
+
+    def __init__(
+        self,
+        center: CoordT,
+        radius_m: float,
+        transport_modes: Iterable[TransportModeT] = POSSIBLE_TRANSPORTATION_MODES,
+        keep_graph: bool = False,
+    ) -> None:
+        """keep_graph: Keep the networkx graphs, see StreetNetwork"""
+        self.center = center
+        self.radius_m = radius_m
+        self.transport_modes = list(transport_modes)
+        self.keep_graph = keep_graph
+        self._lock = threading.Lock()
+        self._networks: Dict[TransportModeT, StreetNetwork] = {}
+        for transport_mode in self.transport_modes:
+            self.network(transport_mode)
+
+    def network(self, transport_mode: TransportModeT) -> StreetNetwork:
+        assert (
+            transport_mode in self.transport_modes
+        ), f"transport_mode {transport_mode} not loaded for this region"
+        with self._lock:
+            if transport_mode not in self._networks:
+                self._networks[transport_mode] = StreetNetwork(
+                    load_graph(self.center, self.radius_m, transport_mode),
+                    keep_graph=self.keep_graph,
+                    transport_mode=transport_mode,
+                )
+            return self._networks[transport_mode]
+
+    def prepare_contraction_hierarchies(
+        self, weight: WeightT = "length", directory: Optional[Path] = None
+    ) -> None:
+        """
+        Contraction hierarchies for all transport modes of the region, kept in
+        directory/<transport mode> when directory is given.
+        """
+        for transport_mode in self.transport_modes:
+            self.network(transport_mode).prepare_contraction_hierarchy(
+                weight, None if directory is None else directory / transport_mode
+            )
+
+    def covers(self, latitude: float, longitude: float) -> bool:
+        offset_m = 1000 * great_circle_distance(
+            self.center[0], self.center[1], latitude, longitude
+        )
+        return offset_m <= self.radius_m
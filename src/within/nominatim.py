@@ -1,16 +1,44 @@
 import json
+import os
+import re
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from time import sleep
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, cast
 
 import requests
+from requests.adapters import HTTPAdapter
 from typing_extensions import TypedDict
 
-NOMINATIM_ENDPOINT = "https://nominatim.openstreetmap.org/search"
+from within.cache import CacheStatsT, LRUCache, SingleFlight, SQLiteCache
+from within.rate_limit import TokenBucket, backoff_delay
+
+NOMINATIM_ENDPOINT = os.getenv(
+    "NOMINATIM_ENDPOINT", "https://nominatim.openstreetmap.org/search"
+)
 REQUEST_TIMEOUT = 2  # seconds
-RETRY_PAUSE = 20  # seconds
+# Public API requests are limited to 1 per second
+REQUESTS_PER_SECOND = float(os.getenv("NOMINATIM_REQUESTS_PER_SECOND", "1"))
+BACKOFF_BASE = 1  # seconds
+BACKOFF_MAX = 60  # seconds
+# Worker threads used by bulk_coords_from_addresses
+DEFAULT_CONCURRENCY = 8
+# Max kept-alive connections to the endpoint. Should cover DEFAULT_CONCURRENCY.
+POOL_SIZE = int(os.getenv("NOMINATIM_POOL_SIZE", str(DEFAULT_CONCURRENCY)))
+CACHE_DB_PATH = Path(__file__).parent / "nominatim_cache.sqlite3"
+# Legacy whole-file JSON cache. Imported into the SQLite cache on first use.
 CACHE_FILE_PATH = Path(__file__).parent / "nominatim_cache.json"
 USE_CACHE = True
+# In-memory LRU in front of the disk cache for frequently requested addresses
+MEMORY_CACHE_MAX_ENTRIES = 10_000
+MEMORY_CACHE_MAX_BYTES = 16 * 1024**2
+MEMORY_CACHE_TTL: Optional[float] = None  # seconds
+# Addresses without results are retried after a day, lookups that failed
+# (e.g. exhausted retries) after 10 minutes. Found addresses do not expire.
+NEGATIVE_CACHE_TTL = 24 * 3600  # seconds
+FAILURE_CACHE_TTL = 10 * 60  # seconds
 
 
 class ResponseJSONType(TypedDict):
@@ -18,25 +46,84 @@ class ResponseJSONType(TypedDict):
     lon: float
 
 
-def _read_cache(address: str) -> Optional[List[ResponseJSONType]]:
-    if not CACHE_FILE_PATH.exists():
+def _response_size(response: List[ResponseJSONType]) -> int:
+    return len(json.dumps(response))
+
+
+_rate_limiter = TokenBucket(REQUESTS_PER_SECOND)
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_in_flight: SingleFlight[Tuple[List[ResponseJSONType], bool]] = SingleFlight()
+_cache_store: Optional[SQLiteCache] = None
+_cache_store_lock = threading.Lock()
+_memory_cache: LRUCache[List[ResponseJSONType]] = LRUCache(
+    max_entries=MEMORY_CACHE_MAX_ENTRIES,
+    max_bytes=MEMORY_CACHE_MAX_BYTES,
+    ttl_s=MEMORY_CACHE_TTL,
+    sizeof=_response_size,
+)
+
+
+def _get_cache_store() -> SQLiteCache:
+    """
+    Open the SQLite cache at CACHE_DB_PATH, importing the legacy JSON cache
+    the first time. Reopens if CACHE_DB_PATH has been changed.
+    """
+    global _cache_store
+    with _cache_store_lock:
+        if _cache_store is None or _cache_store.path != CACHE_DB_PATH:
+            if _cache_store is not None:
+                _cache_store.close()
+            # The memory layer mirrors the store it sits in front of
+            _memory_cache.clear()
+            _cache_store = SQLiteCache(CACHE_DB_PATH)
+            _cache_store.migrate_from_json(
+                CACHE_FILE_PATH, key_func=normalize_query, ttl_func=_cache_ttl
+            )
+        return _cache_store
+
+
+def normalize_query(address: str) -> str:
+    """
+    Cache key for an address query. Unicode normalized and case folded with
+    punctuation removed and whitespace collapsed, so trivially different
+    spellings of the same address share a cache entry.
+    """
+    normalized = unicodedata.normalize("NFKC", address).casefold()
+    normalized = re.sub(r"[^\w\s]", " ", normalized)
+    return " ".join(normalized.split())
+
+
+def _cache_ttl(result: List[ResponseJSONType]) -> Optional[float]:
+    """Seconds to cache a Nominatim result for, None for ever"""
+    return None if result else NEGATIVE_CACHE_TTL
+
+
+def _read_cache(key: str) -> Optional[List[ResponseJSONType]]:
+    store = _get_cache_store()
+    cached_result = _memory_cache.get(key)
+    if cached_result is not None:
+        return cached_result
+    entry = store.get_with_ttl(key)
+    if entry is None:
         return None
-    with CACHE_FILE_PATH.open("r") as fh:
-        cached_data: Dict[str, List[ResponseJSONType]] = json.load(fh)
-    return cached_data.get(address, None)
+    # Expires from memory when it does from the store, e.g. failures after
+    # FAILURE_CACHE_TTL rather than NEGATIVE_CACHE_TTL
+    cached_result, ttl_s = entry
+    _memory_cache.set(key, cached_result, ttl_s=ttl_s)
+    return cast(List[ResponseJSONType], cached_result)
 
 
-def _write_cache(address: str, result: List[ResponseJSONType]) -> None:
-    cached_data: Dict[str, List[ResponseJSONType]]
-    if CACHE_FILE_PATH.exists():
-        with CACHE_FILE_PATH.open("r") as fh:
-            cached_data = json.load(fh)
-    else:
-        CACHE_FILE_PATH.parent.mkdir(parents=True, exist_ok=True)
-        cached_data = {}
-    cached_data[address] = result
-    with CACHE_FILE_PATH.open("w") as fh:
-        json.dump(cached_data, fh, sort_keys=True, indent=2)
+def _write_cache(
+    key: str, result: List[ResponseJSONType], ttl_s: Optional[float] = None
+) -> None:
+    _get_cache_store().set(key, result, ttl_s=ttl_s)
+    _memory_cache.set(key, result, ttl_s=ttl_s)
+
+
+def memory_cache_stats() -> CacheStatsT:
+    """Hit, miss and eviction counters for the in-memory geocoding cache"""
+    return _memory_cache.stats()
 
 
 def _coords_from_response(
@@ -53,28 +140,60 @@ def _coords_from_response(
     return (response[0]["lat"], response[0]["lon"])
 
 
-def _coords_from_address(
-    address: str,
-    retry_count: int = 3,
-) -> Tuple[Tuple[float, float] | None, bool]:
+def _get_session() -> requests.Session:
+    """Shared HTTP session keeping up to POOL_SIZE connections alive"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            # Nominative wants custom headers
+            session.headers.update(
+                {
+                    "User-Agent": "Toy street routing project",
+                    "referer": "https://github.com/lillekemiker/within",
+                    "Accept-Language": "en",
+                }
+            )
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def configure_session(
+    endpoint: Optional[str] = None, pool_size: Optional[int] = None
+) -> None:
     """
-    Send a HTTP GET request to the Nominatim API and return response.
-    Returns ((lat, long), was_read_from_cache)
+    Point geocoding at another Nominatim instance and/or resize the connection
+    pool. Open connections are closed and a new session is created on next use.
     """
-    if USE_CACHE:
-        cached_result = _read_cache(address)
-        if cached_result is not None:
-            return _coords_from_response(cached_result), True
+    global NOMINATIM_ENDPOINT, POOL_SIZE, _session
+    with _session_lock:
+        if endpoint is not None:
+            NOMINATIM_ENDPOINT = endpoint
+        if pool_size is not None:
+            POOL_SIZE = pool_size
+        if _session is not None:
+            _session.close()
+            _session = None
 
-    # Nominative wants custom headers
-    headers = dict(requests.utils.default_headers())
-    headers.update(
-        {
-            "User-Agent": "Toy street routing project",
-            "referer": "https://github.com/lillekemiker/within",
-            "Accept-Language": "en",
-        }
+
+def _back_off(attempt: int, response: requests.Response) -> None:
+    delay = backoff_delay(
+        attempt, BACKOFF_BASE, BACKOFF_MAX, response.headers.get("Retry-After")
     )
+    print(f"Retrying in {delay:.1f} seconds")
+    # Pausing the shared limiter holds back every caller, not just this one
+    _rate_limiter.pause(delay)
+
+
+def _request_nominatim(address: str, retry_count: int) -> List[ResponseJSONType]:
+    """
+    Send rate limited HTTP GET requests to the Nominatim API until it returns
+    a list of results, backing off on transient errors.
+    """
+    session = _get_session()
     params: Dict[str, str | int] = {
         "q": address,
         "format": "json",
@@ -82,48 +201,105 @@ def _coords_from_address(
         "dedupe": 0,
     }
 
-    # transmit the HTTP GET request
-    response = requests.get(
-        NOMINATIM_ENDPOINT,
-        params=params,
-        timeout=REQUEST_TIMEOUT,
-        headers=headers,
-    )
-
-    # retry on 429 and 504 errors
-    if response.status_code in (429, 504):
-        print(
-            f"{NOMINATIM_ENDPOINT} responded {response.status_code} {response.reason}"
+    for attempt in range(retry_count + 1):
+        _rate_limiter.acquire()
+        # transmit the HTTP GET request
+        response = session.get(
+            NOMINATIM_ENDPOINT,
+            params=params,
+            timeout=REQUEST_TIMEOUT,
         )
-        if retry_count > 0:
-            print(f"Retrying {RETRY_PAUSE} seconds")
-            sleep(RETRY_PAUSE)
-            return _coords_from_address(address, retry_count=retry_count - 1)
-        else:
+
+        # retry on 429 and 504 errors
+        if response.status_code in (429, 504):
+            print(
+                f"{NOMINATIM_ENDPOINT} responded {response.status_code} "
+                f"{response.reason}"
+            )
+            if attempt < retry_count:
+                _back_off(attempt, response)
+            continue
+
+        try:
+            response_json: Optional[List[ResponseJSONType]] = response.json()
+        except requests.JSONDecodeError:
+            print(
+                f"{NOMINATIM_ENDPOINT} responded {response.status_code} "
+                f"{response.reason}: {response.text}"
+            )
+            if attempt < retry_count:
+                _back_off(attempt, response)
+            continue
+
+        if not isinstance(response_json, list):
+            # Not retrying because this is not expected to be a transient error.
+            print("Nominatim API did not return a list of results.")
             raise Exception(f"Failed to parse address input: {address}")
+        return response_json
+
+    raise Exception(f"Failed to parse address input: {address}")
+
+
+def _fetch_and_cache(
+    address: str, key: str, retry_count: int
+) -> Tuple[List[ResponseJSONType], bool]:
+    if USE_CACHE:
+        # Another caller may have completed this lookup since our cache miss
+        cached_result = _read_cache(key)
+        if cached_result is not None:
+            return cached_result, True
 
     try:
-        response_json: Optional[List[ResponseJSONType]] = response.json()
-    except requests.JSONDecodeError:
-        print(
-            f"{NOMINATIM_ENDPOINT} responded {response.status_code} {response.reason}: "
-            f"{response.text}"
-        )
-        if retry_count > 0:
-            print(f"Retrying {RETRY_PAUSE} seconds")
-            sleep(RETRY_PAUSE)
-            return _coords_from_address(address, retry_count=retry_count - 1)
-        else:
-            raise Exception(f"Failed to parse address input: {address}")
+        response_json = _request_nominatim(address, retry_count)
+    except Exception:
+        if USE_CACHE:
+            # Remember the failure as an empty result to save rate limit budget
+            _write_cache(key, [], ttl_s=FAILURE_CACHE_TTL)
+        raise
 
-    if not isinstance(response_json, list):
-        # Not retrying because this is not expected to be a transient error.
-        print("Nominatim API did not return a list of results.")
-        raise Exception(f"Failed to parse address input: {address}")
+    if USE_CACHE:
+        _write_cache(key, response_json, ttl_s=_cache_ttl(response_json))
+    return response_json, False
 
+
+def _coords_from_address(
+    address: str,
+    retry_count: int = 3,
+) -> Tuple[Tuple[float, float] | None, bool]:
+    """
+    Look up address in the cache or the Nominatim API.
+    Concurrent lookups of the same (normalized) address share a single request.
+    Returns ((lat, long), was_read_from_cache)
+    """
+    key = normalize_query(address)
     if USE_CACHE:
-        _write_cache(address, response_json)
-    return _coords_from_response(response_json), False
+        cached_result = _read_cache(key)
+        if cached_result is not None:
+            return _coords_from_response(cached_result), True
+
+    response_json, was_read_from_cache = _in_flight.do(
+        key, partial(_fetch_and_cache, address, key, retry_count)
+    )
+    return _coords_from_response(response_json), was_read_from_cache
+
+
+def set_rate_limit(requests_per_second: float, burst: int = 1) -> None:
+    """
+    Change the rate of requests sent to Nominatim. The public API allows 1 per
+    second, self-hosted instances typically allow far more.
+    """
+    global _rate_limiter
+    _rate_limiter = TokenBucket(requests_per_second, burst)
+
+
+def _try_coords_from_address(
+    address: str, retry_count: int
+) -> Optional[Tuple[float, float]]:
+    try:
+        coord, _ = _coords_from_address(address, retry_count)
+    except Exception:
+        return None
+    return coord
 
 
 def coords_from_addresses(
@@ -133,14 +309,32 @@ def coords_from_addresses(
     Takes a list of addresses and returns a list of their coordinates or None's
     for addresses that could not be resolved.
     """
-    result: List[Optional[Tuple[float, float]]] = []
-    for idx, address in enumerate(addresses):
-        try:
-            coord, was_read_from_cache = _coords_from_address(address, retry_count)
-            result.append(coord)
-        except Exception:
-            result.append(None)
-        if not was_read_from_cache and not idx == len(addresses) - 1:
-            # Public API requests are limited to 1 per second
-            sleep(1)
-    return result
+    return [_try_coords_from_address(address, retry_count) for address in addresses]
+
+
+def bulk_coords_from_addresses(
+    addresses: List[str],
+    max_concurrency: int = DEFAULT_CONCURRENCY,
+    retry_count: int = 3,
+) -> List[Optional[Tuple[float, float]]]:
+    """
+    Concurrent version of coords_from_addresses for large batches.
+    Duplicate addresses (after normalization) are only looked up once, all
+    requests share the module rate limiter and results are returned in input order.
+    """
+    keys = [normalize_query(address) for address in addresses]
+    # First spelling of each normalized address is the one sent to the API
+    unique_addresses: Dict[str, str] = {}
+    for key, address in zip(keys, addresses):
+        unique_addresses.setdefault(key, address)
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        coords = dict(
+            zip(
+                unique_addresses.keys(),
+                executor.map(
+                    partial(_try_coords_from_address, retry_count=retry_count),
+                    unique_addresses.values(),
+                ),
+            )
+        )
+    return [coords[key] for key in keys]
@@ -0,0 +1,94 @@
+# Client side rate limiting and retry backoff for external APIs
+
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import monotonic, sleep
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter shared by all callers of an API.
+    Tokens accrue continuously at `rate` per second up to `burst`. acquire()
+    reserves a token and sleeps only until that token is due, so time spent
+    waiting for earlier responses counts towards the next request's slot.
+    """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        assert rate > 0, f"rate must be positive, got {rate}"
+        assert burst >= 1, f"burst must be at least 1, got {burst}"
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        # Time from which tokens accrue, in the future while paused
+        self._updated = monotonic()
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(now - self._updated, 0.0)
+        self._tokens = min(float(self.burst), self._tokens + elapsed * self.rate)
+        self._updated = max(self._updated, now)
+
+    def acquire(self) -> float:
+        """Block until a request may be sent. Returns the time slept in seconds."""
+        with self._lock:
+            now = monotonic()
+            self._refill(now)
+            # A negative balance is a queue of reservations by other callers
+            self._tokens -= 1
+            wait = self._updated - now - self._tokens / self.rate
+        if wait > 0:
+            sleep(wait)
+        return max(wait, 0.0)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hold back all callers for `seconds`, e.g. when the server asks us to.
+        The bucket restarts with a single token when the pause ends, so the
+        first caller queued meanwhile is sent right then and the rest one slot
+        apart rather than all at once.
+        """
+        with self._lock:
+            now = monotonic()
+            self._refill(now)
+            # Slots already reserved are kept: the first free one is not moved
+            # earlier, only later up to the end of the pause
+            next_slot = self._updated + max(1.0 - self._tokens, 0.0) / self.rate
+            self._updated = max(self._updated, now + seconds)
+            self._tokens = 1.0 - max(next_slot - self._updated, 0.0) * self.rate
+
+
+def parse_retry_after(retry_after: Optional[str]) -> Optional[float]:
+    """Seconds to wait according to a Retry-After header (delay-seconds or HTTP-date)"""
+    if not retry_after:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def backoff_delay(
+    attempt: int,
+    base: float,
+    cap: float,
+    retry_after: Optional[str] = None,
+) -> float:
+    """
+    Exponential backoff with full jitter for the given (0 based) retry attempt.
+    A Retry-After header from the server is honoured as a lower bound.
+    """
+    delay = random.uniform(0, min(cap, base * 2**attempt))
+    server_delay = parse_retry_after(retry_after)
+    if server_delay is not None:
+        delay = max(delay, server_delay)
+    return delay
@@ -1,30 +1,47 @@
 # Main interface class
 
-from typing import Dict, List, Literal, Optional, Tuple
+from functools import cached_property
+from math import isnan
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, cast
 
-import osmnx
+import numpy as np
 from networkx import MultiDiGraph
-from pydantic import BaseModel
+from numpy.typing import NDArray
 from typing_extensions import TypedDict
 
-from within.address import Address
+from within.address import Address, resolve_addresses
+from within.compact_graph import UNNAMED, CompactGraph, EdgeKeyT, WeightT
+from within.graph_cache import load_corridor_graph, load_graph
+from within.network import (
+    POSSIBLE_TRANSPORTATION_MODES,
+    EdgeDataT,
+    RegionalNetwork,
+    StreetNetwork,
+    TransportModeT,
+)
+from within.search import (
+    EndpointT,
+    PathT,
+    alternative_paths,
+    bidirectional_astar,
+    end_links,
+)
 from within.spherical_geometry import (
-    get_bearing,
+    get_bearings,
     get_cardinal_direction,
     get_turning_instruction,
     great_circle_distance,
     great_circle_halfway_point,
 )
 
-TransportModeT = Literal["bike", "drive", "walk"]
-POSSIBLE_TRANSPORTATION_MODES: List[TransportModeT] = [
-    # "all",
-    # "all_public",
-    "bike",
-    "drive",
-    # "drive_service",
-    "walk",
-]
+# Beyond this distance the network is downloaded as a corridor of tiles along the
+# route rather than a disc around the midway point
+CORRIDOR_MIN_DISTANCE_KM = 20
+
+# Route node ids of end points part way along an edge (OSM node ids are positive)
+ORIGIN_NODE_ID = -1
+DESTINATION_NODE_ID = -2
 
 
 def _format_distance(dist_m: float) -> str:
@@ -35,9 +52,15 @@ def _format_distance(dist_m: float) -> str:
     return f"{dist_m:.0f} m"
 
 
-class EdgeDataT(TypedDict, total=False):
-    length: float
-    name: str | List[str]
+def _edge_data(graph: CompactGraph, edge: int, share: float = 1.0) -> EdgeDataT:
+    """Attributes of edge, or of the share of it up to or from a virtual node"""
+    edge_data: EdgeDataT = {"length": share * float(graph.lengths[edge])}
+    if not isnan(graph.travel_times[edge]):
+        edge_data["travel_time"] = share * float(graph.travel_times[edge])
+    name_id = int(graph.name_ids[edge])
+    if name_id != UNNAMED:
+        edge_data["name"] = graph.names[name_id]
+    return edge_data
 
 
 class NodeT(TypedDict):
@@ -45,41 +68,138 @@ class NodeT(TypedDict):
     y: float
 
 
-class Route(BaseModel):
-    node_idx: List[int]
-    edges: Dict[Tuple[int, int], EdgeDataT]
-    nodes: Dict[int, NodeT]
+class RouteDictT(TypedDict):
+    node_ids: List[int]
+    latitudes: List[float]
+    longitudes: List[float]
+    lengths: List[float]  # per step between nodes
+    travel_times: List[float]
+    streets: List[str]
+
+
+class Route:
+    """
+    A route as a few flat arrays: node ids and coordinates, and for each step
+    between nodes the edge taken (an index into graph) with the share of it
+    travelled, below 1 to or from a virtual node. Everything else is derived
+    from these on first access and then cached.
+    """
+
+    def __init__(
+        self,
+        graph: CompactGraph,
+        node_ids: NDArray[np.int64],
+        latitudes: NDArray[np.float64],
+        longitudes: NDArray[np.float64],
+        edge_indices: NDArray[np.int64],
+        shares: NDArray[np.float64],
+    ) -> None:
+        self.graph = graph
+        self.node_ids = node_ids
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.edge_indices = edge_indices
+        self.shares = shares
+
+    @cached_property
+    def node_idx(self) -> List[int]:
+        return cast(List[int], self.node_ids.tolist())
+
+    @cached_property
+    def nodes(self) -> Dict[int, NodeT]:
+        return {
+            node_id: {"x": longitude, "y": latitude}
+            for node_id, latitude, longitude in zip(
+                self.node_idx, self.latitudes.tolist(), self.longitudes.tolist()
+            )
+        }
+
+    @cached_property
+    def edges(self) -> Dict[Tuple[int, int], EdgeDataT]:
+        """Attributes of the edge taken for each step, keyed by node ids"""
+        return {
+            (node_a, node_b): _edge_data(self.graph, edge, share)
+            for node_a, node_b, edge, share in zip(
+                self.node_idx,
+                self.node_idx[1:],
+                self.edge_indices.tolist(),
+                self.shares.tolist(),
+            )
+        }
 
     @property
+    def edge_keys(self) -> List[EdgeKeyT]:
+        """
+        (u, v, key) of the osmnx graph edge taken for each step, including the
+        edges that steps to or from virtual nodes are part of
+        """
+        return [self.graph.edge_key(edge) for edge in self.edge_indices.tolist()]
+
+    @cached_property
+    def lengths(self) -> NDArray[np.float64]:
+        return self.graph.lengths[self.edge_indices] * self.shares
+
+    @cached_property
+    def travel_times(self) -> NDArray[np.float64]:
+        return self.graph.travel_times[self.edge_indices] * self.shares
+
+    @cached_property
+    def streets(self) -> List[str]:
+        """Street name of each step"""
+        names = self.graph.names
+        return [
+            "unnamed street" if name_id == UNNAMED else names[name_id]
+            for name_id in self.graph.name_ids[self.edge_indices].tolist()
+        ]
+
+    @cached_property
+    def bearings(self) -> List[float]:
+        """Bearing of each step"""
+        return cast(
+            List[float],
+            get_bearings(
+                self.latitudes[:-1],
+                self.longitudes[:-1],
+                self.latitudes[1:],
+                self.longitudes[1:],
+            ).tolist(),
+        )
+
+    @cached_property
     def path_coordinates(self) -> List[Dict[str, float]]:
         return [
-            {"lat": self.nodes[idx]["y"], "lon": self.nodes[idx]["x"]}
-            for idx in self.node_idx
+            {"lat": latitude, "lon": longitude}
+            for latitude, longitude in zip(
+                self.latitudes.tolist(), self.longitudes.tolist()
+            )
         ]
 
-    @property
+    @cached_property
     def total_length_m(self) -> float:
-        return self._get_route_metric("length")
+        return float(self.lengths.sum())
 
-    @property
+    @cached_property
+    def total_travel_time_s(self) -> float:
+        """Estimated travel time; NaN if the street network has no travel times"""
+        return float(self.travel_times.sum())
+
+    @cached_property
     def description(self) -> List[str]:
         result: List[str] = []
+        if not self.streets:
+            return ["Arriving at your destination."]
 
-        current_bearing = new_bearing = self._get_node_to_node_berring(
-            self.node_idx[0], self.node_idx[1]
-        )
-        current_street: str = self._get_street_name(self.node_idx[0], self.node_idx[1])
+        current_bearing = new_bearing = self.bearings[0]
+        current_street = self.streets[0]
         acc_street_distance = 0.0
-        destination_node_idx = self.node_idx[-1]
+        last_step = len(self.streets) - 1
 
-        for node_a_idx, node_b_idx in zip(self.node_idx, self.node_idx[1:]):
-            street = self._get_street_name(node_a_idx, node_b_idx)
-            edge_data = self.edges[(node_a_idx, node_b_idx)]
-            edge_length = edge_data.get("length", 0)
-            assert isinstance(edge_length, float)
+        for step, (street, edge_length, bearing) in enumerate(
+            zip(self.streets, self.lengths.tolist(), self.bearings)
+        ):
             acc_street_distance += edge_length
 
-            if street == current_street and node_b_idx != destination_node_idx:
+            if street == current_street and step != last_step:
                 # continuing along the same street - skip instruction
                 continue
 
@@ -102,58 +222,75 @@ class Route(BaseModel):
                 result.append(instruction + f"and continue for {dist_string}")
 
             current_bearing = new_bearing
-            new_bearing = self._get_node_to_node_berring(node_a_idx, node_b_idx)
+            new_bearing = bearing
             current_street = street
             acc_street_distance = 0  # reset on new street
         result.append("Arriving at your destination.")
         return result
 
-    def _get_route_metric(self, metric: Literal["length"]) -> float:
-        return sum(
-            self.edges[(node_a, node_b)][metric]
-            for node_a, node_b in zip(self.node_idx, self.node_idx[1:])
-        )
-
-    def _get_node_to_node_berring(self, node_a_idx: int, node_b_idx: int) -> float:
-        node_a = self.nodes[node_a_idx]
-        node_b = self.nodes[node_b_idx]
-        return get_bearing(node_a["y"], node_a["x"], node_b["y"], node_b["x"])
-
-    def _get_street_name(
-        self, node_a_idx: int, node_b_idx: int, default: str = "unnamed street"
-    ) -> str:
-        edge_data = self.edges[(node_a_idx, node_b_idx)]
-        street = edge_data.get("name", default)
-        if isinstance(street, list):
-            # Street as two names
-            street = "/".join(street)
-        assert isinstance(street, str)
-        return street
+    def to_dict(self) -> RouteDictT:
+        """Plain lists, e.g. for a JSON response"""
+        return {
+            "node_ids": self.node_idx,
+            "latitudes": self.latitudes.tolist(),
+            "longitudes": self.longitudes.tolist(),
+            "lengths": self.lengths.tolist(),
+            "travel_times": self.travel_times.tolist(),
+            "streets": self.streets,
+        }
 
 
 class Routing:
-    _network: Optional[MultiDiGraph] = None
-    _origin_node: int
-    _dest_node: int
-    _origin_node_dist_m: float
-    _dest_node_dist_m: float
-    _edge_data: Dict[Tuple[int, int], EdgeDataT]
+    _street_network: Optional[StreetNetwork] = None
+    # End points snapped to the edges of the street network
+    _origin: EndpointT
+    _dest: EndpointT
+    _origin_dist_m: float
+    _dest_dist_m: float
 
     def __init__(
         self,
         starting_point: Address,
         destination: Address,
         transport_mode: TransportModeT,
+        use_corridor: Optional[bool] = None,
+        region: Optional[RegionalNetwork] = None,
+        snapshot: Optional[Path] = None,
+        weight_by: WeightT = "length",
+        keep_graph: bool = False,
     ) -> None:
+        """
+        use_corridor: Download the network as tiles along the route rather than
+        as a disc around the midway point. By default only for routes longer
+        than CORRIDOR_MIN_DISTANCE_KM.
+        region: Preloaded network shared with other queries. Both end points
+        must be inside the region. Nothing is downloaded when given.
+        snapshot: Directory of a street network snapshot for transport_mode
+        (see StreetNetwork.save_snapshot) to open instead of downloading.
+        weight_by: Minimize route length or travel time.
+        keep_graph: Keep the networkx graph of a downloaded network as
+        `network`, e.g. for plotting. Regions keep theirs when created with
+        keep_graph and snapshots have none.
+        """
         self.starting_point = starting_point
         self.destination = destination
         assert (
             transport_mode in POSSIBLE_TRANSPORTATION_MODES
         ), f"invalid transport_mode {transport_mode}"
         self.transport_mode = transport_mode
+        self._use_corridor = use_corridor
+        self.region = region
+        self.snapshot = snapshot
+        self.weight_by = weight_by
+        self.keep_graph = keep_graph
+
+    def _resolve_addresses(self) -> None:
+        # Resolve both ends together rather than one after the other on access
+        resolve_addresses([self.starting_point, self.destination])
 
     @property
     def as_the_crow_flies_distance_km(self) -> float:
+        self._resolve_addresses()
         return great_circle_distance(
             self.starting_point.latitude,
             self.starting_point.longitude,
@@ -166,6 +303,7 @@ class Routing:
         """
         (latitude, longitude) for halfway point between starting point and destination
         """
+        self._resolve_addresses()
         return great_circle_halfway_point(
             self.starting_point.latitude,
             self.starting_point.longitude,
@@ -174,50 +312,132 @@ class Routing:
         )
 
     @property
-    def network(self) -> MultiDiGraph:
-        if self._network is None:
-            network_radius_m = 1000 * (self.as_the_crow_flies_distance_km / 2 + 1)
-            self._network = osmnx.graph.graph_from_point(
-                self.midway_coordinate,
-                network_radius_m,
-                network_type=self.transport_mode,
-            )
-            origin_node, origin_node_dist_m = osmnx.distance.nearest_nodes(
-                self.network,
-                self.starting_point.longitude,
-                self.starting_point.latitude,
-                return_dist=True,
+    def use_corridor(self) -> bool:
+        if self._use_corridor is None:
+            return self.as_the_crow_flies_distance_km > CORRIDOR_MIN_DISTANCE_KM
+        return self._use_corridor
+
+    @property
+    def street_network(self) -> StreetNetwork:
+        if self._street_network is None:
+            self._street_network = self._load_street_network()
+            self._snap_end_points()
+        return self._street_network
+
+    @property
+    def network(self) -> Optional[MultiDiGraph]:
+        """
+        The networkx graph if kept (see keep_graph), otherwise None. Routes
+        are found on street_network.compact.
+        """
+        return self.street_network.graph
+
+    @property
+    def snap_distances_m(self) -> Tuple[float, float]:
+        """
+        Distances (m) from the starting point and the destination to the
+        points on the street network the routes start and end at
+        """
+        self.street_network
+        return self._origin_dist_m, self._dest_dist_m
+
+    def _load_street_network(self) -> StreetNetwork:
+        self._resolve_addresses()
+        if self.region is not None:
+            for address in (self.starting_point, self.destination):
+                assert self.region.covers(
+                    address.latitude, address.longitude
+                ), f"{address.location_description} is outside the routing region"
+            return self.region.network(self.transport_mode)
+        if self.snapshot is not None:
+            network = StreetNetwork.open_snapshot(self.snapshot)
+            assert network.transport_mode in (None, self.transport_mode), (
+                f"snapshot {self.snapshot} is of the {network.transport_mode} "
+                f"network, not {self.transport_mode}"
             )
-            self._origin_node = int(origin_node)
-            self._origin_node_dist_m = float(origin_node_dist_m)
-            dest_node, dest_node_dist_m = osmnx.distance.nearest_nodes(
-                self.network,
-                self.destination.longitude,
-                self.destination.latitude,
-                return_dist=True,
+            for address in (self.starting_point, self.destination):
+                assert network.covers(
+                    address.latitude, address.longitude
+                ), f"{address.location_description} is outside the snapshot"
+            return network
+        if self.use_corridor:
+            return StreetNetwork(
+                load_corridor_graph(
+                    (self.starting_point.latitude, self.starting_point.longitude),
+                    (self.destination.latitude, self.destination.longitude),
+                    self.transport_mode,
+                ),
+                keep_graph=self.keep_graph,
+                transport_mode=self.transport_mode,
             )
-            self._dest_node = int(dest_node)
-            self._dest_node_dist_m = float(dest_node_dist_m)
-            self._edge_data = {
-                (u, v): edge_data for u, v, edge_data in self.network.edges(data=True)
-            }
-        return self._network
-
-    def _get_shortest_paths(self, *, k: int = 1, weight_by: str) -> List[Route]:
-        idx_paths = osmnx.routing.k_shortest_paths(
-            self.network, self._origin_node, self._dest_node, k, weight=weight_by
+        network_radius_m = 1000 * (self.as_the_crow_flies_distance_km / 2 + 1)
+        return StreetNetwork(
+            load_graph(self.midway_coordinate, network_radius_m, self.transport_mode),
+            keep_graph=self.keep_graph,
+            transport_mode=self.transport_mode,
+        )
+
+    def _snap_end_points(self) -> None:
+        endpoints, dist_m = self.street_network.snap_to_edges(
+            [self.starting_point.latitude, self.destination.latitude],
+            [self.starting_point.longitude, self.destination.longitude],
+        )
+        self._origin, self._dest = endpoints
+        self._origin_dist_m = float(dist_m[0])
+        self._dest_dist_m = float(dist_m[1])
+
+    def _get_shortest_paths(self, *, k: int = 1, weight_by: WeightT) -> List[Route]:
+        compact = self.street_network.compact
+        assert compact.has_weight(weight_by), f"street network has no {weight_by}"
+        hierarchy = self.street_network.hierarchies.get(weight_by)
+        if k == 1:
+            if hierarchy is not None:
+                path = hierarchy.shortest_path(self._origin, self._dest)
+            else:
+                # Goal directed search settles far fewer nodes than Yen's
+                path = bidirectional_astar(compact, self._origin, self._dest, weight_by)
+            paths = [] if path is None else [path]
+        else:
+            paths = alternative_paths(compact, self._origin, self._dest, k, weight_by)
+        return [self._route(path, weight_by) for path in paths]
+
+    def _route(self, path: PathT, weight_by: WeightT) -> Route:
+        """Route of path, with virtual nodes at end points part way along an edge"""
+        compact = self.street_network.compact
+        node_ids = compact.node_ids[path.nodes].tolist()
+        latitudes = compact.latitudes[path.nodes].tolist()
+        longitudes = compact.longitudes[path.nodes].tolist()
+        edge_indices = list(path.edges)
+        shares = [1.0] * len(path.edges)
+        origin_link, dest_link = end_links(
+            path, self._origin, self._dest, compact.adjacency(weight_by)[2]
+        )
+        if not path.nodes:
+            # Both end points on the same edge
+            edge_indices = [origin_link.edge]
+            shares = [origin_link.share + dest_link.share - 1]
+        elif origin_link.edge >= 0:
+            edge_indices.insert(0, origin_link.edge)
+            shares.insert(0, origin_link.share)
+        if origin_link.edge >= 0:
+            node_ids.insert(0, ORIGIN_NODE_ID)
+            latitudes.insert(0, self._origin.latitude)
+            longitudes.insert(0, self._origin.longitude)
+        if dest_link.edge >= 0:
+            if path.nodes:
+                edge_indices.append(dest_link.edge)
+                shares.append(dest_link.share)
+            node_ids.append(DESTINATION_NODE_ID)
+            latitudes.append(self._dest.latitude)
+            longitudes.append(self._dest.longitude)
+        return Route(
+            compact,
+            np.array(node_ids, dtype=np.int64),
+            np.array(latitudes),
+            np.array(longitudes),
+            np.array(edge_indices, dtype=np.int64),
+            np.array(shares),
         )
-        return [
-            Route(
-                node_idx=idx_list,
-                edges={
-                    (node_a, node_b): self._edge_data[(node_a, node_b)]
-                    for node_a, node_b in zip(idx_list, idx_list[1:])
-                },
-                nodes={idx: self.network.nodes[idx] for idx in idx_list},
-            )
-            for idx_list in idx_paths
-        ]
 
     def shortest_routes(self, k: int = 1) -> List[Route]:
-        return self._get_shortest_paths(k=k, weight_by="length")
+        return self._get_shortest_paths(k=k, weight_by=self.weight_by)
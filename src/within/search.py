@@ -0,0 +1,378 @@
+# Shortest path searches on CompactGraph
+
+from heapq import heappop, heappush
+from math import asin, cos, inf, radians, sin, sqrt
+from typing import (
+    AbstractSet,
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    cast,
+)
+
+import numpy as np
+
+from within.compact_graph import CompactGraph, WeightT
+from within.spherical_geometry import EARTH_RADIUS
+
+# Alternative routes: weight factor applied to the edges of each route found,
+# the largest share of a route that may overlap with a better one, and how
+# much longer than the best route (as a fraction) an alternative may be.
+ALTERNATIVE_PENALTY = 1.4
+ALTERNATIVE_MAX_OVERLAP = 0.6
+ALTERNATIVE_MAX_STRETCH = 0.5
+
+
+class PathT(NamedTuple):
+    cost: float
+    nodes: List[int]  # node indices from source to target
+    edges: List[int]  # edge indices, one fewer than nodes
+
+
+class LinkT(NamedTuple):
+    node: int
+    edge: int  # -1 when the end point is the node itself
+    share: float  # fraction of the edge's weight between the end point and node
+
+
+class EndpointT(NamedTuple):
+    """
+    Source or target of a search: a node, or a point part way along an edge
+    which is then a virtual node linked to the nodes at the ends of the edge
+    (through parts of the edge and of the reverse edge, if any). Virtual nodes
+    only exist in the searches that use them; the graph is never modified.
+    """
+
+    latitude: float
+    longitude: float
+    outgoing: Tuple[LinkT, ...]  # from the point to nodes, used as a source
+    incoming: Tuple[LinkT, ...]  # from nodes to the point, used as a target
+
+
+def node_endpoint(graph: CompactGraph, node: int) -> EndpointT:
+    links = (LinkT(node, -1, 0.0),)
+    return EndpointT(
+        float(graph.latitudes[node]), float(graph.longitudes[node]), links, links
+    )
+
+
+def as_endpoint(graph: CompactGraph, end: int | EndpointT) -> EndpointT:
+    return end if isinstance(end, EndpointT) else node_endpoint(graph, end)
+
+
+def link_cost(link: LinkT, weights: Sequence[float]) -> float:
+    return 0.0 if link.edge < 0 else link.share * weights[link.edge]
+
+
+def link_costs(links: Sequence[LinkT], weights: Sequence[float]) -> Dict[int, float]:
+    """Cost between the end point and each node it is linked to"""
+    costs: Dict[int, float] = {}
+    for link in links:
+        costs[link.node] = min(costs.get(link.node, inf), link_cost(link, weights))
+    return costs
+
+
+def _direct_links(source: EndpointT, target: EndpointT) -> List[Tuple[LinkT, LinkT]]:
+    """
+    Pairs of links along the same edge with target further along it than
+    source, i.e. the edge itself leads from source to target
+    """
+    return [
+        (source_link, target_link)
+        for source_link in source.outgoing
+        for target_link in target.incoming
+        if source_link.edge >= 0
+        and source_link.edge == target_link.edge
+        and source_link.share + target_link.share >= 1
+    ]
+
+
+def direct_cost(
+    source: EndpointT, target: EndpointT, weights: Sequence[float]
+) -> float:
+    """Cost from source to target without passing any node, inf if not possible"""
+    return min(
+        (
+            (source_link.share + target_link.share - 1) * weights[source_link.edge]
+            for source_link, target_link in _direct_links(source, target)
+        ),
+        default=inf,
+    )
+
+
+def end_links(
+    path: PathT, source: EndpointT, target: EndpointT, weights: Sequence[float]
+) -> Tuple[LinkT, LinkT]:
+    """
+    Links by which path leaves source and reaches target. For a path without
+    nodes both links are along the edge leading directly from source to target.
+    """
+    if not path.nodes:
+        return min(
+            _direct_links(source, target),
+            key=lambda links: links[0].share + links[1].share,
+        )
+    return (
+        min(
+            (link for link in source.outgoing if link.node == path.nodes[0]),
+            key=lambda link: link_cost(link, weights),
+        ),
+        min(
+            (link for link in target.incoming if link.node == path.nodes[-1]),
+            key=lambda link: link_cost(link, weights),
+        ),
+    )
+
+
+def path_cost(
+    path: PathT, source: EndpointT, target: EndpointT, weights: Sequence[float]
+) -> float:
+    """Cost of path between the end points, including the links to them"""
+    source_link, target_link = end_links(path, source, target, weights)
+    if not path.nodes:
+        return (source_link.share + target_link.share - 1) * weights[source_link.edge]
+    return (
+        link_cost(source_link, weights)
+        + sum(weights[edge] for edge in path.edges)
+        + link_cost(target_link, weights)
+    )
+
+
+def dijkstra_costs(
+    graph: CompactGraph,
+    sources: Dict[int, float],
+    weight: WeightT,
+    targets: AbstractSet[int] = frozenset(),
+    max_cost: float = inf,
+) -> Dict[int, float]:
+    """
+    Costs from the nearest of sources (node indices with their initial cost)
+    to every node settled, i.e. one search for many targets. Stops once all
+    nodes in targets are settled or the next node costs more than max_cost;
+    otherwise the whole reachable graph is searched.
+    """
+    offsets, neighbors, weights = graph.adjacency(weight)
+    dist = dict(sources)
+    settled: Dict[int, float] = {}
+    remaining = set(targets)
+    heap = sorted((cost, node) for node, cost in sources.items())
+    while heap:
+        node_dist, node = heappop(heap)
+        if node_dist > max_cost:
+            break
+        if node in settled:
+            continue
+        settled[node] = node_dist
+        remaining.discard(node)
+        if targets and not remaining:
+            break
+        for edge in range(offsets[node], offsets[node + 1]):
+            neighbor = neighbors[edge]
+            new_dist = node_dist + weights[edge]
+            if new_dist < dist.get(neighbor, inf):
+                dist[neighbor] = new_dist
+                heappush(heap, (new_dist, neighbor))
+    return settled
+
+
+def _reconstruct_path(
+    cost: float, target: int, pred: Dict[int, Tuple[int, int]]
+) -> PathT:
+    """Path to target from the search source it was reached from"""
+    nodes = [target]
+    edges: List[int] = []
+    while nodes[-1] in pred:
+        node, edge = pred[nodes[-1]]
+        nodes.append(node)
+        edges.append(edge)
+    nodes.reverse()
+    edges.reverse()
+    return PathT(cost, nodes, edges)
+
+
+def _distance_to(latitude: float, longitude: float) -> Callable[[float, float], float]:
+    """Great circle distance in meters to (latitude, longitude)"""
+    lat = radians(latitude)
+    long = radians(longitude)
+    cos_lat = cos(lat)
+
+    def distance_m(latitude: float, longitude: float) -> float:
+        node_lat = radians(latitude)
+        a = (
+            sin((node_lat - lat) / 2) ** 2
+            + cos_lat * cos(node_lat) * sin((radians(longitude) - long) / 2) ** 2
+        )
+        return 2000 * EARTH_RADIUS * asin(sqrt(min(a, 1.0)))
+
+    return distance_m
+
+
+def bidirectional_astar(
+    graph: CompactGraph,
+    source: int | EndpointT,
+    target: int | EndpointT,
+    weight: WeightT,
+    edge_weights: Optional[Sequence[float]] = None,
+) -> Optional[PathT]:
+    """
+    Shortest path from source to target (node indices or end points) by A*
+    searches from both ends meeting in the middle. The heuristic is the great circle
+    distance divided by the fastest speed on the graph (1 for length), which
+    never overestimates the remaining cost. Both searches use the average of
+    their two potentials so they stay consistent with each other.
+
+    edge_weights: Used instead of the weight of each edge. Must not be below
+    the weight or the heuristic may overestimate.
+
+    For end points along an edge the path runs between the nodes linked to
+    them, and its cost includes the links. It has no nodes at all when the end
+    points are on the same edge and that is the shortest way.
+    """
+    source = as_endpoint(graph, source)
+    target = as_endpoint(graph, target)
+    offsets, targets, weights = graph.adjacency(weight)
+    if edge_weights is not None:
+        weights = edge_weights
+    latitudes, longitudes = graph.coordinates()
+    max_speed = graph.max_speed(weight)
+    to_target = _distance_to(target.latitude, target.longitude)
+    to_source = _distance_to(source.latitude, source.longitude)
+    potentials: Dict[int, float] = {}
+
+    def potential(node: int) -> float:
+        # Forward potential; the backward search uses its negative
+        if node not in potentials:
+            if max_speed > 0:
+                latitude, longitude = latitudes[node], longitudes[node]
+                potentials[node] = (
+                    to_target(latitude, longitude) - to_source(latitude, longitude)
+                ) / (2 * max_speed)
+            else:
+                potentials[node] = 0.0
+        return potentials[node]
+
+    # Per direction: adjacency as (offsets, neighbors, edge indices), distances,
+    # (neighbor, edge) towards the search origin, settled nodes and the heap
+    # keyed by distance plus potential.
+    adjacency: Tuple[Tuple[Sequence[int], Sequence[int], Sequence[int]], ...] = (
+        (offsets, targets, range(graph.num_edges)),
+        graph.reverse_adjacency(),
+    )
+    dist = (link_costs(source.outgoing, weights), link_costs(target.incoming, weights))
+    pred: Tuple[Dict[int, Tuple[int, int]], ...] = ({}, {})
+    settled: Tuple[Set[int], Set[int]] = (set(), set())
+    heaps: Tuple[List[Tuple[float, int]], ...] = (
+        sorted((cost + potential(node), node) for node, cost in dist[0].items()),
+        sorted((cost - potential(node), node) for node, cost in dist[1].items()),
+    )
+    best_cost = direct_cost(source, target, weights)
+    meeting_node = -1
+    for node in dist[0].keys() & dist[1].keys():
+        if dist[0][node] + dist[1][node] < best_cost:
+            best_cost = dist[0][node] + dist[1][node]
+            meeting_node = node
+    while heaps[0] and heaps[1]:
+        if heaps[0][0][0] + heaps[1][0][0] >= best_cost:
+            break
+        side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+        sign = 1 if side == 0 else -1
+        _, node = heappop(heaps[side])
+        if node in settled[side]:
+            continue
+        settled[side].add(node)
+        side_offsets, neighbors, edges = adjacency[side]
+        side_dist, other_dist = dist[side], dist[1 - side]
+        node_dist = side_dist[node]
+        for idx in range(side_offsets[node], side_offsets[node + 1]):
+            neighbor = neighbors[idx]
+            edge = edges[idx]
+            new_dist = node_dist + weights[edge]
+            if new_dist < side_dist.get(neighbor, inf):
+                side_dist[neighbor] = new_dist
+                pred[side][neighbor] = (node, edge)
+                heappush(heaps[side], (new_dist + sign * potential(neighbor), neighbor))
+                if (
+                    neighbor in other_dist
+                    and new_dist + other_dist[neighbor] < best_cost
+                ):
+                    best_cost = new_dist + other_dist[neighbor]
+                    meeting_node = neighbor
+    if meeting_node < 0:
+        return None if best_cost == inf else PathT(best_cost, [], [])
+    forward = _reconstruct_path(dist[0][meeting_node], meeting_node, pred[0])
+    backward = _reconstruct_path(dist[1][meeting_node], meeting_node, pred[1])
+    return PathT(
+        best_cost,
+        forward.nodes + backward.nodes[-2::-1],
+        forward.edges + backward.edges[::-1],
+    )
+
+
+def _node_pairs(path: PathT) -> FrozenSet[Tuple[int, int]]:
+    return frozenset(zip(path.nodes, path.nodes[1:]))
+
+
+def alternative_paths(
+    graph: CompactGraph,
+    source: int | EndpointT,
+    target: int | EndpointT,
+    k: int,
+    weight: WeightT,
+    max_overlap: float = ALTERNATIVE_MAX_OVERLAP,
+    max_stretch: float = ALTERNATIVE_MAX_STRETCH,
+) -> List[PathT]:
+    """
+    Up to k meaningfully different paths, best first, by the penalty method:
+    after each search the edges of the path found get more expensive and the
+    search is repeated. A path is accepted if at most max_overlap of its cost
+    is shared with any accepted path and it costs at most 1 + max_stretch
+    times the best path. This takes about one search per path, unlike Yen's
+    algorithm which searches from every node of every path.
+    """
+    source = as_endpoint(graph, source)
+    target = as_endpoint(graph, target)
+    best = bidirectional_astar(graph, source, target, weight)
+    if best is None:
+        return []
+    accepted = [best]
+    accepted_pairs = [_node_pairs(best)]
+    weights = graph.weights(weight)
+    penalized = np.array(weights, dtype=np.float64)
+    path = best
+    # Rejected paths are penalized too, so the searches keep moving away
+    for _ in range(2 * k):
+        if len(accepted) == k:
+            break
+        penalized[path.edges] *= ALTERNATIVE_PENALTY
+        next_path = bidirectional_astar(
+            graph, source, target, weight, cast(Sequence[float], penalized.data)
+        )
+        assert next_path is not None  # penalties do not disconnect anything
+        path = next_path._replace(
+            cost=float(
+                path_cost(next_path, source, target, cast(Sequence[float], weights))
+            )
+        )
+        if path.cost > (1 + max_stretch) * best.cost:
+            break
+        pairs = _node_pairs(path)
+        if pairs in accepted_pairs:
+            continue
+        for other_pairs in accepted_pairs:
+            overlap = sum(
+                float(weights[edge])
+                for node, next_node, edge in zip(path.nodes, path.nodes[1:], path.edges)
+                if (node, next_node) in other_pairs
+            )
+            if overlap > max_overlap * path.cost:
+                break
+        else:
+            accepted.append(path)
+            accepted_pairs.append(pairs)
+    return sorted(accepted)
@@ -0,0 +1,222 @@
+# Spatial indexes for snapping coordinates to the street network
+
+import pickle
+from pathlib import Path
+from typing import NamedTuple, Tuple
+
+import numpy as np
+import shapely
+from numpy.typing import ArrayLike, NDArray
+from scipy.spatial import cKDTree
+from shapely import STRtree
+
+from within.compact_graph import load_arrays, save_arrays
+from within.spherical_geometry import EARTH_RADIUS
+
+# Bumped whenever the saved edge index layout changes
+EDGE_INDEX_VERSION = 2
+EDGE_INDEX_ARRAYS = (
+    "starts",
+    "ends",
+    "segment_edges",
+    "positions",
+    "edge_lengths",
+)
+
+
+def unit_vectors(latitudes: ArrayLike, longitudes: ArrayLike) -> NDArray[np.float64]:
+    """(n, 3) points on the unit sphere for latitudes and longitudes in degrees"""
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    long = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(long), cos_lat * np.sin(long), np.sin(lat)], -1)
+
+
+class NodeIndex:
+    """
+    KD-tree over the graph nodes as points on the unit sphere. Straight line
+    (chord) distances there order points the same as great circle distances,
+    so nearest neighbours are exact anywhere on earth, and any number of points
+    is snapped in one vectorized query.
+    """
+
+    def __init__(self, tree: cKDTree) -> None:
+        self.tree = tree
+
+    @classmethod
+    def build(cls, latitudes: ArrayLike, longitudes: ArrayLike) -> "NodeIndex":
+        return cls(cKDTree(unit_vectors(latitudes, longitudes)))
+
+    def nearest(
+        self, latitudes: ArrayLike, longitudes: ArrayLike
+    ) -> Tuple[NDArray[np.int64], NDArray[np.float64]]:
+        """
+        (node indices, great circle distances in meters) of the nodes closest
+        to each point
+        """
+        chord, nodes = self.tree.query(unit_vectors(latitudes, longitudes))
+        dist_m = 2000 * EARTH_RADIUS * np.arcsin(np.minimum(chord / 2, 1.0))
+        return np.asarray(nodes, dtype=np.int64), dist_m
+
+    def save(self, path: Path) -> None:
+        with path.open("wb") as fh:
+            pickle.dump(self.tree, fh, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: Path) -> "NodeIndex":
+        with path.open("rb") as fh:
+            return cls(pickle.load(fh))
+
+
+class EdgeMatchT(NamedTuple):
+    """Closest point on the street network to each of a number of points"""
+
+    edges: NDArray[np.int64]
+    # Fraction of the edge's length from its source node to the point
+    fractions: NDArray[np.float64]
+    latitudes: NDArray[np.float64]
+    longitudes: NDArray[np.float64]
+    dist_m: NDArray[np.float64]
+
+
+class EdgeIndex:
+    """
+    R-tree (shapely's STRtree, packed over the bounding boxes of the segments)
+    of the straight segments making up the geometry of every graph edge.
+    Segments are projected equirectangularly around the mean latitude of the
+    vertices, which keeps distances within a city sized network accurate to
+    well under a percent. The projected segments can be saved, the tree
+    itself is rebuilt from them when loaded.
+    """
+
+    def __init__(
+        self,
+        reference_latitude: float,
+        starts: NDArray[np.float64],
+        ends: NDArray[np.float64],
+        segment_edges: NDArray[np.int64],
+        positions: NDArray[np.float64],
+        edge_lengths: NDArray[np.float64],
+    ) -> None:
+        """
+        starts, ends: (n, 2) projected end points of the segments in meters
+        segment_edges: Edge index of each segment
+        positions: Distance along its edge to the start of each segment
+        edge_lengths: Projected length of each edge
+        """
+        self.reference_latitude = reference_latitude
+        self.starts = starts
+        self.ends = ends
+        self.segment_edges = segment_edges
+        self.positions = positions
+        self.edge_lengths = edge_lengths
+        self.tree = STRtree(shapely.linestrings(np.stack([starts, ends], 1)))
+
+    @classmethod
+    def build(
+        cls, offsets: ArrayLike, latitudes: ArrayLike, longitudes: ArrayLike
+    ) -> "EdgeIndex":
+        """
+        From the vertices of the edges (see CompactGraph.polylines), those
+        of edge i being offsets[i]..offsets[i+1]-1
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        reference_latitude = float(latitudes.mean()) if len(latitudes) else 0.0
+        points = _project(reference_latitude, latitudes, longitudes)
+        num_edges = len(offsets) - 1
+        # Every vertex but the last of an edge starts a segment
+        is_start = np.ones(len(points), dtype=bool)
+        is_start[offsets[1:] - 1] = False
+        first_points = np.flatnonzero(is_start)
+        starts, ends = points[first_points], points[first_points + 1]
+        segment_edges = np.repeat(np.arange(num_edges), np.diff(offsets) - 1)
+        segment_lengths = np.linalg.norm(ends - starts, axis=1)
+        before = np.cumsum(segment_lengths) - segment_lengths
+        # Segments of edge i are offsets[i] - i.., as each edge has one fewer
+        first_segments = offsets[:-1] - np.arange(num_edges)
+        positions = before - before[first_segments][segment_edges]
+        edge_lengths = (
+            np.add.reduceat(segment_lengths, first_segments)
+            if num_edges
+            else np.empty(0)
+        )
+        return cls(
+            reference_latitude, starts, ends, segment_edges, positions, edge_lengths
+        )
+
+    def save(self, directory: Path) -> None:
+        save_arrays(
+            directory,
+            {name: getattr(self, name) for name in EDGE_INDEX_ARRAYS},
+            {
+                "version": EDGE_INDEX_VERSION,
+                "reference_latitude": self.reference_latitude,
+            },
+        )
+
+    @classmethod
+    def load(cls, directory: Path) -> "EdgeIndex":
+        arrays, manifest = load_arrays(directory, EDGE_INDEX_ARRAYS, EDGE_INDEX_VERSION)
+        return cls(manifest["reference_latitude"], **arrays)
+
+    def nearest(self, latitudes: ArrayLike, longitudes: ArrayLike) -> EdgeMatchT:
+        """
+        Point on an edge closest to each point. Of several equally close edges
+        (e.g. both directions of a street) any one is returned.
+        """
+        points = _project(self.reference_latitude, latitudes, longitudes)
+        inputs, segments = self.tree.query_nearest(shapely.points(points))
+        _, first = np.unique(inputs, return_index=True)
+        segments = segments[first].astype(np.int64)
+        starts = self.starts[segments]
+        directions = self.ends[segments] - starts
+        squared_lengths = np.einsum("ij,ij->i", directions, directions)
+        along_segment = np.clip(
+            np.einsum("ij,ij->i", points - starts, directions)
+            / np.where(squared_lengths > 0, squared_lengths, 1.0),
+            0.0,
+            1.0,
+        )
+        closest = starts + along_segment[:, None] * directions
+        edges = self.segment_edges[segments].astype(np.int64)
+        edge_lengths = self.edge_lengths[edges]
+        fractions = np.clip(
+            (self.positions[segments] + along_segment * np.sqrt(squared_lengths))
+            / np.where(edge_lengths > 0, edge_lengths, 1.0),
+            0.0,
+            1.0,
+        )
+        closest_latitudes, closest_longitudes = _unproject(
+            self.reference_latitude, closest
+        )
+        return EdgeMatchT(
+            edges,
+            fractions,
+            closest_latitudes,
+            closest_longitudes,
+            np.linalg.norm(points - closest, axis=1),
+        )
+
+
+def _project(
+    reference_latitude: float, latitudes: ArrayLike, longitudes: ArrayLike
+) -> NDArray[np.float64]:
+    """(n, 2) equirectangular points in meters around reference_latitude"""
+    scale = 1000 * EARTH_RADIUS
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    long = np.radians(np.asarray(longitudes, dtype=np.float64))
+    return np.stack(
+        [scale * np.cos(np.radians(reference_latitude)) * long, scale * lat], -1
+    ).reshape(-1, 2)
+
+
+def _unproject(
+    reference_latitude: float, points: NDArray[np.float64]
+) -> Tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """(latitudes, longitudes) of points from _project"""
+    scale = 1000 * EARTH_RADIUS
+    return (
+        np.degrees(points[:, 1] / scale),
+        np.degrees(points[:, 0] / (scale * np.cos(np.radians(reference_latitude)))),
+    )
@@ -1,10 +1,43 @@
+from bisect import bisect_right
 from math import atan2, cos, degrees, radians, sin, sqrt
-from typing import Tuple
+from typing import Tuple, cast
+
+import numpy as np
+from numpy.typing import ArrayLike, NDArray
 
 EARTH_RADIUS = 6371  # km (average)
 
 CoordT = Tuple[float, float]  # (latitude, longitude)
 
+# Clockwise from north, each covering 360 / 16 degrees centered on its bearing
+CARDINAL_DIRECTIONS = (
+    "N",
+    "NNE",
+    "NE",
+    "ENE",
+    "E",
+    "ESE",
+    "SE",
+    "SSE",
+    "S",
+    "SSW",
+    "SW",
+    "WSW",
+    "W",
+    "WNW",
+    "NW",
+    "NNW",
+)
+# Bearings from which each direction applies, after the first
+CARDINAL_THRESHOLDS = [
+    (idx + 0.5) / len(CARDINAL_DIRECTIONS) * 360
+    for idx in range(len(CARDINAL_DIRECTIONS))
+]
+
+
+def _as_array(values: ArrayLike) -> NDArray[np.float64]:
+    return np.asarray(values, dtype=np.float64)
+
 
 def great_circle_halfway_point(
     start_latitude: float,
@@ -30,6 +63,61 @@ def great_circle_halfway_point(
     return (degrees(mid_lat), degrees(mid_long))
 
 
+def great_circle_halfway_points(
+    start_latitudes: ArrayLike,
+    start_longitudes: ArrayLike,
+    end_latitudes: ArrayLike,
+    end_longitudes: ArrayLike,
+) -> Tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """
+    great_circle_halfway_point for arrays of points, broadcast against each
+    other. Return (latitudes, longitudes) in degrees.
+    """
+    start_lat = np.radians(_as_array(start_latitudes))
+    end_lat = np.radians(_as_array(end_latitudes))
+    start_long = np.radians(_as_array(start_longitudes))
+    long_delta = np.radians(_as_array(end_longitudes) - _as_array(start_longitudes))
+
+    Bx = np.cos(end_lat) * np.cos(long_delta)
+    By = np.cos(end_lat) * np.sin(long_delta)
+    mid_lat = np.arctan2(
+        np.sin(start_lat) + np.sin(end_lat),
+        np.sqrt((np.cos(start_lat) + Bx) ** 2 + By**2),
+    )
+    mid_long = start_long + np.arctan2(By, np.cos(start_lat) + Bx)
+    return (np.degrees(mid_lat), np.degrees(mid_long))
+
+
+def great_circle_intermediate_point(
+    start_latitude: float,
+    start_longitude: float,
+    end_latitude: float,
+    end_longitude: float,
+    fraction: float,
+) -> CoordT:
+    """
+    Point at `fraction` (0 at start, 1 at end) of the way along the great circle
+    path between the two points.
+    Return (latitude, longitude) in degrees.
+    """
+    start_lat = radians(start_latitude)
+    start_long = radians(start_longitude)
+    end_lat = radians(end_latitude)
+    end_long = radians(end_longitude)
+    angular_dist = great_circle_distance(
+        start_latitude, start_longitude, end_latitude, end_longitude, radius=1
+    )
+    if angular_dist == 0:
+        return (start_latitude, start_longitude)
+
+    a = sin((1 - fraction) * angular_dist) / sin(angular_dist)
+    b = sin(fraction * angular_dist) / sin(angular_dist)
+    x = a * cos(start_lat) * cos(start_long) + b * cos(end_lat) * cos(end_long)
+    y = a * cos(start_lat) * sin(start_long) + b * cos(end_lat) * sin(end_long)
+    z = a * sin(start_lat) + b * sin(end_lat)
+    return (degrees(atan2(z, sqrt(x**2 + y**2))), degrees(atan2(y, x)))
+
+
 def great_circle_distance(
     start_latitude: float,
     start_longitude: float,
@@ -55,6 +143,30 @@ def great_circle_distance(
     return fractional_dist * radius
 
 
+def great_circle_distances(
+    start_latitudes: ArrayLike,
+    start_longitudes: ArrayLike,
+    end_latitudes: ArrayLike,
+    end_longitudes: ArrayLike,
+    radius: float = EARTH_RADIUS,
+) -> NDArray[np.float64]:
+    """great_circle_distance for arrays of points, broadcast against each other"""
+    start_lat = np.radians(_as_array(start_latitudes))
+    end_lat = np.radians(_as_array(end_latitudes))
+    lat_delta = np.radians(_as_array(start_latitudes) - _as_array(end_latitudes))
+    long_delta = np.radians(_as_array(end_longitudes) - _as_array(start_longitudes))
+
+    haversine = (
+        np.sin(lat_delta / 2) ** 2
+        + np.cos(start_lat) * np.cos(end_lat) * np.sin(long_delta / 2) ** 2
+    )
+    fractional_dist: NDArray[np.float64] = 2 * np.arctan2(
+        np.sqrt(haversine), np.sqrt(1 - haversine)
+    )
+
+    return fractional_dist * radius
+
+
 def get_bearing(
     start_latitude: float,
     start_longitude: float,
@@ -78,41 +190,39 @@ def get_bearing(
     return (bearing + 360) % 360
 
 
+def get_bearings(
+    start_latitudes: ArrayLike,
+    start_longitudes: ArrayLike,
+    end_latitudes: ArrayLike,
+    end_longitudes: ArrayLike,
+) -> NDArray[np.float64]:
+    """get_bearing for arrays of coordinates, broadcast against each other"""
+    start_lat = np.radians(_as_array(start_latitudes))
+    end_lat = np.radians(_as_array(end_latitudes))
+    long_delta = np.radians(_as_array(end_longitudes) - _as_array(start_longitudes))
+
+    x = np.sin(long_delta) * np.cos(end_lat)
+    y = np.cos(start_lat) * np.sin(end_lat) - np.sin(start_lat) * np.cos(
+        end_lat
+    ) * np.cos(long_delta)
+    bearings: NDArray[np.float64] = np.degrees(np.arctan2(x, y))
+
+    return (bearings + 360) % 360
+
+
 def get_cardinal_direction(bearing_degrees: float) -> str:
     """Bearing in degrees to one of 16 cardinal directions"""
-    if bearing_degrees < (1 - 0.5) / 16 * 360:
-        return "N"
-    elif bearing_degrees < (2 - 0.5) / 16 * 360:
-        return "NNE"
-    elif bearing_degrees < (3 - 0.5) / 16 * 360:
-        return "NE"
-    elif bearing_degrees < (4 - 0.5) / 16 * 360:
-        return "ENE"
-    elif bearing_degrees < (5 - 0.5) / 16 * 360:
-        return "E"
-    elif bearing_degrees < (6 - 0.5) / 16 * 360:
-        return "ESE"
-    elif bearing_degrees < (7 - 0.5) / 16 * 360:
-        return "SE"
-    elif bearing_degrees < (8 - 0.5) / 16 * 360:
-        return "SSE"
-    elif bearing_degrees < (9 - 0.5) / 16 * 360:
-        return "S"
-    elif bearing_degrees < (10 - 0.5) / 16 * 360:
-        return "SSW"
-    elif bearing_degrees < (11 - 0.5) / 16 * 360:
-        return "SW"
-    elif bearing_degrees < (12 - 0.5) / 16 * 360:
-        return "WSW"
-    elif bearing_degrees < (13 - 0.5) / 16 * 360:
-        return "W"
-    elif bearing_degrees < (14 - 0.5) / 16 * 360:
-        return "WNW"
-    elif bearing_degrees < (15 - 0.5) / 16 * 360:
-        return "NW"
-    elif bearing_degrees < (16 - 0.5) / 16 * 360:
-        return "NNW"
-    return "N"
+    idx = bisect_right(CARDINAL_THRESHOLDS, bearing_degrees)
+    return CARDINAL_DIRECTIONS[idx % len(CARDINAL_DIRECTIONS)]
+
+
+def get_cardinal_directions(bearings_degrees: ArrayLike) -> NDArray[np.str_]:
+    """get_cardinal_direction for an array of bearings"""
+    indices = np.searchsorted(CARDINAL_THRESHOLDS, bearings_degrees, side="right")
+    return cast(
+        NDArray[np.str_],
+        np.array(CARDINAL_DIRECTIONS)[indices % len(CARDINAL_DIRECTIONS)],
+    )
 
 
 def get_turning_instruction(current_bearing: float, next_bearing: float) -> str:
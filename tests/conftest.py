@@ -0,0 +1,100 @@
+from pathlib import Path
+from typing import Iterator
+from unittest.mock import patch
+
+import pytest
+from networkx import MultiDiGraph
+
+from within.address import Address
+from within.network import RegionalNetwork
+from within.spherical_geometry import great_circle_distance
+
+# South west corner of the synthetic street grid (lower Manhattan)
+GRID_ORIGIN = (40.70, -74.02)
+GRID_SIZE = 6
+GRID_SPACING = 0.001  # degrees
+
+
+def grid_node_id(row: int, col: int) -> int:
+    return 1000 + row * GRID_SIZE + col
+
+
+def grid_address(row: float, col: float) -> Address:
+    return Address(
+        f"Grid {row}, {col}",
+        (GRID_ORIGIN[0] + row * GRID_SPACING, GRID_ORIGIN[1] + col * GRID_SPACING),
+    )
+
+
+def _add_street(
+    graph: MultiDiGraph, node_a: int, node_b: int, name: str, highway: str
+) -> None:
+    length = 1000 * great_circle_distance(
+        graph.nodes[node_a]["y"],
+        graph.nodes[node_a]["x"],
+        graph.nodes[node_b]["y"],
+        graph.nodes[node_b]["x"],
+    )
+    for u, v in ((node_a, node_b), (node_b, node_a)):
+        graph.add_edge(
+            u, v, osmid=u * 10000 + v, length=length, name=name, highway=highway
+        )
+
+
+@pytest.fixture
+def street_graph() -> MultiDiGraph:
+    """
+    Small osmnx style street grid. Rows are named streets running east-west
+    and columns are avenues running north-south, all two-way.
+    """
+    graph = MultiDiGraph(crs="epsg:4326")
+    for row in range(GRID_SIZE):
+        for col in range(GRID_SIZE):
+            graph.add_node(
+                grid_node_id(row, col),
+                y=GRID_ORIGIN[0] + row * GRID_SPACING,
+                x=GRID_ORIGIN[1] + col * GRID_SPACING,
+                street_count=4,
+            )
+    for row in range(GRID_SIZE):
+        for col in range(GRID_SIZE):
+            if col + 1 < GRID_SIZE:
+                _add_street(
+                    graph,
+                    grid_node_id(row, col),
+                    grid_node_id(row, col + 1),
+                    f"{row + 1} Street",
+                    "residential",
+                )
+            if row + 1 < GRID_SIZE:
+                _add_street(
+                    graph,
+                    grid_node_id(row, col),
+                    grid_node_id(row + 1, col),
+                    f"{col + 1} Avenue",
+                    "primary",
+                )
+    return graph
+
+
+@pytest.fixture
+def one_way_street_graph(street_graph: MultiDiGraph) -> MultiDiGraph:
+    """The street grid with two one-way blocks, so routes are not symmetric"""
+    street_graph.remove_edge(grid_node_id(2, 3), grid_node_id(2, 2))
+    street_graph.remove_edge(grid_node_id(4, 1), grid_node_id(3, 1))
+    return street_graph
+
+
+@pytest.fixture
+def region(street_graph: MultiDiGraph) -> Iterator[RegionalNetwork]:
+    """Walking network of the street grid, without downloading anything"""
+    with patch("within.network.load_graph") as mock_load:
+        mock_load.return_value = street_graph
+        yield RegionalNetwork(GRID_ORIGIN, 2000, transport_modes=["walk"])
+
+
+@pytest.fixture(autouse=True)
+def graph_cache_dir(tmp_path: Path) -> Iterator[Path]:
+    """Keeps graphs cached by tests out of the user's graph cache"""
+    with patch("within.graph_cache.GRAPH_CACHE_DIR", tmp_path / "graphs"):
+        yield tmp_path / "graphs"
@@ -1,6 +1,7 @@
 import os
+from pathlib import Path
 from typing import Iterator
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import pytest
 from openai.types.chat.parsed_chat_completion import (
@@ -14,7 +15,21 @@ from openai.types.completion_usage import (
     PromptTokensDetails,
 )
 
-from within.address import Address, GeographicLocation
+from within.address import (
+    Address,
+    GeographicLocation,
+    SanitizedAddresses,
+    resolve_addresses,
+)
+
+
+@pytest.fixture(autouse=True)
+def openai_cache(tmp_path: Path) -> Iterator[Path]:
+    cache_path = tmp_path / "openai_cache.sqlite3"
+    with patch("within.address.OPENAI_CACHE_DB_PATH", cache_path):
+        # Each test gets a fresh (mocked) client
+        with patch("within.address._openai_client", None):
+            yield cache_path
 
 
 @pytest.fixture()
@@ -267,3 +282,119 @@ def test_address_coordinate_override() -> None:
         assert address.longitude == 15.5
         assert address.latitude == 3.3
         assert mock_openai_instance.beta.chat.completions.parse.call_count == 0
+
+
+def test_address_openai_answers_are_cached(
+    mock_openai_address_response: ParsedChatCompletion[None],
+    mock_openai_coord_response: ParsedChatCompletion[GeographicLocation],
+    mock_openai_api_key: None,
+) -> None:
+    with patch("within.address.OpenAI") as mock_OpenAI:
+        mock_openai_instance = mock_OpenAI.return_value
+        mock_parse = mock_openai_instance.beta.chat.completions.parse
+        mock_parse.side_effect = (
+            mock_openai_address_response,
+            mock_openai_coord_response,
+        )
+        for _ in range(2):
+            address = Address("Madison Square Garden")
+            assert address.sanitized_address == (
+                "Madison Square Garden, 4 Pennsylvania Plaza, New York, NY 10001, USA."
+            )
+            address.parse_location_description_with_OpenAI()
+            assert address.latitude == 40.750504
+            assert address.longitude == -73.993438
+        # Second round is served from the cache by the same shared client
+        assert mock_parse.call_count == 2
+        assert mock_OpenAI.call_count == 1
+
+
+def test_address_sanitize_addresses_batch(
+    mock_openai_address_response: ParsedChatCompletion[None],
+    mock_openai_api_key: None,
+) -> None:
+    batch_response = MagicMock()
+    batch_response.choices[0].message.parsed = SanitizedAddresses(
+        addresses=["1071 5th Ave, New York, NY 10128, USA", "New York, NY 10004, USA"]
+    )
+    with patch("within.address.OpenAI") as mock_OpenAI:
+        mock_parse = mock_OpenAI.return_value.beta.chat.completions.parse
+        mock_parse.side_effect = (mock_openai_address_response, batch_response)
+        # Cached beforehand
+        Address("Madison Square Garden").sanitized_address
+        addresses = [
+            Address("Guggenheim"),
+            Address("Madison Square Garden"),
+            Address("Battery Park"),
+            Address("Guggenheim"),
+        ]
+        Address.sanitize_addresses(addresses)
+    assert [address.sanitized_address for address in addresses] == [
+        "1071 5th Ave, New York, NY 10128, USA",
+        "Madison Square Garden, 4 Pennsylvania Plaza, New York, NY 10001, USA.",
+        "New York, NY 10004, USA",
+        "1071 5th Ave, New York, NY 10128, USA",
+    ]
+    assert mock_parse.call_count == 2
+    batch_kwargs = mock_parse.call_args[1]
+    assert batch_kwargs["response_format"] == SanitizedAddresses
+    assert "1. Guggenheim\n2. Battery Park\n" in (
+        batch_kwargs["messages"][1]["content"]
+    )
+    # Batch answers are cached too
+    address = Address("Battery Park")
+    assert address.sanitized_address == "New York, NY 10004, USA"
+    assert mock_parse.call_count == 2
+
+
+def test_address_sanitize_addresses_batch_mismatch(
+    mock_openai_address_response: ParsedChatCompletion[None],
+    mock_openai_api_key: None,
+) -> None:
+    batch_response = MagicMock()
+    batch_response.choices[0].message.parsed = SanitizedAddresses(
+        addresses=["Only one"]
+    )
+    with patch("within.address.OpenAI") as mock_OpenAI:
+        mock_parse = mock_OpenAI.return_value.beta.chat.completions.parse
+        mock_parse.side_effect = (
+            batch_response,
+            mock_openai_address_response,
+            mock_openai_address_response,
+        )
+        addresses = [Address("Madison Square Garden"), Address("MSG")]
+        Address.sanitize_addresses(addresses)
+    assert mock_parse.call_count == 3
+    assert addresses[1].sanitized_address == (
+        "Madison Square Garden, 4 Pennsylvania Plaza, New York, NY 10001, USA."
+    )
+
+
+def test_resolve_addresses(
+    mock_openai_coord_response: ParsedChatCompletion[GeographicLocation],
+    mock_openai_api_key: None,
+) -> None:
+    batch_response = MagicMock()
+    batch_response.choices[0].message.parsed = SanitizedAddresses(
+        addresses=["Sanitized B", "Sanitized C"]
+    )
+    with patch("within.address.bulk_coords_from_addresses") as mock_bulk:
+        mock_bulk.side_effect = [[(1.0, 1.5), None, None], [(2.0, 2.5), None]]
+        with patch("within.address.OpenAI") as mock_OpenAI:
+            mock_parse = mock_OpenAI.return_value.beta.chat.completions.parse
+            mock_parse.side_effect = (batch_response, mock_openai_coord_response)
+            addresses = [Address("A"), Address("B"), Address("C"), Address("D", (3, 4))]
+            resolve_addresses(addresses)
+            # Resolving again is a no-op
+            resolve_addresses(addresses)
+    assert [(address.latitude, address.longitude) for address in addresses] == [
+        (1.0, 1.5),
+        (2.0, 2.5),
+        (40.750504, -73.993438),
+        (3, 4),
+    ]
+    # One Nominatim pass per stage for the whole group
+    assert mock_bulk.call_count == 2
+    assert mock_bulk.call_args_list[0][0][0] == ["A", "B", "C"]
+    assert mock_bulk.call_args_list[1][0][0] == ["Sanitized B", "Sanitized C"]
+    assert mock_parse.call_count == 2
@@ -0,0 +1,164 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import sleep
+from typing import List
+from unittest.mock import patch
+
+import pytest
+
+from within.cache import LRUCache, SingleFlight, SQLiteCache
+
+
+def test_sqlite_cache_get_set(tmp_path: Path) -> None:
+    cache = SQLiteCache(tmp_path / "cache.sqlite3")
+    assert cache.get("missing") is None
+    cache.set("key", [{"lat": 1.0, "lon": 2.0}])
+    cache.set("other", [])
+    assert cache.get("key") == [{"lat": 1.0, "lon": 2.0}]
+    assert cache.get("other") == []
+    assert len(cache) == 2
+    cache.delete("other")
+    assert cache.get("other") is None
+    cache.close()
+
+    # Persisted across connections
+    assert SQLiteCache(tmp_path / "cache.sqlite3").get("key") == [
+        {"lat": 1.0, "lon": 2.0}
+    ]
+
+
+def test_sqlite_cache_ttl(tmp_path: Path) -> None:
+    cache = SQLiteCache(tmp_path / "cache.sqlite3")
+    with patch("within.cache.time", return_value=1000.0):
+        cache.set("key", "value", ttl_s=10)
+        cache.set("permanent", "value")
+    with patch("within.cache.time", return_value=1004.0):
+        assert cache.get_with_ttl("key") == ("value", 6)
+        assert cache.get_with_ttl("permanent") == ("value", None)
+    with patch("within.cache.time", return_value=1009.0):
+        assert cache.get("key") == "value"
+    with patch("within.cache.time", return_value=1010.0):
+        assert cache.get("key") is None
+
+
+def test_sqlite_cache_migrate_from_json(tmp_path: Path) -> None:
+    json_path = tmp_path / "legacy.json"
+    with json_path.open("w") as fh:
+        json.dump({"a": [1], "b": [2]}, fh)
+    cache = SQLiteCache(tmp_path / "cache.sqlite3")
+    cache.set("a", [0])
+    assert cache.migrate_from_json(json_path) == 2
+    # Existing entries win over legacy ones
+    assert cache.get("a") == [0]
+    assert cache.get("b") == [2]
+    # Only imported once
+    cache.delete("b")
+    assert cache.migrate_from_json(json_path) == 0
+    assert cache.get("b") is None
+    assert cache.migrate_from_json(tmp_path / "does_not_exist.json") == 0
+
+
+def test_sqlite_cache_migrate_from_json_ttl(tmp_path: Path) -> None:
+    json_path = tmp_path / "legacy.json"
+    with json_path.open("w") as fh:
+        json.dump({"a": [], "A": [1], "b": [], "c": [2]}, fh)
+    cache = SQLiteCache(tmp_path / "cache.sqlite3")
+    assert (
+        cache.migrate_from_json(
+            json_path,
+            key_func=str.lower,
+            ttl_func=lambda value: None if value else 60,
+        )
+        == 4
+    )
+    # The colliding entry kept for ever wins
+    assert cache.get_with_ttl("a") == ([1], None)
+    entry = cache.get_with_ttl("b")
+    assert entry is not None and entry[0] == []
+    assert entry[1] is not None and 0 < entry[1] <= 60
+    assert cache.get_with_ttl("c") == ([2], None)
+
+
+def test_lru_cache_evicts_least_recently_used() -> None:
+    cache: LRUCache[int] = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == {
+        "hits": 3,
+        "misses": 1,
+        "evictions": 1,
+        "entries": 2,
+        "size_bytes": cache.stats()["size_bytes"],
+    }
+
+
+def test_lru_cache_byte_budget() -> None:
+    cache: LRUCache[str] = LRUCache(max_entries=None, max_bytes=10, sizeof=len)
+    cache.set("a", "12345")
+    cache.set("b", "12345")
+    assert len(cache) == 2
+    cache.set("a", "123456")  # replacing updates the size
+    assert cache.get("b") is None
+    assert cache.get("a") == "123456"
+    assert cache.stats()["size_bytes"] == 6
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_cache_ttl() -> None:
+    cache: LRUCache[int] = LRUCache(ttl_s=10)
+    with patch("within.cache.monotonic", return_value=100.0):
+        cache.set("a", 1)
+        cache.set("b", 2, ttl_s=100)
+    with patch("within.cache.monotonic", return_value=110.0):
+        assert cache.get("a") is None
+        assert cache.get("b") == 2
+    assert cache.stats()["misses"] == 1
+    assert len(cache) == 1
+
+
+def test_single_flight_shares_result() -> None:
+    flight: SingleFlight[int] = SingleFlight()
+    release = threading.Event()
+    calls: List[str] = []
+
+    def slow_call() -> int:
+        calls.append("called")
+        release.wait(timeout=5)
+        return 42
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(flight.do, "key", slow_call) for _ in range(4)]
+        sleep(0.1)  # let every caller join the flight
+        assert len(flight) == 1
+        release.set()
+        results = [future.result() for future in futures]
+    assert results == [42, 42, 42, 42]
+    assert calls == ["called"]
+    assert len(flight) == 0
+    # Later calls run again
+    assert flight.do("key", lambda: 7) == 7
+
+
+def test_single_flight_shares_exception() -> None:
+    flight: SingleFlight[int] = SingleFlight()
+    release = threading.Event()
+
+    def failing_call() -> int:
+        release.wait(timeout=5)
+        raise ValueError("failed")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(flight.do, "key", failing_call) for _ in range(2)]
+        sleep(0.1)
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result()
+    assert len(flight) == 0
@@ -1,3 +1,4 @@
+from pathlib import Path
 from typing import Iterator
 from unittest.mock import Mock, patch
 
@@ -19,9 +20,10 @@ def mock_Address() -> Iterator[Mock]:
 
 @pytest.fixture
 def mock_Routing() -> Iterator[Mock]:
-    route = Mock(spec_set=["description", "total_length_m"])
+    route = Mock(spec_set=["description", "total_length_m", "total_travel_time_s"])
     route.description = "test"
     route.total_length_m = 1000.0
+    route.total_travel_time_s = 120.0
     routing = Mock(spec_set=["shortest_routes"])
     routing.shortest_routes.return_value = [route]
     with patch("within.cli.Routing") as mock_routing_class:
@@ -29,7 +31,15 @@ def mock_Routing() -> Iterator[Mock]:
         yield mock_routing_class
 
 
-def test_main(mock_Address: Mock, mock_Routing: Mock) -> None:
+@pytest.fixture
+def mock_resolve_addresses() -> Iterator[Mock]:
+    with patch("within.cli.resolve_addresses") as mock_resolve:
+        yield mock_resolve
+
+
+def test_main(
+    mock_Address: Mock, mock_Routing: Mock, mock_resolve_addresses: Mock
+) -> None:
     cli_args = [
         "--start",
         "start_address",
@@ -48,9 +58,58 @@ def test_main(mock_Address: Mock, mock_Routing: Mock) -> None:
     assert mock_Address.call_args_list[1][0][0] == "end_address"
 
     start_address = end_address = mock_Address.return_value
+    assert mock_resolve_addresses.call_count == 1
+    assert mock_resolve_addresses.call_args[0][0] == [start_address, end_address]
+
     assert mock_Routing.call_count == 1
     assert mock_Routing.call_args[0] == (start_address, end_address, "drive")
+    assert mock_Routing.call_args[1] == {"snapshot": None, "weight_by": "length"}
 
     routing = mock_Routing.return_value
     assert routing.shortest_routes.call_count == 1
     assert routing.shortest_routes.call_args[0][0] == 1
+
+
+def test_main_snapshots(
+    mock_Address: Mock, mock_Routing: Mock, mock_resolve_addresses: Mock
+) -> None:
+    cli_args = [
+        "--start",
+        "start_address",
+        "--destination",
+        "end_address",
+        "--snapshot",
+        "old_snapshot",
+        "--save-snapshot",
+        "new_snapshot",
+    ]
+    routing = Mock(spec_set=["shortest_routes", "street_network"])
+    routing.shortest_routes.return_value = []
+    mock_Routing.return_value = routing
+    with patch("sys.argv", ["cli.py", *cli_args]):
+        main()
+
+    assert mock_Routing.call_args[1] == {
+        "snapshot": Path("old_snapshot"),
+        "weight_by": "length",
+    }
+    assert routing.street_network.save_snapshot.call_args[0] == (Path("new_snapshot"),)
+
+
+def test_main_travel_time(
+    mock_Address: Mock,
+    mock_Routing: Mock,
+    mock_resolve_addresses: Mock,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    cli_args = ["--start", "a", "--destination", "b", "--optimize", "travel_time"]
+    with patch("sys.argv", ["cli.py", *cli_args]):
+        main()
+    assert mock_Routing.call_args[1]["weight_by"] == "travel_time"
+    assert "Estimated travel time: 2 min" in capsys.readouterr().out
+
+    route = mock_Routing.return_value.shortest_routes.return_value[0]
+    route.total_travel_time_s = float("nan")
+    with patch("sys.argv", ["cli.py", *cli_args]):
+        main()
+    assert "Estimated travel time" not in capsys.readouterr().out
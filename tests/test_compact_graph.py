@@ -0,0 +1,234 @@
+import json
+import pickle
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+import shapely
+from networkx import MultiDiGraph
+
+from within.compact_graph import (
+    SNAPSHOT_ARRAYS,
+    UNNAMED,
+    CompactGraph,
+    read_manifest,
+)
+
+from .conftest import GRID_ORIGIN, GRID_SIZE, GRID_SPACING, grid_node_id
+
+
+def test_from_networkx(street_graph: MultiDiGraph) -> None:
+    graph = CompactGraph.from_networkx(street_graph)
+    assert graph.num_nodes == GRID_SIZE * GRID_SIZE
+    assert graph.num_edges == street_graph.number_of_edges()
+    assert list(graph.node_ids) == sorted(street_graph.nodes)
+    assert graph.offsets[0] == 0 and graph.offsets[-1] == graph.num_edges
+
+    corner = graph.index_of(grid_node_id(0, 0))
+    assert graph.latitudes[corner] == GRID_ORIGIN[0]
+    assert graph.longitudes[corner] == GRID_ORIGIN[1]
+    edges = range(graph.offsets[corner], graph.offsets[corner + 1])
+    assert sorted(graph.node_ids[graph.targets[edge]] for edge in edges) == [
+        grid_node_id(0, 1),
+        grid_node_id(1, 0),
+    ]
+    assert {graph.names[graph.name_ids[edge]] for edge in edges} == {
+        "1 Street",
+        "1 Avenue",
+    }
+    assert all(80 < graph.lengths[edge] < 120 for edge in edges)
+    # No travel times on the test graph
+    assert np.isnan(graph.travel_times).all()
+
+
+def test_from_networkx_names(street_graph: MultiDiGraph) -> None:
+    node_a, node_b = grid_node_id(0, 0), grid_node_id(0, 1)
+    street_graph.add_edge(node_a, node_b, length=1.0, name=["Broadway", "Bway"])
+    street_graph.add_edge(node_a, node_b, length=2.0, travel_time=3.0)
+    graph = CompactGraph.from_networkx(street_graph)
+    source = graph.index_of(node_a)
+    edges = range(graph.offsets[source], graph.offsets[source + 1])
+    by_length = {float(graph.lengths[edge]): edge for edge in edges}
+    assert graph.names[graph.name_ids[by_length[1.0]]] == "Broadway/Bway"
+    assert graph.name_ids[by_length[2.0]] == UNNAMED
+    assert graph.travel_times[by_length[2.0]] == 3.0
+    assert set(graph.edge_keys[list(by_length.values())]) == {0, 1, 2}
+
+
+def test_from_networkx_geometry(street_graph: MultiDiGraph) -> None:
+    west, east = grid_node_id(0, 0), grid_node_id(0, 1)
+    bend = [
+        (GRID_ORIGIN[1] + 0.0003, GRID_ORIGIN[0] - 0.0002),
+        (GRID_ORIGIN[1] + 0.0007, GRID_ORIGIN[0] - 0.0002),
+    ]
+    street_graph.edges[west, east, 0]["geometry"] = shapely.LineString(
+        [(GRID_ORIGIN[1], GRID_ORIGIN[0])]
+        + bend
+        + [(GRID_ORIGIN[1] + 0.001, GRID_ORIGIN[0])]
+    )
+    graph = CompactGraph.from_networkx(street_graph)
+    edge = graph.edge_index(west, east)
+    assert graph.geometry_offsets[-1] == 2
+    start, end = graph.geometry_offsets[edge], graph.geometry_offsets[edge + 1]
+    assert (
+        list(
+            zip(
+                graph.geometry_longitudes[start:end],
+                graph.geometry_latitudes[start:end],
+            )
+        )
+        == bend
+    )
+    offsets, latitudes, longitudes = graph.polylines()
+    assert len(offsets) == graph.num_edges + 1
+    assert offsets[-1] == 2 * graph.num_edges + 2
+    start, end = offsets[edge], offsets[edge + 1]
+    assert list(zip(longitudes[start:end], latitudes[start:end])) == [
+        (graph.longitudes[graph.index_of(west)], graph.latitudes[graph.index_of(west)])
+    ] + bend + [
+        (graph.longitudes[graph.index_of(east)], graph.latitudes[graph.index_of(east)])
+    ]
+    # Edges without geometry are straight between their nodes
+    other = graph.edge_index(east, west)
+    start = offsets[other]
+    assert offsets[other + 1] - start == 2
+    assert latitudes[start] == graph.latitudes[graph.index_of(east)]
+    assert longitudes[start + 1] == graph.longitudes[graph.index_of(west)]
+
+
+def test_index_of(street_graph: MultiDiGraph) -> None:
+    graph = CompactGraph.from_networkx(street_graph)
+    assert graph.node_ids[graph.index_of(grid_node_id(2, 3))] == grid_node_id(2, 3)
+    with pytest.raises(KeyError):
+        graph.index_of(1)
+    with pytest.raises(KeyError):
+        graph.index_of(10**9)
+
+
+def test_edge_keys(street_graph: MultiDiGraph) -> None:
+    node_a, node_b = grid_node_id(1, 1), grid_node_id(1, 2)
+    street_graph.add_edge(node_a, node_b, length=1.0)
+    graph = CompactGraph.from_networkx(street_graph)
+    edges = np.arange(graph.num_edges)
+    assert np.array_equal(
+        graph.sources(edges),
+        np.repeat(np.arange(graph.num_nodes), np.diff(graph.offsets)),
+    )
+    for key in (0, 1):
+        edge = graph.edge_index(node_a, node_b, key)
+        assert graph.edge_key(edge) == (node_a, node_b, key)
+        assert graph.lengths[edge] == street_graph.edges[node_a, node_b, key]["length"]
+    for u, v, key in ((node_a, node_b, 2), (node_a, grid_node_id(3, 3), 0)):
+        with pytest.raises(KeyError):
+            graph.edge_index(u, v, key)
+
+
+def test_pickle(street_graph: MultiDiGraph) -> None:
+    graph = CompactGraph.from_networkx(street_graph)
+    graph.adjacency("length")
+    copy = pickle.loads(pickle.dumps(graph))
+    for name in SNAPSHOT_ARRAYS:
+        assert np.array_equal(getattr(copy, name), getattr(graph, name), equal_nan=True)
+    assert copy.names == graph.names
+    assert list(copy.adjacency("length")[1]) == list(graph.adjacency("length")[1])
+
+
+def test_adjacency(street_graph: MultiDiGraph) -> None:
+    graph = CompactGraph.from_networkx(street_graph)
+    offsets, targets, weights = graph.adjacency("length")
+    assert graph.adjacency("length")[0] is offsets
+    assert list(offsets) == graph.offsets.tolist()
+    assert list(targets) == graph.targets.tolist()
+    assert list(weights) == graph.lengths.tolist()
+    assert np.isnan(graph.adjacency("travel_time")[2][0])
+
+
+def test_nbytes(street_graph: MultiDiGraph) -> None:
+    graph = CompactGraph.from_networkx(street_graph)
+    assert 0 < graph.nbytes() < 10_000
+
+
+def test_snapshot(street_graph: MultiDiGraph, tmp_path: Path) -> None:
+    graph = CompactGraph.from_networkx(street_graph)
+    graph.save(tmp_path / "snapshot")
+    loaded = CompactGraph.load(tmp_path / "snapshot")
+    for name in SNAPSHOT_ARRAYS:
+        array = getattr(loaded, name)
+        assert isinstance(array, np.memmap)
+        assert not array.flags.writeable
+        assert np.array_equal(array, getattr(graph, name), equal_nan=True)
+        assert array.dtype == getattr(graph, name).dtype
+    assert loaded.names == graph.names
+    assert list(loaded.adjacency("length")[1]) == graph.targets.tolist()
+    assert loaded.bounds() == graph.bounds()
+
+    in_memory = CompactGraph.load(tmp_path / "snapshot", mmap=False)
+    assert not isinstance(in_memory.lengths, np.memmap)
+    assert np.array_equal(in_memory.lengths, graph.lengths)
+
+
+def test_bounds(street_graph: MultiDiGraph, tmp_path: Path) -> None:
+    graph = CompactGraph.from_networkx(street_graph)
+    south, west, north, east = graph.bounds()
+    assert (south, west) == pytest.approx(GRID_ORIGIN)
+    assert (north, east) == pytest.approx(
+        (
+            GRID_ORIGIN[0] + (GRID_SIZE - 1) * GRID_SPACING,
+            GRID_ORIGIN[1] + (GRID_SIZE - 1) * GRID_SPACING,
+        )
+    )
+    # Kept in the manifest with any metadata, so opening does not scan arrays
+    graph.save(tmp_path, {"transport_mode": "walk"})
+    manifest = read_manifest(tmp_path)
+    assert manifest["bounds"] == list(graph.bounds())
+    assert manifest["metadata"] == {"transport_mode": "walk"}
+
+
+def test_fingerprint(street_graph: MultiDiGraph, tmp_path: Path) -> None:
+    graph = CompactGraph.from_networkx(street_graph)
+    graph.save(tmp_path)
+    with patch("within.compact_graph.hashlib.sha1") as mock_sha1:
+        loaded = CompactGraph.load(tmp_path)
+        # Read from the manifest rather than hashed again
+        assert loaded.fingerprint("length") == graph.fingerprint("length")
+        assert loaded.fingerprint("travel_time") == graph.fingerprint("travel_time")
+    assert mock_sha1.call_count == 0
+    assert graph.fingerprint("length") != graph.fingerprint("travel_time")
+    street_graph.remove_edge(grid_node_id(0, 0), grid_node_id(0, 1))
+    other_graph = CompactGraph.from_networkx(street_graph)
+    assert other_graph.fingerprint("length") != graph.fingerprint("length")
+
+
+def test_snapshot_version(street_graph: MultiDiGraph, tmp_path: Path) -> None:
+    CompactGraph.from_networkx(street_graph).save(tmp_path)
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    manifest["version"] = 0
+    (tmp_path / "manifest.json").write_text(json.dumps(manifest))
+    with pytest.raises(Exception, match="version 0"):
+        CompactGraph.load(tmp_path)
+
+
+def test_reverse_adjacency(street_graph: MultiDiGraph) -> None:
+    graph = CompactGraph.from_networkx(street_graph)
+    offsets, sources, edges = graph.reverse_adjacency()
+    assert graph.reverse_adjacency() is graph.reverse_adjacency()
+    assert len(sources) == len(edges) == graph.num_edges
+    for node in range(graph.num_nodes):
+        for idx in range(offsets[node], offsets[node + 1]):
+            edge = edges[idx]
+            assert graph.targets[edge] == node
+            assert graph.offsets[sources[idx]] <= edge < graph.offsets[sources[idx] + 1]
+
+
+def test_max_speed(street_graph: MultiDiGraph) -> None:
+    graph = CompactGraph.from_networkx(street_graph)
+    assert graph.has_weight("length")
+    assert not graph.has_weight("travel_time")
+    assert graph.max_speed("length") == 1.0
+    assert graph.max_speed("travel_time") == 0.0
+    for u, v, data in street_graph.edges(data=True):
+        data["travel_time"] = data["length"] / (20 if u < v else 10)
+    graph = CompactGraph.from_networkx(street_graph)
+    assert graph.has_weight("travel_time")
+    assert graph.max_speed("travel_time") == pytest.approx(20)
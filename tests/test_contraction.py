@@ -0,0 +1,121 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+from networkx import MultiDiGraph
+
+from within.compact_graph import CompactGraph
+from within.contraction import ContractionHierarchy
+from within.network import StreetNetwork
+from within.search import bidirectional_astar, dijkstra_costs, node_endpoint
+
+from .conftest import GRID_ORIGIN, GRID_SPACING, grid_node_id
+
+
+@pytest.fixture
+def graph(one_way_street_graph: MultiDiGraph) -> CompactGraph:
+    # A parallel edge makes the grid less regular still
+    one_way_street_graph.add_edge(grid_node_id(0, 0), grid_node_id(0, 1), length=500.0)
+    return CompactGraph.from_networkx(one_way_street_graph)
+
+
+@pytest.fixture
+def hierarchy(graph: CompactGraph) -> ContractionHierarchy:
+    return ContractionHierarchy.build(graph, "length")
+
+
+def test_shortest_paths_match_dijkstra(
+    graph: CompactGraph, hierarchy: ContractionHierarchy
+) -> None:
+    # The contraction order keeps shortcuts well below the number of edges
+    assert 0 < hierarchy.num_shortcuts < graph.num_edges / 2
+    for source in range(graph.num_nodes):
+        expected = dijkstra_costs(graph, {source: 0.0}, "length")
+        for target in range(graph.num_nodes):
+            path = hierarchy.shortest_path(source, target)
+            assert path is not None
+            assert path.cost == pytest.approx(expected[target])
+            assert path.nodes[0] == source and path.nodes[-1] == target
+            # Shortcuts are unpacked into consecutive original edges
+            assert len(path.edges) == len(path.nodes) - 1
+            for node, next_node, edge in zip(path.nodes, path.nodes[1:], path.edges):
+                assert graph.offsets[node] <= edge < graph.offsets[node + 1]
+                assert graph.targets[edge] == next_node
+            assert float(graph.lengths[path.edges].sum()) == pytest.approx(path.cost)
+
+
+def test_shortest_paths_between_endpoints(
+    graph: CompactGraph, hierarchy: ContractionHierarchy
+) -> None:
+    rng = np.random.default_rng(0)
+    offsets = rng.uniform(0, 5 * GRID_SPACING, (40, 2))
+    # Also points on the same edge, in both directions
+    offsets[-4:] = [[0.0, 0.0002], [0.0, 0.0008], [0.0, 0.0007], [0.0, 0.0003]]
+    endpoints, _ = StreetNetwork(compact=graph).snap_to_edges(
+        GRID_ORIGIN[0] + offsets[:, 0], GRID_ORIGIN[1] + offsets[:, 1]
+    )
+    for source, target in zip(endpoints[::2], endpoints[1::2]):
+        path = hierarchy.shortest_path(source, target)
+        expected = bidirectional_astar(graph, source, target, "length")
+        assert path is not None and expected is not None
+        assert path.cost == pytest.approx(expected.cost)
+        assert (path.nodes == []) == (expected.nodes == [])
+
+
+def test_search_spaces_meet_at_shortest_paths(
+    graph: CompactGraph, hierarchy: ContractionHierarchy
+) -> None:
+    for source, target in ((0, 35), (14, 8), (20, 20)):
+        forward = hierarchy.search_space(node_endpoint(graph, source).outgoing)
+        backward = hierarchy.search_space(
+            node_endpoint(graph, target).incoming, backward=True
+        )
+        expected = dijkstra_costs(graph, {source: 0.0}, "length", {target})
+        assert min(
+            forward[node] + backward[node] for node in forward.keys() & backward.keys()
+        ) == pytest.approx(expected[target])
+
+
+def test_unreachable(street_graph: MultiDiGraph) -> None:
+    street_graph.add_node(9999, y=40.0, x=-74.0)
+    graph = CompactGraph.from_networkx(street_graph)
+    hierarchy = ContractionHierarchy.build(graph, "length")
+    assert hierarchy.shortest_path(0, graph.index_of(9999)) is None
+    assert hierarchy.shortest_path(graph.index_of(9999), 0) is None
+
+
+def test_build_requires_weight(graph: CompactGraph) -> None:
+    with pytest.raises(Exception, match="without travel_time"):
+        ContractionHierarchy.build(graph, "travel_time")
+
+
+def test_save_load(
+    graph: CompactGraph, hierarchy: ContractionHierarchy, tmp_path: Path
+) -> None:
+    hierarchy.save(tmp_path)
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    assert manifest["weight"] == "length"
+    assert manifest["fingerprint"] == graph.fingerprint("length")
+
+    loaded = ContractionHierarchy.load(tmp_path, graph, "length")
+    assert isinstance(loaded.weights, np.memmap)
+    assert np.array_equal(loaded.up_targets, hierarchy.up_targets)
+    source, target = graph.index_of(grid_node_id(0, 0)), graph.index_of(
+        grid_node_id(5, 5)
+    )
+    expected = hierarchy.shortest_path(source, target)
+    assert expected is not None
+    assert loaded.shortest_path(source, target) == expected
+
+
+def test_load_other_graph(
+    street_graph: MultiDiGraph, hierarchy: ContractionHierarchy, tmp_path: Path
+) -> None:
+    hierarchy.save(tmp_path)
+    street_graph.remove_edge(grid_node_id(5, 5), grid_node_id(5, 4))
+    other_graph = CompactGraph.from_networkx(street_graph)
+    with pytest.raises(Exception, match="built for another graph"):
+        ContractionHierarchy.load(tmp_path, other_graph, "length")
+    with pytest.raises(Exception, match="built for another graph"):
+        ContractionHierarchy.load(tmp_path, hierarchy.graph, "travel_time")
@@ -0,0 +1,220 @@
+import sqlite3
+from pathlib import Path
+from typing import Iterator, Tuple
+from unittest.mock import Mock, patch
+
+import networkx
+import pytest
+from networkx import MultiDiGraph
+
+from within.graph_cache import (
+    GraphCache,
+    add_travel_times,
+    corridor_tiles,
+    get_graph_cache,
+    load_corridor_graph,
+    load_graph,
+)
+
+from .conftest import GRID_ORIGIN, GRID_SIZE, GRID_SPACING, grid_node_id
+
+CENTER = (40.7, -74.0)
+
+
+@pytest.fixture
+def mock_graph_from_point(street_graph: MultiDiGraph) -> Iterator[Mock]:
+    with patch("within.graph_cache.osmnx.graph.graph_from_point") as mock_download:
+        mock_download.return_value = street_graph
+        yield mock_download
+
+
+def test_graph_cache_find_covering(tmp_path: Path, street_graph: MultiDiGraph) -> None:
+    cache = GraphCache(tmp_path, max_bytes=10**9)
+    key = GraphCache.disc_key("walk", CENTER, 2000)
+    cache.put(key, "walk", CENTER, 2000, street_graph)
+
+    cached = cache.find("walk", CENTER, 1000)
+    assert cached is not None
+    assert networkx.utils.graphs_equal(cached, street_graph)
+    # Offset circle still inside the cached one (~1.1 km north + 800 m radius)
+    assert cache.find("walk", (40.71, -74.0), 800) is not None
+    # Sticking out of the cached circle
+    assert cache.find("walk", (40.71, -74.0), 1000) is None
+    assert cache.find("walk", CENTER, 2500) is None
+    # Other transport mode
+    assert cache.find("drive", CENTER, 1000) is None
+
+
+def test_graph_cache_evicts_least_recently_used(
+    tmp_path: Path, street_graph: MultiDiGraph
+) -> None:
+    cache = GraphCache(tmp_path, max_bytes=10**9)
+    cache.put("a", "walk", CENTER, 1000, street_graph)
+    graph_size = cache.total_bytes()
+    cache.max_bytes = 2 * graph_size
+    cache.put("b", "walk", (41.0, -74.0), 1000, street_graph)
+    assert cache.get("a") is not None  # "b" is now least recently used
+    cache.put("c", "walk", (42.0, -74.0), 1000, street_graph)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.total_bytes() == 2 * graph_size
+    assert len(list(tmp_path.glob("*.pickle"))) == 2
+
+
+def test_load_graph_uses_cache(
+    graph_cache_dir: Path, mock_graph_from_point: Mock
+) -> None:
+    graph = load_graph(CENTER, 2000, "walk")
+    # Smaller area inside the first one does not touch the network
+    cached_graph = load_graph((40.701, -74.0), 1000, "walk")
+    assert mock_graph_from_point.call_count == 1
+    assert mock_graph_from_point.call_args[0] == (CENTER, 2000)
+    assert mock_graph_from_point.call_args[1] == {"network_type": "walk"}
+    assert networkx.utils.graphs_equal(cached_graph, graph)
+    load_graph(CENTER, 2000, "bike")
+    assert mock_graph_from_point.call_count == 2
+
+
+def test_load_graph_adds_travel_times(
+    graph_cache_dir: Path, mock_graph_from_point: Mock, street_graph: MultiDiGraph
+) -> None:
+    # Cached without travel times, e.g. by an older version
+    GraphCache(graph_cache_dir, 10**9).put(
+        GraphCache.disc_key("walk", CENTER, 2000), "walk", CENTER, 2000, street_graph
+    )
+    graph = load_graph(CENTER, 2000, "walk")
+    assert mock_graph_from_point.call_count == 0
+    assert all(data["speed_kph"] == 5 for _, _, data in graph.edges(data=True))
+
+    graph = load_graph(CENTER, 2000, "drive")
+    assert mock_graph_from_point.call_count == 1
+    assert all("travel_time" in data for _, _, data in graph.edges(data=True))
+    # Downloaded graphs are cached with travel times
+    cache = get_graph_cache()
+    cached_graph = cache.find("drive", CENTER, 2000)
+    assert cached_graph is not None
+    assert networkx.utils.graphs_equal(cached_graph, graph)
+    assert cache.has_travel_times(GraphCache.disc_key("drive", CENTER, 2000))
+    assert not cache.has_travel_times(GraphCache.disc_key("walk", CENTER, 2000))
+    # and served without going over their edges again
+    with patch("within.graph_cache.add_travel_times") as mock_add_travel_times:
+        load_graph(CENTER, 1000, "drive")
+    assert mock_add_travel_times.call_count == 0
+
+
+def test_graph_cache_upgrades_index(tmp_path: Path) -> None:
+    with sqlite3.connect(tmp_path / "index.sqlite3") as connection:
+        connection.execute(
+            "CREATE TABLE graphs ("
+            "key TEXT PRIMARY KEY, transport_mode TEXT NOT NULL, "
+            "latitude REAL NOT NULL, longitude REAL NOT NULL, radius_m REAL NOT NULL, "
+            "file_name TEXT NOT NULL, size_bytes INTEGER NOT NULL, "
+            "last_used REAL NOT NULL)"
+        )
+        connection.execute(
+            "INSERT INTO graphs VALUES ('old', 'walk', 0, 0, 1, 'old.pickle', 1, 0)"
+        )
+    connection.close()
+    cache = GraphCache(tmp_path, 10**9)
+    assert cache.find_key("walk", (0, 0), 1) == "old"
+    assert not cache.has_travel_times("old")
+
+
+def test_add_travel_times(street_graph: MultiDiGraph) -> None:
+    residential = (grid_node_id(0, 0), grid_node_id(0, 1), 0)
+    primary = (grid_node_id(0, 0), grid_node_id(1, 0), 0)
+    drive_graph = add_travel_times(street_graph.copy(), "drive")
+    assert drive_graph.edges[residential]["speed_kph"] == 30
+    assert drive_graph.edges[primary]["speed_kph"] == 60
+    length = drive_graph.edges[primary]["length"]
+    assert drive_graph.edges[primary]["travel_time"] == pytest.approx(length / 60 * 3.6)
+
+    street_graph.edges[residential]["highway"] = ["residential", "steps"]
+    street_graph.edges[primary]["highway"] = "footway"
+    bike_graph = add_travel_times(street_graph.copy(), "bike")
+    assert bike_graph.edges[residential]["speed_kph"] == 2
+    assert bike_graph.edges[primary]["speed_kph"] == 5
+    assert bike_graph.edges[(grid_node_id(1, 0), grid_node_id(1, 1), 0)][
+        "speed_kph"
+    ] == (15)
+    walk_graph = add_travel_times(street_graph.copy(), "walk")
+    assert walk_graph.edges[primary]["speed_kph"] == 5
+
+    empty_graph = MultiDiGraph()
+    assert add_travel_times(empty_graph, "drive") is empty_graph
+
+
+def test_load_graph_without_cache(
+    graph_cache_dir: Path, mock_graph_from_point: Mock
+) -> None:
+    with patch("within.graph_cache.USE_GRAPH_CACHE", False):
+        load_graph(CENTER, 2000, "walk")
+        load_graph(CENTER, 2000, "walk")
+    assert mock_graph_from_point.call_count == 2
+    assert not graph_cache_dir.exists()
+
+
+@pytest.fixture
+def mock_graph_from_bbox(street_graph: MultiDiGraph) -> Iterator[Mock]:
+    def graph_from_bbox(
+        bbox: Tuple[float, float, float, float], **kwargs: object
+    ) -> MultiDiGraph:
+        left, bottom, right, top = bbox
+        inside = {
+            node
+            for node, data in street_graph.nodes(data=True)
+            if left <= data["x"] < right and bottom <= data["y"] < top
+        }
+        if not inside:
+            # What osmnx raises for tiles without streets
+            raise ValueError("No data elements in server response")
+        # truncate_by_edge: keep edges leaving the tile and their far ends
+        nodes = inside | {
+            neighbor for node in inside for neighbor in street_graph.neighbors(node)
+        }
+        return street_graph.subgraph(nodes).copy()
+
+    with patch("within.graph_cache.osmnx.graph.graph_from_bbox") as mock_download:
+        mock_download.side_effect = graph_from_bbox
+        yield mock_download
+
+
+def test_corridor_tiles() -> None:
+    start, end = (40.05, -74.05), (41.05, -74.05)
+    tiles = corridor_tiles(start, end, half_width_km=1, tile_size_deg=0.1)
+    # Narrow band along a meridian: one column, rows from 40.0x to 41.0x
+    assert {col for _, col in tiles} == {-741}
+    assert [row for row, _ in tiles] == list(range(400, 411))
+    wide_tiles = corridor_tiles(start, end, half_width_km=10, tile_size_deg=0.1)
+    # ~0.12 degrees of longitude either side at this latitude
+    assert {col for _, col in wide_tiles} == {-742, -741, -740}
+    assert len(set(wide_tiles)) == len(wide_tiles)
+
+
+def test_load_corridor_graph(
+    graph_cache_dir: Path, mock_graph_from_bbox: Mock, street_graph: MultiDiGraph
+) -> None:
+    start = (GRID_ORIGIN[0], GRID_ORIGIN[1])
+    end = (
+        GRID_ORIGIN[0] + (GRID_SIZE - 1) * GRID_SPACING,
+        GRID_ORIGIN[1] + (GRID_SIZE - 1) * GRID_SPACING,
+    )
+    with patch("within.graph_cache.TILE_SIZE_DEG", 0.002):
+        graph = load_corridor_graph(start, end, "walk", half_width_km=1)
+        num_tiles = mock_graph_from_bbox.call_count
+        assert num_tiles > 1
+        # Tiles are cached individually
+        load_corridor_graph(start, end, "walk", half_width_km=1)
+        assert mock_graph_from_bbox.call_count == num_tiles
+    assert mock_graph_from_bbox.call_args[1]["simplify"] is False
+    assert mock_graph_from_bbox.call_args[1]["truncate_by_edge"] is True
+    # Stitched into one connected graph where only the corners get simplified away
+    assert networkx.is_strongly_connected(graph)
+    corners = {
+        grid_node_id(row, col)
+        for row in (0, GRID_SIZE - 1)
+        for col in (0, GRID_SIZE - 1)
+    }
+    assert set(graph.nodes) == set(street_graph.nodes) - corners
+    assert all("travel_time" in data for _, _, data in graph.edges(data=True))
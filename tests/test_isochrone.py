@@ -0,0 +1,124 @@
+from pathlib import Path
+from unittest.mock import patch
+
+import networkx
+import pytest
+import shapely
+from networkx import MultiDiGraph
+
+from within.address import Address
+from within.graph_cache import add_travel_times
+from within.isochrone import ISOCHRONE_MARGIN_M, Isochrone
+from within.network import RegionalNetwork
+from within.search import dijkstra_costs
+
+from .conftest import GRID_ORIGIN, GRID_SPACING, grid_address, grid_node_id
+
+
+def grid_point(row: float, col: float) -> shapely.Point:
+    return shapely.Point(
+        GRID_ORIGIN[1] + col * GRID_SPACING, GRID_ORIGIN[0] + row * GRID_SPACING
+    )
+
+
+def test_isochrone_reachable_nodes(
+    street_graph: MultiDiGraph, region: RegionalNetwork
+) -> None:
+    isochrone = Isochrone(grid_address(0, 0), 250, "walk", region=region)
+    expected = networkx.single_source_dijkstra_path_length(
+        street_graph, grid_node_id(0, 0), cutoff=250, weight="length"
+    )
+    nodes = isochrone.reachable_nodes()
+    assert nodes == pytest.approx(expected)
+    assert list(nodes.values()) == sorted(nodes.values())
+    assert set(nodes) == {
+        grid_node_id(0, 0),
+        grid_node_id(0, 1),
+        grid_node_id(0, 2),
+        grid_node_id(1, 0),
+        grid_node_id(1, 1),
+        grid_node_id(2, 0),
+    }
+    assert set(isochrone.reachable_nodes(100)) == {
+        grid_node_id(0, 0),
+        grid_node_id(0, 1),
+    }
+
+
+def test_isochrone_polygons_from_one_search(region: RegionalNetwork) -> None:
+    isochrone = Isochrone(grid_address(2, 2), 400, "walk", region=region)
+    with patch(
+        "within.isochrone.dijkstra_costs", wraps=dijkstra_costs
+    ) as mock_dijkstra_costs:
+        polygons = isochrone.polygons([100, 200, 400])
+        isochrone.reachable_nodes(300)
+    assert mock_dijkstra_costs.call_count == 1
+    assert polygons[100].area < polygons[200].area < polygons[400].area
+    assert polygons[200].covers(grid_point(2, 2))
+    assert polygons[200].covers(grid_point(3, 3))
+    assert not polygons[200].covers(grid_point(4, 4))
+    # 391 m away, two blocks each way
+    assert polygons[400].covers(grid_point(0, 0))
+    # 200 m reaches part way along the streets, e.g. two blocks east and beyond
+    assert polygons[200].covers(grid_point(2, 4.3))
+    assert not polygons[200].covers(grid_point(2, 4.5))
+
+
+def test_isochrone_mid_block(region: RegionalNetwork) -> None:
+    # Half way along 1 Street between 2 and 3 Avenue, 42 m from either end
+    isochrone = Isochrone(grid_address(0, 1.5), 50, "walk", region=region)
+    assert isochrone.snap_distance_m == pytest.approx(0, abs=0.01)
+    assert isochrone.reachable_nodes(40) == {}
+    assert isochrone.reachable_nodes() == pytest.approx(
+        {grid_node_id(0, 1): 42.15, grid_node_id(0, 2): 42.15}, rel=0.01
+    )
+    # Only 1 Street is reached, 20 m either side of the start
+    hull = isochrone.polygon(20)
+    min_x, min_y, max_x, max_y = hull.bounds
+    assert hull.area == pytest.approx(0, abs=1e-12)
+    assert max_x - min_x == pytest.approx(40 / 84.3 * GRID_SPACING, rel=0.01)
+    assert max_y - min_y == pytest.approx(0, abs=1e-9)
+
+
+def test_isochrone_travel_time(street_graph: MultiDiGraph) -> None:
+    add_travel_times(street_graph, "walk")
+    with patch("within.isochrone.load_graph") as mock_load_graph:
+        mock_load_graph.return_value = street_graph
+        isochrone = Isochrone(grid_address(0, 0), 120, "walk", weight_by="travel_time")
+        nodes = isochrone.reachable_nodes()
+    # 5 km/h for two minutes is 167 m
+    assert mock_load_graph.call_args[0][1] == pytest.approx(
+        120 / 3.6 * 5 + ISOCHRONE_MARGIN_M
+    )
+    assert set(nodes) == {
+        grid_node_id(0, 0),
+        grid_node_id(0, 1),
+        grid_node_id(1, 0),
+    }
+    assert nodes[grid_node_id(0, 1)] == pytest.approx(84.3 / 5 * 3.6, rel=0.01)
+
+
+def test_isochrone_invalid(region: RegionalNetwork) -> None:
+    isochrone = Isochrone(grid_address(0, 0), 100, "walk", region=region)
+    with pytest.raises(AssertionError, match="beyond budget"):
+        isochrone.polygon(200)
+    with pytest.raises(AssertionError, match="no travel_time"):
+        Isochrone(
+            grid_address(0, 0), 100, "walk", weight_by="travel_time", region=region
+        ).reachable_nodes()
+    with pytest.raises(AssertionError, match="outside the region"):
+        Isochrone(Address("Far", (41.0, -74.0)), 100, "walk", region=region).polygon()
+
+
+def test_isochrone_snapshot(region: RegionalNetwork, tmp_path: Path) -> None:
+    region.network("walk").save_snapshot(tmp_path)
+    isochrone = Isochrone(grid_address(0, 0), 250, "walk", snapshot=tmp_path)
+    assert isochrone.reachable_nodes() == pytest.approx(
+        Isochrone(grid_address(0, 0), 250, "walk", region=region).reachable_nodes()
+    )
+    with pytest.raises(AssertionError, match="walk network, not bike"):
+        Isochrone(grid_address(0, 0), 250, "bike", snapshot=tmp_path).polygon()
+    with pytest.raises(AssertionError, match="Far is outside the snapshot"):
+        Isochrone(
+            Address("Far", (41.0, -74.0)), 100, "walk", snapshot=tmp_path
+        ).polygon()
@@ -0,0 +1,90 @@
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from networkx import MultiDiGraph
+
+from within.matrix import cost_matrix
+from within.network import StreetNetwork
+from within.search import bidirectional_astar
+
+from .conftest import GRID_ORIGIN, GRID_SPACING
+
+
+@pytest.fixture
+def network(one_way_street_graph: MultiDiGraph) -> StreetNetwork:
+    # A separate street nothing else connects to
+    one_way_street_graph.add_node(1, y=GRID_ORIGIN[0] - 0.01, x=GRID_ORIGIN[1])
+    one_way_street_graph.add_node(2, y=GRID_ORIGIN[0] - 0.01, x=GRID_ORIGIN[1] + 0.001)
+    one_way_street_graph.add_edge(1, 2, length=84.0)
+    one_way_street_graph.add_edge(2, 1, length=84.0)
+    return StreetNetwork(one_way_street_graph)
+
+
+def _points(count: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return np.column_stack(
+        [
+            GRID_ORIGIN[0] + rng.uniform(0, 5 * GRID_SPACING, count),
+            GRID_ORIGIN[1] + rng.uniform(0, 5 * GRID_SPACING, count),
+        ]
+    )
+
+
+def _expected(
+    network: StreetNetwork, origins: np.ndarray, destinations: np.ndarray
+) -> np.ndarray:
+    origin_endpoints, _ = network.snap_to_edges(origins[:, 0], origins[:, 1])
+    destination_endpoints, _ = network.snap_to_edges(
+        destinations[:, 0], destinations[:, 1]
+    )
+    expected = np.full((len(origins), len(destinations)), np.inf)
+    for row, origin in enumerate(origin_endpoints):
+        for col, destination in enumerate(destination_endpoints):
+            path = bidirectional_astar(network.compact, origin, destination, "length")
+            if path is not None:
+                expected[row, col] = path.cost
+    return expected
+
+
+def test_cost_matrix(network: StreetNetwork) -> None:
+    origins, destinations = _points(6, 0), _points(9, 1)
+    # Same street, a little further along
+    destinations[0] = origins[0] + [0, 0.0001]
+    matrix = cost_matrix(network, origins, destinations)
+    assert matrix.shape == (6, 9)
+    assert matrix == pytest.approx(_expected(network, origins, destinations))
+    assert cost_matrix(network, destinations, origins) != pytest.approx(matrix.T)
+
+
+def test_cost_matrix_unreachable(network: StreetNetwork) -> None:
+    isolated = [GRID_ORIGIN[0] - 0.01, GRID_ORIGIN[1] + 0.0005]
+    matrix = cost_matrix(network, [GRID_ORIGIN, isolated], [GRID_ORIGIN, isolated])
+    assert matrix[0, 0] == 0
+    assert matrix[1, 1] == 0
+    assert np.isinf(matrix[0, 1]) and np.isinf(matrix[1, 0])
+
+
+def test_cost_matrix_contraction_hierarchy(network: StreetNetwork) -> None:
+    origins, destinations = _points(6, 2), _points(9, 3)
+    destinations[0] = origins[0] - [0.0001, 0]
+    expected = cost_matrix(network, origins, destinations)
+    network.prepare_contraction_hierarchy("length")
+    with patch("within.matrix.dijkstra_costs") as mock_dijkstra_costs:
+        matrix = cost_matrix(network, origins, destinations)
+    assert mock_dijkstra_costs.call_count == 0
+    assert matrix == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("prepare_hierarchy", [False, True])
+def test_cost_matrix_processes(network: StreetNetwork, prepare_hierarchy: bool) -> None:
+    if prepare_hierarchy:
+        network.prepare_contraction_hierarchy("length")
+    origins, destinations = _points(7, 4), _points(5, 5)
+    matrix = cost_matrix(network, origins, destinations, processes=2)
+    assert matrix == pytest.approx(cost_matrix(network, origins, destinations))
+
+
+def test_cost_matrix_requires_weight(network: StreetNetwork) -> None:
+    with pytest.raises(AssertionError, match="no travel_time"):
+        cost_matrix(network, [GRID_ORIGIN], [GRID_ORIGIN], "travel_time")
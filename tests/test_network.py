@@ -0,0 +1,219 @@
+from pathlib import Path
+from typing import Iterator
+from unittest.mock import Mock, patch
+
+import networkx
+import numpy as np
+import pytest
+import shapely
+from networkx import MultiDiGraph
+
+from within.network import RegionalNetwork, StreetNetwork
+from within.search import LinkT, node_endpoint
+from within.spatial_index import NodeIndex
+from within.spherical_geometry import great_circle_distance
+
+from .conftest import GRID_ORIGIN, GRID_SPACING, grid_node_id
+
+
+@pytest.fixture
+def mock_load_graph(street_graph: MultiDiGraph) -> Iterator[Mock]:
+    with patch("within.network.load_graph") as mock_load:
+        mock_load.side_effect = lambda *args: street_graph.copy()
+        yield mock_load
+
+
+def test_street_network(street_graph: MultiDiGraph) -> None:
+    with patch("within.network.EdgeIndex.build") as mock_build_edge_index:
+        network = StreetNetwork(street_graph)
+    # Spatial indexes are built on first use
+    assert mock_build_edge_index.call_count == 0
+    assert network.graph is None
+    kept = StreetNetwork(street_graph, keep_graph=True).graph
+    assert kept is not None and networkx.is_frozen(kept)
+    assert network.compact.num_nodes == street_graph.number_of_nodes()
+
+
+def test_street_network_snap_to_nodes(street_graph: MultiDiGraph) -> None:
+    with patch("within.network.NodeIndex.build", wraps=NodeIndex.build) as mock_build:
+        network = StreetNetwork(street_graph)
+        assert mock_build.call_count == 0
+        network.snap_to_nodes([GRID_ORIGIN[0]], [GRID_ORIGIN[1]])
+    assert mock_build.call_count == 1
+    nodes, dist_m = network.snap_to_nodes(
+        [GRID_ORIGIN[0] + 0.0021, GRID_ORIGIN[0]],
+        [GRID_ORIGIN[1] + 0.0029, GRID_ORIGIN[1]],
+    )
+    assert network.compact.node_ids[nodes].tolist() == [
+        grid_node_id(2, 3),
+        grid_node_id(0, 0),
+    ]
+    assert 10 < dist_m[0] < 20
+    assert dist_m[1] == pytest.approx(0)
+
+
+def test_street_network_snap_to_edges(street_graph: MultiDiGraph) -> None:
+    network = StreetNetwork(street_graph)
+    compact = network.compact
+    (on_street, at_corner), dist_m = network.snap_to_edges(
+        [GRID_ORIGIN[0] + 0.0001, GRID_ORIGIN[0] + 2 * GRID_SPACING],
+        [GRID_ORIGIN[1] + 0.25 * GRID_SPACING, GRID_ORIGIN[1] + 3 * GRID_SPACING],
+    )
+    # A quarter along 1 Street between 1 and 2 Avenue, linked both ways
+    assert on_street.latitude == pytest.approx(GRID_ORIGIN[0])
+    assert on_street.longitude == pytest.approx(GRID_ORIGIN[1] + 0.25 * GRID_SPACING)
+    west, east = compact.index_of(grid_node_id(0, 0)), compact.index_of(
+        grid_node_id(0, 1)
+    )
+    for links in (on_street.outgoing, on_street.incoming):
+        assert sorted((link.node, round(link.share, 3)) for link in links) == [
+            (west, 0.25),
+            (east, 0.75),
+        ]
+    for link in on_street.outgoing:
+        assert compact.targets[link.edge] == link.node
+    assert dist_m[0] == pytest.approx(11.1, abs=0.1)
+    # At a node there is no virtual node
+    assert at_corner.outgoing == at_corner.incoming
+    assert at_corner.outgoing == (LinkT(compact.index_of(grid_node_id(2, 3)), -1, 0.0),)
+    assert dist_m[1] == pytest.approx(0)
+
+
+def test_street_network_snap_to_curved_edges(street_graph: MultiDiGraph) -> None:
+    # A one-way crescent from 1 to 3 Avenue, bending half a block south of 1 Street
+    west, east = grid_node_id(0, 0), grid_node_id(0, 2)
+    apex = (GRID_ORIGIN[1] + GRID_SPACING, GRID_ORIGIN[0] - 0.5 * GRID_SPACING)
+    street_graph.add_edge(
+        west,
+        east,
+        length=2
+        * 1000
+        * great_circle_distance(GRID_ORIGIN[0], GRID_ORIGIN[1], apex[1], apex[0]),
+        name="Crescent",
+        geometry=shapely.LineString(
+            [
+                (GRID_ORIGIN[1], GRID_ORIGIN[0]),
+                apex,
+                (GRID_ORIGIN[1] + 2 * GRID_SPACING, GRID_ORIGIN[0]),
+            ]
+        ),
+    )
+    network = StreetNetwork(street_graph)
+    compact = network.compact
+    (endpoint,), dist_m = network.snap_to_edges([apex[1] - 0.0001], [apex[0]])
+    # On the crescent half way along, not on 1 Street which its ends lie on
+    crescent = compact.edge_index(west, east)
+    assert endpoint.latitude == pytest.approx(apex[1])
+    assert endpoint.longitude == pytest.approx(apex[0])
+    ((outgoing,), (incoming,)) = endpoint.outgoing, endpoint.incoming
+    assert (outgoing.node, outgoing.edge) == (compact.index_of(east), crescent)
+    assert (incoming.node, incoming.edge) == (compact.index_of(west), crescent)
+    assert outgoing.share == pytest.approx(0.5)
+    assert incoming.share == pytest.approx(0.5)
+    assert dist_m[0] == pytest.approx(11.1, abs=0.1)
+
+
+def test_street_network_snapshot(street_graph: MultiDiGraph, tmp_path: Path) -> None:
+    network = StreetNetwork(street_graph, transport_mode="walk")
+    network.save_snapshot(tmp_path / "unused")
+    # The node index is only built (and saved) once used
+    assert not (tmp_path / "unused" / "node_index.pickle").exists()
+    network.snap_to_nodes([GRID_ORIGIN[0]], [GRID_ORIGIN[1]])
+    network.save_snapshot(tmp_path / "walk")
+    with (
+        patch("within.network.NodeIndex.build") as mock_build,
+        patch("within.network.EdgeIndex.build") as mock_build_edge_index,
+    ):
+        network = StreetNetwork.open_snapshot(tmp_path / "walk")
+        assert network.snap_to_nodes([GRID_ORIGIN[0]], [GRID_ORIGIN[1]])[0][0] == 0
+        endpoints, _ = network.snap_to_edges([GRID_ORIGIN[0]], [GRID_ORIGIN[1]])
+    assert mock_build.call_count == 0
+    assert mock_build_edge_index.call_count == 0
+    assert endpoints[0] == node_endpoint(network.compact, 0)
+    assert network.graph is None
+    assert network.transport_mode == "walk"
+    assert list(network.compact.node_ids) == sorted(street_graph.nodes)
+    assert StreetNetwork.open_snapshot(tmp_path / "unused").transport_mode == "walk"
+    with pytest.raises(AssertionError):
+        StreetNetwork()
+
+
+def test_street_network_covers(street_graph: MultiDiGraph) -> None:
+    network = StreetNetwork(street_graph)
+    assert network.covers(GRID_ORIGIN[0] + GRID_SPACING, GRID_ORIGIN[1])
+    # Within COVERS_MARGIN_M (about 111 m per GRID_SPACING of latitude)
+    assert network.covers(GRID_ORIGIN[0] - 2 * GRID_SPACING, GRID_ORIGIN[1])
+    assert not network.covers(GRID_ORIGIN[0] - 3 * GRID_SPACING, GRID_ORIGIN[1])
+    assert not network.covers(41.0, -74.0)
+
+
+def test_regional_network_loads_each_mode_once(mock_load_graph: Mock) -> None:
+    region = RegionalNetwork(GRID_ORIGIN, 2000, transport_modes=["walk", "drive"])
+    assert region.network("drive").transport_mode == "drive"
+    assert mock_load_graph.call_count == 2
+    assert mock_load_graph.call_args_list[0][0] == (GRID_ORIGIN, 2000, "walk")
+    assert region.network("walk") is region.network("walk")
+    assert region.network("walk") is not region.network("drive")
+    assert mock_load_graph.call_count == 2
+    with pytest.raises(AssertionError):
+        region.network("bike")
+    assert region.network("walk").graph is None
+
+
+def test_regional_network_keep_graph(
+    mock_load_graph: Mock, street_graph: MultiDiGraph
+) -> None:
+    region = RegionalNetwork(GRID_ORIGIN, 2000, ["walk"], keep_graph=True)
+    graph = region.network("walk").graph
+    assert graph is not None and set(graph.nodes) == set(street_graph.nodes)
+
+
+def test_regional_network_covers(mock_load_graph: Mock) -> None:
+    region = RegionalNetwork(GRID_ORIGIN, 2000, transport_modes=["walk"])
+    assert region.covers(GRID_ORIGIN[0] + 0.01, GRID_ORIGIN[1])
+    assert not region.covers(GRID_ORIGIN[0] + 0.02, GRID_ORIGIN[1])
+
+
+def test_prepare_contraction_hierarchy(
+    street_graph: MultiDiGraph, tmp_path: Path
+) -> None:
+    network = StreetNetwork(street_graph)
+    hierarchy = network.prepare_contraction_hierarchy("length", tmp_path / "ch")
+    assert network.hierarchies == {"length": hierarchy}
+    assert network.prepare_contraction_hierarchy("length") is hierarchy
+    assert (tmp_path / "ch" / "manifest.json").exists()
+
+    # A fresh network loads the saved hierarchy instead of building one
+    other_network = StreetNetwork(street_graph)
+    with patch("within.network.ContractionHierarchy.build") as mock_build:
+        loaded = other_network.prepare_contraction_hierarchy("length", tmp_path / "ch")
+    assert mock_build.call_count == 0
+    assert np.array_equal(loaded.weights, hierarchy.weights)
+
+    # ...unless it was made for another graph
+    changed_graph = MultiDiGraph(street_graph)
+    changed_graph.remove_edge(grid_node_id(0, 0), grid_node_id(0, 1))
+    changed_network = StreetNetwork(changed_graph)
+    with patch("within.network.ContractionHierarchy.build") as mock_build:
+        changed_network.prepare_contraction_hierarchy("length", tmp_path / "ch")
+    assert mock_build.call_count == 1
+
+
+def test_street_network_snapshot_hierarchies(
+    street_graph: MultiDiGraph, tmp_path: Path
+) -> None:
+    network = StreetNetwork(street_graph)
+    network.prepare_contraction_hierarchy()
+    network.save_snapshot(tmp_path)
+    assert list(StreetNetwork.open_snapshot(tmp_path).hierarchies) == ["length"]
+
+
+def test_regional_network_contraction_hierarchies(
+    mock_load_graph: Mock, tmp_path: Path
+) -> None:
+    region = RegionalNetwork(GRID_ORIGIN, 2000, transport_modes=["walk", "drive"])
+    region.prepare_contraction_hierarchies("length", tmp_path)
+    assert "length" in region.network("walk").hierarchies
+    assert "length" in region.network("drive").hierarchies
+    assert (tmp_path / "walk" / "manifest.json").exists()
+    assert (tmp_path / "drive" / "manifest.json").exists()
@@ -1,12 +1,28 @@
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Iterator
+from time import sleep
+from typing import Iterator, List, Optional, Tuple
 from unittest.mock import Mock, create_autospec, patch
 
 import pytest
 from requests import Response
+from requests.adapters import HTTPAdapter
 
-from within.nominatim import NOMINATIM_ENDPOINT, REQUEST_TIMEOUT, coords_from_addresses
+from within import nominatim
+from within.cache import SQLiteCache
+from within.nominatim import (
+    NOMINATIM_ENDPOINT,
+    REQUEST_TIMEOUT,
+    bulk_coords_from_addresses,
+    configure_session,
+    coords_from_addresses,
+    memory_cache_stats,
+    normalize_query,
+    set_rate_limit,
+)
+from within.rate_limit import TokenBucket
 
 
 @pytest.fixture
@@ -28,14 +44,27 @@ def no_cache() -> Iterator[None]:
         yield
 
 
-def test_coords_from_address(mock_response: Mock, no_cache: None) -> None:
-    with patch("within.nominatim.sleep") as mock_sleep:
-        with patch("within.nominatim.requests.get") as mock_get:
-            mock_get.return_value = mock_response
-            resp = coords_from_addresses(["1071 5th Ave, New York", "Guggenheim"])
+@pytest.fixture
+def mock_rate_limiter() -> Iterator[Mock]:
+    with patch("within.nominatim._rate_limiter", spec=TokenBucket) as mock_limiter:
+        yield mock_limiter
+
+
+@pytest.fixture
+def cache_paths(tmp_path: Path) -> Iterator[Path]:
+    with patch("within.nominatim.CACHE_DB_PATH", tmp_path / "cache.sqlite3"):
+        with patch("within.nominatim.CACHE_FILE_PATH", tmp_path / "cache.json"):
+            yield tmp_path
+
+
+def test_coords_from_address(
+    mock_response: Mock, mock_rate_limiter: Mock, no_cache: None
+) -> None:
+    with patch("within.nominatim.requests.Session.get") as mock_get:
+        mock_get.return_value = mock_response
+        resp = coords_from_addresses(["1071 5th Ave, New York", "Guggenheim"])
     assert resp[0] == resp[1] == (40.7829932, -73.95892501810057)
-    assert mock_sleep.call_count == 1
-    assert mock_sleep.call_args[0][0] == 1
+    assert mock_rate_limiter.acquire.call_count == 2
     assert mock_get.call_count == 2
     assert mock_get.call_args[0][0] == NOMINATIM_ENDPOINT
     assert mock_get.call_args[1]["params"] == {
@@ -47,20 +76,19 @@ def test_coords_from_address(mock_response: Mock, no_cache: None) -> None:
     assert mock_get.call_args[1]["timeout"] == REQUEST_TIMEOUT
 
 
-def test_coords_from_address_uses_cache(mock_response: Mock, tmp_path: Path) -> None:
-    cache_file_path = tmp_path / "cache.json"
-    with patch("within.nominatim.CACHE_FILE_PATH", cache_file_path):
-        with patch("within.nominatim.sleep") as mock_sleep:
-            with patch("within.nominatim.requests.get") as mock_get:
-                mock_get.return_value = mock_response
-                # saves to cache
-                resp = coords_from_addresses(["1071 5th Ave, New York", "Guggenheim"])
-                # reads from cache
-                resp2 = coords_from_addresses(["1071 5th Ave, New York", "Guggenheim"])
+def test_coords_from_address_uses_cache(
+    mock_response: Mock, mock_rate_limiter: Mock, cache_paths: Path
+) -> None:
+    with patch("within.nominatim.requests.Session.get") as mock_get:
+        mock_get.return_value = mock_response
+        # saves to cache
+        resp = coords_from_addresses(["1071 5th Ave, New York", "Guggenheim"])
+        # reads from cache
+        resp2 = coords_from_addresses(["1071 5th Ave, New York", "Guggenheim"])
     assert resp == resp2
     assert resp[0] == resp[1] == (40.7829932, -73.95892501810057)
-    assert mock_sleep.call_count == 1  # Should not be called when reading from cache
-    assert mock_sleep.call_args[0][0] == 1
+    # Should not be rate limited when reading from cache
+    assert mock_rate_limiter.acquire.call_count == 2
     assert mock_get.call_count == 2  # Not 4 since the last 2 were cached
     assert mock_get.call_args[0][0] == NOMINATIM_ENDPOINT
     assert mock_get.call_args[1]["params"] == {
@@ -71,10 +99,251 @@ def test_coords_from_address_uses_cache(mock_response: Mock, tmp_path: Path) ->
     }
     assert mock_get.call_args[1]["timeout"] == REQUEST_TIMEOUT
     # Check what was written to cache
-    assert cache_file_path.exists()
-    with cache_file_path.open("r") as fh:
-        cached_data = json.load(fh)
-    assert cached_data == {
-        "1071 5th Ave, New York": mock_response.json.return_value,
-        "Guggenheim": mock_response.json.return_value,
+    cache = SQLiteCache(cache_paths / "cache.sqlite3")
+    assert len(cache) == 2
+    assert cache.get("1071 5th ave new york") == mock_response.json.return_value
+    assert cache.get("guggenheim") == mock_response.json.return_value
+
+
+def test_coords_from_address_migrates_json_cache(cache_paths: Path) -> None:
+    legacy_data = {
+        # Different spellings of the same key: the hit wins over the miss
+        "guggenheim": [],
+        "Guggenheim": [{"lat": 40.7829932, "lon": -73.95892501810057}],
+        "Nowhere": [],
     }
+    with (cache_paths / "cache.json").open("w") as fh:
+        json.dump(legacy_data, fh)
+    with patch("within.nominatim.requests.Session.get") as mock_get:
+        resp = coords_from_addresses(["Guggenheim", "Nowhere"])
+    assert resp == [(40.7829932, -73.95892501810057), None]
+    assert mock_get.call_count == 0
+    cache = SQLiteCache(cache_paths / "cache.sqlite3")
+    assert cache.get_with_ttl("guggenheim") == (legacy_data["Guggenheim"], None)
+    # Legacy misses are retried like new ones
+    entry = cache.get_with_ttl("nowhere")
+    assert entry is not None and entry[0] == []
+    assert entry[1] == pytest.approx(nominatim.NEGATIVE_CACHE_TTL, abs=60)
+
+
+def test_coords_from_address_memory_cache(
+    mock_response: Mock, mock_rate_limiter: Mock, cache_paths: Path
+) -> None:
+    with patch("within.nominatim.requests.Session.get") as mock_get:
+        mock_get.return_value = mock_response
+        coords_from_addresses(["Guggenheim"])
+        stats_before = memory_cache_stats()
+        with patch("within.cache.SQLiteCache.get") as mock_disk_get:
+            coords_from_addresses(["Guggenheim", "Guggenheim"])
+    assert mock_disk_get.call_count == 0
+    stats_after = memory_cache_stats()
+    assert stats_after["hits"] == stats_before["hits"] + 2
+    assert stats_after["misses"] == stats_before["misses"]
+    assert mock_get.call_count == 1
+
+
+def test_coords_from_address_backs_off_on_429(
+    mock_response: Mock, mock_rate_limiter: Mock, no_cache: None
+) -> None:
+    too_many_requests: Mock = create_autospec(Response, instance=True)
+    too_many_requests.status_code = 429
+    too_many_requests.reason = "Too Many Requests"
+    too_many_requests.headers = {"Retry-After": "7"}
+    with patch("within.nominatim.requests.Session.get") as mock_get:
+        mock_get.side_effect = [too_many_requests, mock_response]
+        resp = coords_from_addresses(["Guggenheim"])
+    assert resp == [(40.7829932, -73.95892501810057)]
+    assert mock_rate_limiter.acquire.call_count == 2
+    assert mock_rate_limiter.pause.call_count == 1
+    assert mock_rate_limiter.pause.call_args[0][0] == 7
+
+
+def test_coords_from_address_gives_up_after_retries(
+    mock_rate_limiter: Mock, no_cache: None
+) -> None:
+    timeout: Mock = create_autospec(Response, instance=True)
+    timeout.status_code = 504
+    timeout.reason = "Gateway Timeout"
+    timeout.headers = {}
+    with patch("within.nominatim.requests.Session.get") as mock_get:
+        mock_get.return_value = timeout
+        resp = coords_from_addresses(["Guggenheim"], retry_count=2)
+    assert resp == [None]
+    assert mock_get.call_count == 3
+    assert mock_rate_limiter.pause.call_count == 2
+
+
+def test_set_rate_limit() -> None:
+    with patch("within.nominatim._rate_limiter") as original:
+        set_rate_limit(50, burst=5)
+        assert nominatim._rate_limiter is not original
+        assert nominatim._rate_limiter.rate == 50
+        assert nominatim._rate_limiter.burst == 5
+
+
+def test_bulk_coords_from_addresses(mock_rate_limiter: Mock, no_cache: None) -> None:
+    coords = {"a": (1.0, 1.0), "b": (2.0, 2.0), "c": None}
+    max_concurrency = 2
+    lock = threading.Lock()
+    in_flight: List[int] = [0, 0]  # current, peak
+
+    def fake_coords_from_address(
+        address: str, retry_count: int
+    ) -> Tuple[Optional[Tuple[float, float]], bool]:
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+        if address == "d":
+            raise Exception("Failed")
+        return coords[address], False
+
+    with patch(
+        "within.nominatim._coords_from_address", side_effect=fake_coords_from_address
+    ) as mock_cfa:
+        resp = bulk_coords_from_addresses(
+            ["a", "b", "a", "c", "d", "b"], max_concurrency=max_concurrency
+        )
+    assert resp == [(1.0, 1.0), (2.0, 2.0), (1.0, 1.0), None, None, (2.0, 2.0)]
+    # Duplicates are only requested once
+    assert sorted(call[0][0] for call in mock_cfa.call_args_list) == [
+        "a",
+        "b",
+        "c",
+        "d",
+    ]
+    assert 1 <= in_flight[1] <= max_concurrency
+
+
+def test_configure_session() -> None:
+    with patch("within.nominatim._session", None):
+        with patch("within.nominatim.NOMINATIM_ENDPOINT"):
+            with patch("within.nominatim.POOL_SIZE"):
+                session = nominatim._get_session()
+                # Reused across requests
+                assert nominatim._get_session() is session
+                configure_session("http://localhost:8080/search", pool_size=32)
+                assert nominatim.NOMINATIM_ENDPOINT == "http://localhost:8080/search"
+                new_session = nominatim._get_session()
+                assert new_session is not session
+                adapter = new_session.get_adapter("http://localhost:8080/search")
+                assert isinstance(adapter, HTTPAdapter)
+                assert adapter._pool_maxsize == 32  # type: ignore[attr-defined]
+                assert new_session.headers["User-Agent"] == "Toy street routing project"
+
+
+def test_concurrent_lookups_share_one_request(
+    mock_response: Mock, mock_rate_limiter: Mock, cache_paths: Path
+) -> None:
+    release = threading.Event()
+
+    def slow_get(*args: object, **kwargs: object) -> Mock:
+        release.wait(timeout=5)
+        return mock_response
+
+    with patch(
+        "within.nominatim.requests.Session.get", side_effect=slow_get
+    ) as mock_get:
+        with patch(
+            "within.nominatim._write_cache", wraps=nominatim._write_cache
+        ) as mock_write:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                futures = [
+                    executor.submit(coords_from_addresses, ["Guggenheim"])
+                    for _ in range(4)
+                ]
+                sleep(0.1)  # let every caller join the in-flight request
+                release.set()
+                results = [future.result() for future in futures]
+    assert results == [[(40.7829932, -73.95892501810057)]] * 4
+    assert mock_get.call_count == 1
+    assert mock_write.call_count == 1
+
+
+@pytest.mark.parametrize(
+    "address",
+    [
+        "1071 5th Ave, New York",
+        "1071 5th ave new york",
+        "  1071  5TH AVE., NEW YORK ",
+        "１０７１ 5th Ave; New York",  # full width digits
+    ],
+)
+def test_normalize_query(address: str) -> None:
+    assert normalize_query(address) == "1071 5th ave new york"
+
+
+def test_coords_from_address_normalized_cache_hit(
+    mock_response: Mock, mock_rate_limiter: Mock, cache_paths: Path
+) -> None:
+    with patch("within.nominatim.requests.Session.get") as mock_get:
+        mock_get.return_value = mock_response
+        resp = coords_from_addresses(["1071 5th Ave, New York"])
+        resp2 = coords_from_addresses(["1071 5th ave new york"])
+        resp3 = bulk_coords_from_addresses(["Guggenheim museum", "guggenheim, MUSEUM"])
+    assert resp == resp2
+    assert resp3[0] == resp3[1]
+    assert mock_get.call_count == 2
+    assert mock_get.call_args[1]["params"]["q"] == "Guggenheim museum"
+
+
+def test_coords_from_address_negative_cache(
+    mock_response: Mock, mock_rate_limiter: Mock, cache_paths: Path
+) -> None:
+    mock_response.json.return_value = []
+    with patch("within.nominatim.requests.Session.get") as mock_get:
+        mock_get.return_value = mock_response
+        with patch("within.cache.time", return_value=1000.0):
+            assert coords_from_addresses(["Nowhere"]) == [None]
+        nominatim._memory_cache.clear()
+        # Still cached on disk within the negative TTL
+        with patch("within.cache.time", return_value=1000.0 + 3600):
+            assert coords_from_addresses(["Nowhere"]) == [None]
+        assert mock_get.call_count == 1
+        nominatim._memory_cache.clear()
+        with patch(
+            "within.cache.time",
+            return_value=1000.0 + nominatim.NEGATIVE_CACHE_TTL,
+        ):
+            assert coords_from_addresses(["Nowhere"]) == [None]
+        assert mock_get.call_count == 2
+
+
+def test_coords_from_address_caches_failures(
+    mock_rate_limiter: Mock, cache_paths: Path
+) -> None:
+    not_a_list: Mock = create_autospec(Response, instance=True)
+    not_a_list.status_code = 200
+    not_a_list.json.return_value = {"error": "Unexpected"}
+    with patch("within.nominatim.requests.Session.get") as mock_get:
+        mock_get.return_value = not_a_list
+        assert coords_from_addresses(["Junk", "Junk"]) == [None, None]
+    assert mock_get.call_count == 1
+    store = SQLiteCache(cache_paths / "cache.sqlite3")
+    assert store.get("junk") == []
+
+
+def test_coords_from_address_failure_ttl_from_store(
+    mock_response: Mock, mock_rate_limiter: Mock, cache_paths: Path
+) -> None:
+    # Written by another process, or before a restart
+    with patch("within.cache.time", return_value=1000.0):
+        nominatim._get_cache_store().set("junk", [], ttl_s=nominatim.FAILURE_CACHE_TTL)
+    with patch("within.nominatim.requests.Session.get") as mock_get:
+        mock_get.return_value = mock_response
+        with patch("within.cache.time", return_value=1000.0 + 60):
+            with patch("within.cache.monotonic", return_value=0.0):
+                assert coords_from_addresses(["Junk"]) == [None]
+        assert mock_get.call_count == 0
+        # The memory copy expires with the store entry, not a day later
+        with patch(
+            "within.cache.time", return_value=1000.0 + nominatim.FAILURE_CACHE_TTL
+        ):
+            with patch(
+                "within.cache.monotonic",
+                return_value=nominatim.FAILURE_CACHE_TTL - 60.0,
+            ):
+                assert coords_from_addresses(["Junk"]) != [None]
+        assert mock_get.call_count == 1
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from typing import Iterator, List
+from unittest.mock import patch
+
+import pytest
+
+from within.rate_limit import TokenBucket, backoff_delay, parse_retry_after
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.sleeps: List[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock() -> Iterator[FakeClock]:
+    fake_clock = FakeClock()
+    with patch("within.rate_limit.monotonic", fake_clock.monotonic):
+        with patch("within.rate_limit.sleep", fake_clock.sleep):
+            yield fake_clock
+
+
+def test_token_bucket_paces_requests(clock: FakeClock) -> None:
+    bucket = TokenBucket(rate=2, burst=1)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0.5
+    # Time spent in flight counts towards the next slot
+    clock.now += 0.3
+    assert round(bucket.acquire(), 6) == 0.2
+    # Idle time refills up to burst only
+    clock.now += 10
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0.5
+
+
+def test_token_bucket_burst(clock: FakeClock) -> None:
+    bucket = TokenBucket(rate=1, burst=3)
+    assert [bucket.acquire() for _ in range(4)] == [0, 0, 0, 1]
+
+
+def test_token_bucket_pause(clock: FakeClock) -> None:
+    bucket = TokenBucket(rate=10, burst=1)
+    bucket.acquire()
+    bucket.pause(5)
+    bucket.pause(1)  # Does not shorten an existing pause
+    assert round(bucket.acquire(), 6) == 5
+
+
+def test_token_bucket_pause_spreads_callers(clock: FakeClock) -> None:
+    bucket = TokenBucket(rate=1, burst=1)
+    bucket.acquire()
+    bucket.pause(5)
+    # The first caller arriving during the pause is sent when it ends and the
+    # rest one slot apart after it
+    waits = []
+    for arrival in (0, 1, 2, 2):
+        clock.now = arrival
+        waits.append(clock.now + bucket.acquire())
+    assert waits == [5, 6, 7, 8]
+
+
+def test_token_bucket_pause_keeps_reservations(clock: FakeClock) -> None:
+    bucket = TokenBucket(rate=1, burst=1)
+    for _ in range(3):
+        bucket.acquire()
+    # The callers holding the slots at 1 and 2 s are still asleep. Slots
+    # reserved beyond the end of the pause are not given out again.
+    clock.now = 0
+    bucket.pause(1)
+    assert bucket.acquire() == 3
+
+
+def test_parse_retry_after() -> None:
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("120") == 120
+    assert parse_retry_after("not a date") is None
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    seconds = parse_retry_after(format_datetime(retry_at, usegmt=True))
+    assert seconds is not None and 28 <= seconds <= 30
+    past = datetime.now(timezone.utc) - timedelta(seconds=30)
+    assert parse_retry_after(format_datetime(past, usegmt=True)) == 0
+
+
+def test_backoff_delay() -> None:
+    with patch("within.rate_limit.random.uniform", side_effect=lambda a, b: b):
+        assert backoff_delay(0, base=1, cap=60) == 1
+        assert backoff_delay(3, base=1, cap=60) == 8
+        assert backoff_delay(10, base=1, cap=60) == 60
+        assert backoff_delay(0, base=1, cap=60, retry_after="20") == 20
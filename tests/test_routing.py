@@ -1,10 +1,20 @@
 # TODO: mock API calls
 
 
+from math import isnan
+from pathlib import Path
+from unittest.mock import patch
+
 import pytest
+from networkx import MultiDiGraph
 
 from within.address import Address
-from within.routing import Route, Routing
+from within.graph_cache import add_travel_times
+from within.network import RegionalNetwork, StreetNetwork
+from within.routing import DESTINATION_NODE_ID, ORIGIN_NODE_ID, Route, Routing
+from within.spherical_geometry import get_bearings
+
+from .conftest import GRID_ORIGIN, GRID_SPACING, grid_address, grid_node_id
 
 
 @pytest.fixture
@@ -28,6 +38,27 @@ def test_route_as_the_crow_flies_distance_km(
     assert round(routing.as_the_crow_flies_distance_km, 3) == 5.465
 
 
+def test_routing_resolves_addresses_together(
+    starting_point: Address, destination: Address
+) -> None:
+    routing = Routing(
+        starting_point=starting_point,
+        destination=destination,
+        transport_mode="walk",
+    )
+    with patch("within.routing.resolve_addresses") as mock_resolve:
+        routing.as_the_crow_flies_distance_km
+    assert mock_resolve.call_args[0][0] == [starting_point, destination]
+
+
+def test_routing_use_corridor(starting_point: Address, destination: Address) -> None:
+    routing = Routing(starting_point, destination, "walk")
+    assert not routing.use_corridor
+    assert Routing(starting_point, destination, "walk", use_corridor=True).use_corridor
+    far_away = Address("Philadelphia", (39.9526, -75.1652))
+    assert Routing(starting_point, far_away, "drive").use_corridor
+
+
 def test_midway_coordinate(starting_point: Address, destination: Address) -> None:
     routing = Routing(
         starting_point=starting_point,
@@ -54,3 +85,255 @@ def test_routing_shortest_routes(starting_point: Address, destination: Address)
         route.description[-1] == "Arriving at your destination."
         for route in shortest_routes
     )
+
+
+def test_routing_shared_region(region: RegionalNetwork) -> None:
+    with patch("within.routing.load_graph") as mock_load_graph:
+        routing = Routing(grid_address(0, 0), grid_address(2, 3), "walk", region=region)
+        other_routing = Routing(
+            grid_address(1, 1), grid_address(0, 4), "walk", region=region
+        )
+        routes = routing.shortest_routes(2)
+        other_routes = other_routing.shortest_routes(1)
+    assert mock_load_graph.call_count == 0
+    assert routing.street_network is other_routing.street_network
+    assert routes[0].node_idx[0] == grid_node_id(0, 0)
+    assert routes[0].node_idx[-1] == grid_node_id(2, 3)
+    assert len(routes[0].node_idx) == 6
+    assert routes[0].total_length_m <= routes[1].total_length_m
+    assert routes[0].description[0].startswith("Head ")
+    assert routes[0].description[-1] == "Arriving at your destination."
+    assert other_routes[0].node_idx[0] == grid_node_id(1, 1)
+
+
+def test_routing_snap_distances(region: RegionalNetwork) -> None:
+    # 22 m south of 1 Street, to 8 m west of 4 Avenue
+    routing = Routing(
+        grid_address(-0.2, 0.5), grid_address(2.5, 2.9), "walk", region=region
+    )
+    assert routing.snap_distances_m == pytest.approx((22.2, 8.4), abs=0.1)
+
+
+def test_routing_mid_block(region: RegionalNetwork) -> None:
+    # Half way along 1 Street between 1 and 2 Avenue, to a quarter of the way up
+    # 4 Avenue from 3 Street
+    starting_point = Address(
+        "1 Street", (GRID_ORIGIN[0], GRID_ORIGIN[1] + 0.5 * GRID_SPACING)
+    )
+    destination = Address(
+        "4 Avenue",
+        (GRID_ORIGIN[0] + 2.25 * GRID_SPACING, GRID_ORIGIN[1] + 3 * GRID_SPACING),
+    )
+    routing = Routing(starting_point, destination, "walk", region=region)
+    route = routing.shortest_routes(1)[0]
+    assert route.node_idx[0] == ORIGIN_NODE_ID
+    assert route.node_idx[1] == grid_node_id(0, 1)
+    assert route.node_idx[-2] == grid_node_id(2, 3)
+    assert route.node_idx[-1] == DESTINATION_NODE_ID
+    assert route.nodes[ORIGIN_NODE_ID]["x"] == pytest.approx(starting_point.longitude)
+    assert route.nodes[ORIGIN_NODE_ID]["y"] == pytest.approx(starting_point.latitude)
+    first_edge = route.edges[(ORIGIN_NODE_ID, grid_node_id(0, 1))]
+    assert first_edge["name"] == "1 Street"
+    assert first_edge["length"] == pytest.approx(0.5 * 84.3, rel=0.01)
+    assert route.edges[(grid_node_id(2, 3), DESTINATION_NODE_ID)][
+        "length"
+    ] == pytest.approx(0.25 * 111.2, rel=0.01)
+    assert route.total_length_m == pytest.approx(2.5 * 84.3 + 2.25 * 111.2, rel=0.01)
+    assert route.description[0].startswith("Head E on 1 Street")
+    assert route.description[-1] == "Arriving at your destination."
+    assert routing.snap_distances_m == pytest.approx((0, 0), abs=0.01)
+    # The hierarchy finds the same route
+    region.prepare_contraction_hierarchies("length")
+    hierarchy_route = Routing(
+        starting_point, destination, "walk", region=region
+    ).shortest_routes(1)[0]
+    assert hierarchy_route.node_idx == route.node_idx
+
+
+def test_routing_same_block(region: RegionalNetwork) -> None:
+    starting_point = Address(
+        "1 Street", (GRID_ORIGIN[0], GRID_ORIGIN[1] + 0.8 * GRID_SPACING)
+    )
+    destination = Address(
+        "1 Street", (GRID_ORIGIN[0], GRID_ORIGIN[1] + 0.2 * GRID_SPACING)
+    )
+    routes = Routing(
+        starting_point, destination, "walk", region=region
+    ).shortest_routes(2)
+    assert routes[0].node_idx == [ORIGIN_NODE_ID, DESTINATION_NODE_ID]
+    assert routes[0].total_length_m == pytest.approx(0.6 * 84.3, rel=0.01)
+    assert routes[0].description == [
+        "Head W on 1 Street and continue for 51 m",
+        "Arriving at your destination.",
+    ]
+
+
+def test_routing_parallel_edges(street_graph: MultiDiGraph) -> None:
+    # A short cut next to 1 Street between 2 and 3 Avenue
+    node_a, node_b = grid_node_id(0, 1), grid_node_id(0, 2)
+    street_graph.add_edge(node_a, node_b, length=50.0, name="Short Cut")
+    with patch("within.routing.load_graph") as mock_load_graph:
+        mock_load_graph.return_value = street_graph
+        route = Routing(grid_address(0, 0), grid_address(0, 3), "walk").shortest_routes(
+            1
+        )[0]
+    assert route.edge_keys == [
+        (grid_node_id(0, 0), node_a, 0),
+        (node_a, node_b, 1),
+        (node_b, grid_node_id(0, 3), 0),
+    ]
+    assert route.edges[(node_a, node_b)] == {"length": 50.0, "name": "Short Cut"}
+    assert route.total_length_m == pytest.approx(50 + 2 * 84.3, rel=0.01)
+    serialized = route.to_dict()
+    assert serialized["node_ids"] == route.node_idx
+    assert serialized["streets"] == ["1 Street", "Short Cut", "1 Street"]
+    assert sum(serialized["lengths"]) == pytest.approx(route.total_length_m)
+
+
+def test_route_derived_fields_cached(street_graph: MultiDiGraph) -> None:
+    del street_graph.edges[grid_node_id(0, 0), grid_node_id(1, 0), 0]["name"]
+    with patch("within.routing.load_graph") as mock_load_graph:
+        mock_load_graph.return_value = street_graph
+        route = Routing(grid_address(0, 0), grid_address(2, 2), "walk").shortest_routes(
+            1
+        )[0]
+    with patch("within.routing.get_bearings", wraps=get_bearings) as mock_bearings:
+        description = route.description
+        assert route.description is description
+    # All bearings of the route in one vectorized call
+    assert mock_bearings.call_count == 1
+    assert route.lengths.shape == (len(route.node_idx) - 1,)
+    assert route.path_coordinates[0] == {"lat": GRID_ORIGIN[0], "lon": GRID_ORIGIN[1]}
+    assert route.total_length_m == pytest.approx(2 * 84.3 + 2 * 111.2, rel=0.01)
+    assert isnan(route.total_travel_time_s)
+    assert route.streets == ["unnamed street", "1 Avenue", "3 Street", "3 Street"]
+
+
+def test_routing_outside_region(region: RegionalNetwork) -> None:
+    routing = Routing(
+        grid_address(0, 0),
+        Address("Philadelphia", (39.9526, -75.1652)),
+        "walk",
+        region=region,
+    )
+    with pytest.raises(AssertionError, match="outside the routing region"):
+        routing.shortest_routes(1)
+
+
+def test_routing_downloads_network(street_graph: MultiDiGraph) -> None:
+    with patch("within.routing.load_graph") as mock_load_graph:
+        mock_load_graph.return_value = street_graph
+        routing = Routing(grid_address(0, 0), grid_address(2, 3), "walk")
+        routes = routing.shortest_routes(1)
+    assert mock_load_graph.call_count == 1
+    assert mock_load_graph.call_args[0][2] == "walk"
+    assert routes[0].node_idx[-1] == grid_node_id(2, 3)
+    # The networkx graph is dropped unless asked for
+    assert routing.network is None
+
+
+def test_routing_keep_graph(street_graph: MultiDiGraph) -> None:
+    with patch("within.routing.load_graph") as mock_load_graph:
+        mock_load_graph.return_value = street_graph
+        routing = Routing(
+            grid_address(0, 0), grid_address(2, 3), "walk", keep_graph=True
+        )
+        network = routing.network
+    assert network is not None and set(network.nodes) == set(street_graph.nodes)
+
+
+def test_routing_snapshot(street_graph: MultiDiGraph, tmp_path: Path) -> None:
+    StreetNetwork(street_graph, transport_mode="walk").save_snapshot(tmp_path)
+    with patch("within.routing.load_graph") as mock_load_graph:
+        routing = Routing(
+            grid_address(0, 0), grid_address(2, 3), "walk", snapshot=tmp_path
+        )
+        routes = routing.shortest_routes(2)
+    assert mock_load_graph.call_count == 0
+    assert routing.network is None
+    assert routes[0].node_idx[-1] == grid_node_id(2, 3)
+    first_edge = routes[0].edges[(routes[0].node_idx[0], routes[0].node_idx[1])]
+    assert first_edge["name"] in ("1 Street", "1 Avenue")
+    assert 80 < first_edge["length"] < 120
+    assert routes[0].description[-1] == "Arriving at your destination."
+
+
+def test_routing_snapshot_mismatch(street_graph: MultiDiGraph, tmp_path: Path) -> None:
+    StreetNetwork(street_graph, transport_mode="walk").save_snapshot(tmp_path)
+    routing = Routing(
+        grid_address(0, 0), grid_address(2, 3), "drive", snapshot=tmp_path
+    )
+    with pytest.raises(AssertionError, match="walk network, not drive"):
+        routing.shortest_routes(1)
+    routing = Routing(
+        grid_address(0, 0),
+        Address("Philadelphia", (39.9526, -75.1652)),
+        "walk",
+        snapshot=tmp_path,
+    )
+    with pytest.raises(AssertionError, match="Philadelphia is outside the snapshot"):
+        routing.shortest_routes(1)
+
+
+def test_routing_contraction_hierarchy(region: RegionalNetwork) -> None:
+    region.prepare_contraction_hierarchies("length")
+    routing = Routing(grid_address(0, 0), grid_address(2, 3), "walk", region=region)
+    with patch("within.routing.bidirectional_astar") as mock_astar:
+        routes = routing.shortest_routes(1)
+    assert mock_astar.call_count == 0
+    assert routes[0].node_idx[0] == grid_node_id(0, 0)
+    assert routes[0].node_idx[-1] == grid_node_id(2, 3)
+    assert len(routes[0].node_idx) == 6
+    assert routes[0].total_length_m == pytest.approx(5 * 100, rel=0.2)
+    assert routes[0].description[-1] == "Arriving at your destination."
+
+
+def test_routing_travel_time(street_graph: MultiDiGraph) -> None:
+    # 2 Street is a motorway: a detour over it beats 1 Street for time
+    for u, v, data in street_graph.edges(data=True):
+        if data["name"] == "2 Street":
+            data["highway"] = "motorway"
+    add_travel_times(street_graph, "drive")
+    with patch("within.routing.load_graph") as mock_load_graph:
+        mock_load_graph.return_value = street_graph
+        fastest = Routing(
+            grid_address(0, 0), grid_address(0, 4), "drive", weight_by="travel_time"
+        ).shortest_routes(1)[0]
+        shortest = Routing(
+            grid_address(0, 0), grid_address(0, 4), "drive"
+        ).shortest_routes(1)[0]
+    assert len(shortest.node_idx) == 5
+    assert len(fastest.node_idx) == 7
+    assert fastest.total_length_m > shortest.total_length_m
+    assert shortest.total_travel_time_s == pytest.approx(4 * 84.3 / (30 / 3.6), 0.01)
+    assert fastest.total_travel_time_s == pytest.approx(
+        4 * 84.3 / (100 / 3.6) + 2 * 111.2 / (60 / 3.6), 0.01
+    )
+
+
+def test_routing_without_travel_times(region: RegionalNetwork) -> None:
+    routing = Routing(
+        grid_address(0, 0),
+        grid_address(2, 3),
+        "walk",
+        region=region,
+        weight_by="travel_time",
+    )
+    with pytest.raises(AssertionError, match="no travel_time"):
+        routing.shortest_routes(1)
+    route = Routing(
+        grid_address(0, 0), grid_address(2, 3), "walk", region=region
+    ).shortest_routes(1)[0]
+    assert isnan(route.total_travel_time_s)
+
+
+def test_routing_corridor_network(street_graph: MultiDiGraph) -> None:
+    with patch("within.routing.load_corridor_graph") as mock_load_corridor:
+        mock_load_corridor.return_value = street_graph
+        routing = Routing(
+            grid_address(0, 0), grid_address(2, 3), "walk", use_corridor=True
+        )
+        routing.shortest_routes(1)
+    start, end, transport_mode = mock_load_corridor.call_args[0]
+    assert start == (GRID_ORIGIN[0], GRID_ORIGIN[1])
+    assert transport_mode == "walk"
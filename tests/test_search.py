@@ -0,0 +1,297 @@
+from unittest.mock import patch
+
+import networkx
+import pytest
+from networkx import MultiDiGraph
+
+from within.compact_graph import CompactGraph
+from within.search import (
+    EndpointT,
+    LinkT,
+    alternative_paths,
+    bidirectional_astar,
+    dijkstra_costs,
+    end_links,
+    path_cost,
+)
+
+from .conftest import grid_node_id
+
+
+@pytest.fixture
+def graph(street_graph: MultiDiGraph) -> CompactGraph:
+    return CompactGraph.from_networkx(street_graph)
+
+
+def _node_ids(graph: CompactGraph, nodes: list[int]) -> list[int]:
+    return [int(node_id) for node_id in graph.node_ids[nodes]]
+
+
+def _edge(graph: CompactGraph, node_a: int, node_b: int) -> int:
+    node, next_node = graph.index_of(node_a), graph.index_of(node_b)
+    for edge in range(graph.offsets[node], graph.offsets[node + 1]):
+        if graph.targets[edge] == next_node:
+            return edge
+    raise AssertionError("no such edge")
+
+
+def _street_endpoint(
+    graph: CompactGraph, node_a: int, node_b: int, fraction: float
+) -> EndpointT:
+    """End point fraction of the way from node_a to node_b on a two-way street"""
+    forward, backward = _edge(graph, node_a, node_b), _edge(graph, node_b, node_a)
+    node_a, node_b = graph.index_of(node_a), graph.index_of(node_b)
+    return EndpointT(
+        float(
+            (1 - fraction) * graph.latitudes[node_a]
+            + fraction * graph.latitudes[node_b]
+        ),
+        float(
+            (1 - fraction) * graph.longitudes[node_a]
+            + fraction * graph.longitudes[node_b]
+        ),
+        (LinkT(node_b, forward, 1 - fraction), LinkT(node_a, backward, fraction)),
+        (LinkT(node_a, forward, fraction), LinkT(node_b, backward, 1 - fraction)),
+    )
+
+
+def test_dijkstra_costs(street_graph: MultiDiGraph, graph: CompactGraph) -> None:
+    source = graph.index_of(grid_node_id(0, 0))
+    near = graph.index_of(grid_node_id(0, 1))
+    every = dijkstra_costs(graph, {source: 0.0}, "length")
+    expected = networkx.single_source_dijkstra_path_length(
+        street_graph, grid_node_id(0, 0), weight="length"
+    )
+    assert {graph.node_ids[node]: cost for node, cost in every.items()} == (
+        pytest.approx(expected)
+    )
+    early = dijkstra_costs(graph, {source: 0.0}, "length", {near})
+    assert early[near] == pytest.approx(every[near])
+    assert len(early) < len(every)
+    assert dijkstra_costs(graph, {source: 10.0}, "length", {near})[near] == (
+        pytest.approx(every[near] + 10)
+    )
+    bounded = dijkstra_costs(graph, {source: 0.0}, "length", max_cost=200)
+    assert bounded == {node: cost for node, cost in every.items() if cost <= 200}
+
+
+def test_dijkstra_costs_unreachable(street_graph: MultiDiGraph) -> None:
+    street_graph.add_node(9999, y=40.0, x=-74.0)
+    graph = CompactGraph.from_networkx(street_graph)
+    unreachable = graph.index_of(9999)
+    assert unreachable not in dijkstra_costs(graph, {0: 0.0}, "length", {unreachable})
+
+
+@pytest.mark.parametrize(
+    "source_cell, target_cell",
+    [((0, 0), (5, 5)), ((2, 3), (2, 4)), ((5, 0), (1, 4)), ((3, 3), (3, 3))],
+)
+def test_bidirectional_astar(
+    graph: CompactGraph,
+    source_cell: tuple[int, int],
+    target_cell: tuple[int, int],
+) -> None:
+    source = graph.index_of(grid_node_id(*source_cell))
+    target = graph.index_of(grid_node_id(*target_cell))
+    path = bidirectional_astar(graph, source, target, "length")
+    expected = dijkstra_costs(graph, {source: 0.0}, "length", {target})
+    assert path is not None
+    assert path.cost == pytest.approx(expected[target])
+    assert path.nodes[0] == source and path.nodes[-1] == target
+    assert len(path.edges) == len(path.nodes) - 1
+    for node, next_node, edge in zip(path.nodes, path.nodes[1:], path.edges):
+        assert graph.offsets[node] <= edge < graph.offsets[node + 1]
+        assert graph.targets[edge] == next_node
+    assert float(graph.lengths[path.edges].sum()) == pytest.approx(path.cost)
+
+
+def test_bidirectional_astar_travel_time(street_graph: MultiDiGraph) -> None:
+    # Avenues are twice as fast as streets
+    for u, v, data in street_graph.edges(data=True):
+        speed = 20 if data["highway"] == "primary" else 10
+        data["travel_time"] = data["length"] / speed
+    graph = CompactGraph.from_networkx(street_graph)
+    for source_cell, target_cell in (((0, 0), (5, 5)), ((4, 1), (0, 3))):
+        source = graph.index_of(grid_node_id(*source_cell))
+        target = graph.index_of(grid_node_id(*target_cell))
+        path = bidirectional_astar(graph, source, target, "travel_time")
+        expected = networkx.shortest_path_length(
+            street_graph,
+            grid_node_id(*source_cell),
+            grid_node_id(*target_cell),
+            weight="travel_time",
+        )
+        assert path is not None
+        assert path.cost == pytest.approx(expected)
+
+
+def test_bidirectional_astar_no_heuristic(street_graph: MultiDiGraph) -> None:
+    for _, _, data in street_graph.edges(data=True):
+        data["travel_time"] = 1.0
+    graph = CompactGraph.from_networkx(street_graph)
+    source, target = graph.index_of(grid_node_id(0, 0)), graph.index_of(
+        grid_node_id(4, 2)
+    )
+    with patch.object(graph, "max_speed", return_value=0.0):
+        path = bidirectional_astar(graph, source, target, "travel_time")
+    assert path is not None
+    assert path.cost == 6
+
+
+def test_bidirectional_astar_unreachable(street_graph: MultiDiGraph) -> None:
+    street_graph.add_node(9999, y=40.0, x=-74.0)
+    graph = CompactGraph.from_networkx(street_graph)
+    assert bidirectional_astar(graph, 0, graph.index_of(9999), "length") is None
+
+
+def test_bidirectional_astar_endpoints(graph: CompactGraph) -> None:
+    block_m = float(graph.lengths[_edge(graph, grid_node_id(0, 0), grid_node_id(0, 1))])
+    # A quarter along 1 Street from 1 Avenue to the corner of 4 Avenue, and back
+    source = _street_endpoint(graph, grid_node_id(0, 0), grid_node_id(0, 1), 0.25)
+    corner = graph.index_of(grid_node_id(0, 3))
+    path = bidirectional_astar(graph, source, corner, "length")
+    assert path is not None
+    assert path.cost == pytest.approx(2.75 * block_m)
+    assert _node_ids(graph, path.nodes) == [grid_node_id(0, col) for col in (1, 2, 3)]
+    assert path.edges == [
+        _edge(graph, grid_node_id(0, 1), grid_node_id(0, 2)),
+        _edge(graph, grid_node_id(0, 2), grid_node_id(0, 3)),
+    ]
+    back = bidirectional_astar(graph, corner, source, "length")
+    assert back is not None
+    assert back.cost == pytest.approx(path.cost)
+    assert back.nodes == path.nodes[::-1]
+
+    # Between points on different streets the cost includes both partial edges,
+    # the longer part of 1 Street being on the way
+    target = _street_endpoint(graph, grid_node_id(3, 4), grid_node_id(4, 4), 0.5)
+    path = bidirectional_astar(graph, source, target, "length")
+    corner, other_corner = graph.index_of(grid_node_id(0, 1)), graph.index_of(
+        grid_node_id(3, 4)
+    )
+    between = dijkstra_costs(graph, {corner: 0.0}, "length", {other_corner})
+    assert path is not None
+    avenue_block_m = float(
+        graph.lengths[_edge(graph, grid_node_id(3, 4), grid_node_id(4, 4))]
+    )
+    assert path.cost == pytest.approx(
+        0.75 * block_m + between[other_corner] + 0.5 * avenue_block_m
+    )
+    assert path_cost(
+        path, source, target, graph.adjacency("length")[2]
+    ) == pytest.approx(path.cost)
+    source_link, target_link = end_links(
+        path, source, target, graph.adjacency("length")[2]
+    )
+    assert source_link.node == path.nodes[0] == graph.index_of(grid_node_id(0, 1))
+    assert target_link.node == path.nodes[-1] == graph.index_of(grid_node_id(3, 4))
+
+
+@pytest.mark.parametrize(
+    "source_fraction, target_fraction", [(0.25, 0.75), (0.75, 0.25)]
+)
+def test_bidirectional_astar_same_edge(
+    graph: CompactGraph, source_fraction: float, target_fraction: float
+) -> None:
+    node_a, node_b = grid_node_id(2, 2), grid_node_id(3, 2)
+    source = _street_endpoint(graph, node_a, node_b, source_fraction)
+    target = _street_endpoint(graph, node_a, node_b, target_fraction)
+    path = bidirectional_astar(graph, source, target, "length")
+    assert path is not None
+    assert path.nodes == [] and path.edges == []
+    block_m = float(graph.lengths[_edge(graph, node_a, node_b)])
+    assert path.cost == pytest.approx(0.5 * block_m)
+    assert path_cost(
+        path, source, target, graph.adjacency("length")[2]
+    ) == pytest.approx(path.cost)
+    source_link, target_link = end_links(
+        path, source, target, graph.adjacency("length")[2]
+    )
+    expected_edge = (
+        _edge(graph, node_a, node_b)
+        if source_fraction < target_fraction
+        else _edge(graph, node_b, node_a)
+    )
+    assert source_link.edge == target_link.edge == expected_edge
+
+
+def test_bidirectional_astar_one_way_endpoints(street_graph: MultiDiGraph) -> None:
+    node_a, node_b = grid_node_id(2, 2), grid_node_id(2, 3)
+    street_graph.remove_edge(node_b, node_a)
+    graph = CompactGraph.from_networkx(street_graph)
+    forward = _edge(graph, node_a, node_b)
+    lat = float(graph.latitudes[graph.index_of(node_a)])
+    long = float(graph.longitudes[graph.index_of(node_a)])
+
+    def endpoint(fraction: float) -> EndpointT:
+        return EndpointT(
+            lat,
+            long + fraction * 0.001,
+            (LinkT(graph.index_of(node_b), forward, 1 - fraction),),
+            (LinkT(graph.index_of(node_a), forward, fraction),),
+        )
+
+    # Against the one-way street the route has to go around the block
+    path = bidirectional_astar(graph, endpoint(0.75), endpoint(0.25), "length")
+    assert path is not None
+    assert _node_ids(graph, path.nodes) == [
+        node_b,
+        grid_node_id(3, 3),
+        grid_node_id(3, 2),
+        node_a,
+    ]
+    assert path.cost > 3 * float(graph.lengths[forward])
+    ahead = bidirectional_astar(graph, endpoint(0.25), endpoint(0.75), "length")
+    assert ahead is not None and ahead.nodes == []
+
+
+def test_alternative_paths_endpoints(graph: CompactGraph) -> None:
+    source = _street_endpoint(graph, grid_node_id(0, 0), grid_node_id(0, 1), 0.5)
+    target = _street_endpoint(graph, grid_node_id(4, 4), grid_node_id(4, 5), 0.5)
+    best = bidirectional_astar(graph, source, target, "length")
+    paths = alternative_paths(graph, source, target, 3, "length", max_overlap=0.5)
+    assert best is not None
+    assert len(paths) == 3
+    assert paths[0].cost == pytest.approx(best.cost)
+    for path in paths:
+        assert path_cost(
+            path, source, target, graph.adjacency("length")[2]
+        ) == pytest.approx(path.cost)
+
+
+def test_alternative_paths(graph: CompactGraph) -> None:
+    source, target = graph.index_of(grid_node_id(0, 0)), graph.index_of(
+        grid_node_id(4, 5)
+    )
+    best = dijkstra_costs(graph, {source: 0.0}, "length", {target})[target]
+    paths = alternative_paths(graph, source, target, 3, "length", max_overlap=0.5)
+    assert len(paths) == 3
+    assert paths[0].cost == pytest.approx(best)
+    assert [path.cost for path in paths] == sorted(path.cost for path in paths)
+    pairs = [set(zip(path.nodes, path.nodes[1:])) for path in paths]
+    for idx, path in enumerate(paths):
+        assert path.nodes[0] == source and path.nodes[-1] == target
+        assert float(graph.lengths[path.edges].sum()) == pytest.approx(path.cost)
+        assert path.cost <= 1.5 * best
+        for other_pairs in pairs[:idx]:
+            shared = pairs[idx] & other_pairs
+            assert len(shared) <= 0.5 * len(pairs[idx])
+
+
+def test_alternative_paths_limits(graph: CompactGraph) -> None:
+    source, target = graph.index_of(grid_node_id(0, 0)), graph.index_of(
+        grid_node_id(0, 1)
+    )
+    # Any detour between neighbours is at least three times as long
+    assert len(alternative_paths(graph, source, target, 3, "length")) == 1
+    paths = alternative_paths(graph, source, target, 2, "length", max_stretch=3)
+    assert len(paths) == 2
+    assert len(paths[1].nodes) == 4
+    source = graph.index_of(grid_node_id(5, 5))
+    assert len(alternative_paths(graph, source, source, 3, "length")) == 1
+
+
+def test_alternative_paths_unreachable(street_graph: MultiDiGraph) -> None:
+    street_graph.add_node(9999, y=40.0, x=-74.0)
+    graph = CompactGraph.from_networkx(street_graph)
+    assert alternative_paths(graph, 0, graph.index_of(9999), 3, "length") == []
@@ -0,0 +1,104 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from within.spatial_index import EdgeIndex, NodeIndex, unit_vectors
+from within.spherical_geometry import great_circle_distance
+
+
+def test_unit_vectors() -> None:
+    vectors = unit_vectors([0.0, 0.0, 90.0], [0.0, 90.0, 0.0])
+    assert vectors == pytest.approx(np.eye(3), abs=1e-12)
+    assert unit_vectors(45.0, 45.0).shape == (3,)
+
+
+def test_nearest_matches_brute_force() -> None:
+    rng = np.random.default_rng(0)
+    latitudes = rng.uniform(40.6, 40.8, 500)
+    longitudes = rng.uniform(-74.1, -73.9, 500)
+    index = NodeIndex.build(latitudes, longitudes)
+    query_lats = rng.uniform(40.6, 40.8, 50)
+    query_longs = rng.uniform(-74.1, -73.9, 50)
+    nodes, dist_m = index.nearest(query_lats, query_longs)
+    assert nodes.shape == dist_m.shape == (50,)
+    for lat, long, node, node_dist_m in zip(query_lats, query_longs, nodes, dist_m):
+        distances = [
+            great_circle_distance(lat, long, node_lat, node_long)
+            for node_lat, node_long in zip(latitudes, longitudes)
+        ]
+        assert node == np.argmin(distances)
+        assert node_dist_m == pytest.approx(1000 * min(distances))
+
+
+def test_nearest_across_antimeridian() -> None:
+    index = NodeIndex.build([0.0, 0.0], [179.9, 170.0])
+    nodes, dist_m = index.nearest([0.0], [-179.9])
+    assert nodes.tolist() == [0]
+    assert dist_m[0] == pytest.approx(1000 * great_circle_distance(0, 179.9, 0, -179.9))
+
+
+def test_save_load(tmp_path: Path) -> None:
+    index = NodeIndex.build([40.70, 40.71, 40.72], [-74.0, -74.0, -74.0])
+    index.save(tmp_path / "index.pickle")
+    loaded = NodeIndex.load(tmp_path / "index.pickle")
+    nodes, _ = loaded.nearest([40.712, 40.6], [-74.0, -74.0])
+    assert nodes.tolist() == [1, 0]
+
+
+def test_edge_index_nearest() -> None:
+    # An edge east along latitude 40.7 and one north from its end
+    index = EdgeIndex.build(
+        [0, 2, 4], [40.70, 40.70, 40.70, 40.71], [-74.01, -74.0, -74.0, -74.0]
+    )
+    match = index.nearest([40.7001, 40.705, 40.72], [-74.0075, -73.9999, -74.0])
+    assert match.edges.tolist() == [0, 1, 1]
+    assert match.fractions == pytest.approx([0.25, 0.5, 1.0], abs=1e-3)
+    assert match.latitudes == pytest.approx([40.70, 40.705, 40.71], abs=1e-6)
+    assert match.longitudes == pytest.approx([-74.0075, -74.0, -74.0], abs=1e-6)
+    assert match.dist_m == pytest.approx(
+        [
+            1000 * great_circle_distance(40.7001, -74.0075, 40.70, -74.0075),
+            1000 * great_circle_distance(40.705, -73.9999, 40.705, -74.0),
+            1000 * great_circle_distance(40.72, -74.0, 40.71, -74.0),
+        ],
+        rel=0.01,
+    )
+
+
+def test_edge_index_curved_edges() -> None:
+    # A straight edge and a curved one between the same two points, the
+    # curved one bending north through (40.71, -74.005) with a long first leg
+    index = EdgeIndex.build(
+        [0, 2, 6],
+        [40.70, 40.70, 40.70, 40.709, 40.71, 40.70],
+        [-74.01, -74.0, -74.01, -74.009, -74.005, -74.0],
+    )
+    match = index.nearest([40.7105, 40.7001], [-74.005, -74.005])
+    assert match.edges.tolist() == [1, 0]
+    # Snapped onto the curve, not onto the straight line between its ends
+    assert match.latitudes[0] == pytest.approx(40.71, abs=1e-6)
+    assert match.longitudes[0] == pytest.approx(-74.005, abs=1e-6)
+    assert match.dist_m[0] == pytest.approx(55.6, rel=0.01)
+    # Fractions are of the length along the curve
+    first_m = 1000 * great_circle_distance(40.70, -74.01, 40.709, -74.009)
+    second_m = 1000 * great_circle_distance(40.709, -74.009, 40.71, -74.005)
+    third_m = 1000 * great_circle_distance(40.71, -74.005, 40.70, -74.0)
+    assert match.fractions[0] == pytest.approx(
+        (first_m + second_m) / (first_m + second_m + third_m), rel=0.01
+    )
+    assert match.fractions[1] == pytest.approx(0.5, abs=1e-3)
+
+
+def test_edge_index_save_load(tmp_path: Path) -> None:
+    index = EdgeIndex.build(
+        [0, 2, 5],
+        [40.70, 40.70, 40.70, 40.705, 40.71],
+        [-74.01, -74.0, -74.0, -73.999, -74.0],
+    )
+    index.save(tmp_path / "edge_index")
+    loaded = EdgeIndex.load(tmp_path / "edge_index")
+    assert loaded.reference_latitude == index.reference_latitude
+    queries = ([40.7001, 40.705], [-74.0075, -73.9999])
+    for expected, actual in zip(index.nearest(*queries), loaded.nearest(*queries)):
+        assert np.array_equal(expected, actual)
@@ -1,14 +1,21 @@
 from math import pi
 
+import numpy as np
 import pytest
 
 from within.spherical_geometry import (
+    CARDINAL_DIRECTIONS,
     EARTH_RADIUS,
     get_bearing,
+    get_bearings,
     get_cardinal_direction,
+    get_cardinal_directions,
     get_turning_instruction,
     great_circle_distance,
+    great_circle_distances,
     great_circle_halfway_point,
+    great_circle_halfway_points,
+    great_circle_intermediate_point,
 )
 
 
@@ -17,6 +24,22 @@ def test_great_circle_halfway_point() -> None:
     assert great_circle_halfway_point(89, -90, 89, 90) == (90, 0)
 
 
+def test_great_circle_intermediate_point() -> None:
+    assert great_circle_intermediate_point(0, 0, 0, 90, 0.5) == (0, 45)
+    assert great_circle_intermediate_point(10, 20, 10, 20, 0.5) == (10, 20)
+    start_lat, start_long, end_lat, end_long = 40.750504, -73.993438, 40.7048, -74.0173
+    halfway = great_circle_halfway_point(start_lat, start_long, end_lat, end_long)
+    for fraction, expected in (
+        (0, (start_lat, start_long)),
+        (0.5, halfway),
+        (1, (end_lat, end_long)),
+    ):
+        point = great_circle_intermediate_point(
+            start_lat, start_long, end_lat, end_long, fraction
+        )
+        assert point == pytest.approx(expected)
+
+
 def test_great_circle_distance() -> None:
     quarter_unit_circle_dist = great_circle_distance(0, 0, 0, 90, radius=1)
     assert round(quarter_unit_circle_dist, 10) == round(pi / 2, 10)
@@ -93,3 +116,58 @@ def test_get_turning_instruction(
     next_bearing = start_bearing + turning_degrees
     direction = get_turning_instruction(start_bearing, next_bearing)
     assert direction == exp_direction
+
+
+def test_vectorized_match_scalar() -> None:
+    rng = np.random.default_rng(0)
+    start_lats, end_lats = rng.uniform(-89, 89, (2, 200))
+    start_longs, end_longs = rng.uniform(-180, 180, (2, 200))
+    distances = great_circle_distances(start_lats, start_longs, end_lats, end_longs)
+    bearings = get_bearings(start_lats, start_longs, end_lats, end_longs)
+    mid_lats, mid_longs = great_circle_halfway_points(
+        start_lats, start_longs, end_lats, end_longs
+    )
+    for idx, coords in enumerate(zip(start_lats, start_longs, end_lats, end_longs)):
+        assert distances[idx] == pytest.approx(great_circle_distance(*coords))
+        assert bearings[idx] == pytest.approx(get_bearing(*coords))
+        assert (mid_lats[idx], mid_longs[idx]) == pytest.approx(
+            great_circle_halfway_point(*coords)
+        )
+
+
+def test_vectorized_broadcast() -> None:
+    # One point against a grid of others
+    lats, longs = np.meshgrid([0.0, 10.0, 20.0], [0.0, 30.0])
+    distances = great_circle_distances(0.0, 0.0, lats, longs, radius=1)
+    assert distances.shape == (2, 3)
+    assert distances[0, 0] == 0
+    assert distances[1, 0] == pytest.approx(pi / 6)
+    assert get_bearings(0, 0, [30, 0, -30, 0], [0, 30, 0, -30]).tolist() == [
+        0,
+        90,
+        180,
+        270,
+    ]
+
+
+def test_get_cardinal_directions() -> None:
+    # Including the exact boundaries between directions and values next to them
+    boundaries = np.arange(0.5, 16) * 360 / 16
+    bearings = np.concatenate(
+        [
+            np.arange(0, 360, 0.25),
+            boundaries,
+            np.nextafter(boundaries, 0),
+            np.nextafter(boundaries, 360),
+        ]
+    )
+    assert get_cardinal_direction(11.25) == "NNE"
+    assert get_cardinal_direction(float(np.nextafter(11.25, 0))) == "N"
+    assert get_cardinal_direction(float(np.nextafter(348.75, 0))) == "NNW"
+    assert get_cardinal_direction(348.75) == "N"
+    directions = get_cardinal_directions(bearings)
+    assert directions.shape == bearings.shape
+    assert list(directions) == [get_cardinal_direction(bearing) for bearing in bearings]
+    assert list(get_cardinal_directions(np.arange(16) * 22.5)) == list(
+        CARDINAL_DIRECTIONS
+    )